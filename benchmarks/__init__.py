@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Flat repository:  benchmarks import the root modules, e.g. fillfactor, without survey data.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# findfile defaults.
+os.environ.setdefault('USER', 'bench')
@@ -0,0 +1,53 @@
+import numpy          as np
+
+from   benchmarks     import synthetic
+
+
+class SolveTheta:
+    '''
+    zmax of each galaxy given its theta(z) and faint limit:  gen_zmax_cat.solve_theta, serial and pooled.
+    '''
+    params      = [synthetic.scales(default=[1.e2, 1.e3])]
+    param_names = ['ngal']
+    number      = 1
+    repeat      = 3
+    timeout     = 3600
+
+    def setup(self, ngal):
+        from gen_zmax_cat import theta
+
+        dat         = synthetic.galaxies(ngal)
+
+        self.gmr0p1 = dat['REST_GMR_0P1'].data
+        self.gmr0p0 = dat['REST_GMR_0P0'].data
+        self.thetaz = np.array([theta(z, x, y) for z, x, y in zip(dat['ZSURV'], self.gmr0p1, self.gmr0p0)])
+        self.drs    = 19.8 - dat['DETMAG'].data
+
+    def time_solve_theta(self, ngal):
+        from gen_zmax_cat import solve_theta
+
+        for args in zip(self.gmr0p1, self.gmr0p0, self.thetaz, self.drs):
+            solve_theta(*args)
+
+    def time_zmax(self, ngal):
+        from gen_zmax_cat import zmax
+
+        zmax(self.gmr0p1, self.gmr0p0, self.thetaz, self.drs, debug=False, nproc=2)
+
+class SmithRestGmr:
+    '''
+    Rest-frame g-r of each galaxy given its observed colour and redshift:  rest_gmr.smith_rest_gmr.
+    '''
+    params      = [synthetic.scales(default=[1.e2, 1.e3])]
+    param_names = ['ngal']
+    number      = 1
+    repeat      = 3
+    timeout     = 3600
+
+    def setup(self, ngal):
+        self.dat = synthetic.galaxies(ngal)
+
+    def time_smith_rest_gmr(self, ngal):
+        from rest_gmr import smith_rest_gmr
+
+        smith_rest_gmr(self.dat['ZSURV'].data, self.dat['GMR'].data, debug=False)
@@ -0,0 +1,78 @@
+import numpy          as np
+
+from   benchmarks     import synthetic
+
+
+class Lumfn:
+    '''
+    1/Vmax luminosity function:  lumfn.lumfn.
+    '''
+    params      = [synthetic.scales()]
+    param_names = ['ngal']
+    number      = 1
+    repeat      = 3
+    timeout     = 3600
+
+    def setup(self, ngal):
+        self.dat = synthetic.galaxies(ngal)
+
+    def time_lumfn(self, ngal):
+        from lumfn import lumfn
+
+        lumfn(self.dat)
+
+class LumfnStepwise:
+    '''
+    One iteration of the stepwise (EEP) estimator, i.e. every magnitude bin:  lumfn_stepwise.lumfn_stepwise_eval.
+    '''
+    params      = [synthetic.scales(default=[1.e3, 1.e4])]
+    param_names = ['ngal']
+    number      = 1
+    repeat      = 3
+    timeout     = 3600
+
+    def setup(self, ngal):
+        from schechter import named_schechter
+
+        self.dat    = synthetic.galaxies(ngal)
+
+        self.phi_Ms = np.linspace(-23., -16., 36)
+        self.dM     = np.abs(np.diff(self.phi_Ms)[0])
+        self.phis   = self.dM * named_schechter(self.phi_Ms + self.dM / 2., named_type='TMR')
+
+    def time_lumfn_stepwise_eval(self, ngal):
+        from lumfn_stepwise import lumfn_stepwise_eval
+
+        for phi_M, phi in zip(self.phi_Ms, self.phis):
+            lumfn_stepwise_eval(self.dat, self.dM, phi_M, phi, self.phi_Ms, self.phis, nproc=1)
+
+class VolavgFillfactor:
+    '''
+    Volume average fillfactor:  index build (sort), cumulative tables and per galaxy fractions, see volfracs.
+    '''
+    params      = [synthetic.scales(default=[1.e4, 1.e5, 1.e6])]
+    param_names = ['nrand']
+    number      = 1
+    repeat      = 3
+    timeout     = 3600
+
+    def setup(self, nrand):
+        self.rand = synthetic.randoms(nrand)
+        self.dat  = synthetic.galaxies(1.e4)
+
+    def _index(self):
+        from volfracs import volavg_index
+
+        return  volavg_index(rand=self.rand, cache=False)
+
+    def time_volavg_index(self, nrand):
+        self._index()
+
+    def time_volavg_fillfactor(self, nrand):
+        from volfracs import volavg_fillfactor, eval_volavg_fillfactor
+
+        index = self._index()
+
+        for tier in [None, 0, 4]:
+            volavg_fillfactor(index=index, tier=tier)
+            eval_volavg_fillfactor(self.dat, index=index, tier=tier)
@@ -0,0 +1,63 @@
+import numpy          as np
+
+from   scipy.spatial  import KDTree
+from   benchmarks     import synthetic
+
+
+class FillfactorSphereCount:
+    '''
+    < 8 Mpc/h neighbour counts of randoms in the (x2 oversampled) randoms, chunked in x:  fillfactor.process_one.
+    '''
+    params      = [synthetic.scales()]
+    param_names = ['npoint']
+    number      = 1
+    repeat      = 3
+    timeout     = 3600
+
+    def setup(self, npoint):
+        points    = synthetic.box_points(npoint)
+        over      = synthetic.box_points(2 * npoint, density=2., seed=271)
+
+        runs      = synthetic.x_chunks(points, 8)
+        lims      = [(split[:,0].min(), split[:,0].max()) for split, _ in runs]
+        over      = over[np.argsort(over[:,0])]
+
+        self.runs = [[KDTree(split), over[(over[:,0] > xmin - 8.1) & (over[:,0] < xmax + 8.1)]] for (split, _), (xmin, xmax) in zip(runs, lims)]
+
+    def time_process_one(self, npoint):
+        from fillfactor import process_one
+
+        for run in self.runs:
+            process_one(run)
+
+class BoundDistQuery:
+    '''
+    Nearest boundary point of each body random, chunked in x:  bound_dist.process_one.
+    '''
+    params      = [synthetic.scales()]
+    param_names = ['npoint']
+    number      = 1
+    repeat      = 3
+    timeout     = 3600
+
+    def setup(self, npoint):
+        points    = synthetic.box_points(npoint)
+
+        # Boundary randoms, ~ a percent of the body.
+        isin      = np.random.default_rng(314).uniform(size=len(points)) < 0.01
+        boundary  = points[isin]
+
+        body      = points[np.argsort(points[:,0])]
+        self.runs = []
+
+        for chunk in np.array_split(body, 8):
+            xmin, xmax = chunk[:,0].min(), chunk[:,0].max()
+            complement = boundary[(boundary[:,0] > xmin - 8.2) & (boundary[:,0] < xmax + 8.2)]
+
+            self.runs.append([[x for x in chunk], KDTree(complement)])
+
+    def time_process_one(self, npoint):
+        from bound_dist import process_one
+
+        for run in self.runs:
+            process_one(run)
@@ -0,0 +1,157 @@
+import os
+import sys
+import glob
+import json
+import time
+import inspect
+import argparse
+import platform
+import datetime
+import importlib
+import itertools
+import contextlib
+import subprocess
+import numpy as np
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.dirname(root))
+
+'''
+Benchmarks without asv, e.g. on a laptop:
+
+    python3 benchmarks/run.py
+    python3 benchmarks/run.py --bench Lumfn --repeat 5
+    BENCH_SCALES=1e4,1e5,1e6,1e7,1e8 python3 benchmarks/run.py --bench Fillfactor
+
+Results are written per commit to benchmarks/results/<commit>.json and compared to the latest
+previous commit.  With asv:  asv run, see asv.conf.json.
+'''
+
+def commit():
+    try:
+        sha   = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=root).decode('utf-8').strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root).decode('utf-8').strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return  'unknown'
+
+    return  sha + ('-dirty' if dirty else '')
+
+def discover(select=None):
+    for mpath in sorted(glob.glob(root + '/bench_*.py')):
+        module = importlib.import_module('benchmarks.' + os.path.basename(mpath).replace('.py', ''))
+
+        for cname, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+
+            for method in sorted(xx for xx in dir(cls) if xx.startswith('time_')):
+                name = f'{module.__name__}.{cname}.{method}'
+
+                if (select is None) or any(xx in name for xx in select):
+                    yield  name, cls, method
+
+def run_benchmark(name, cls, method, repeat=None):
+    results = []
+
+    for params in itertools.product(*getattr(cls, 'params', [[]])):
+        bench   = cls()
+        times   = []
+
+        # Kernels report progress to stdout.
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            if hasattr(bench, 'setup'):
+                bench.setup(*params)
+
+            for _ in range(repeat or getattr(cls, 'repeat', 3)):
+                start = time.perf_counter()
+
+                getattr(bench, method)(*params)
+
+                times.append(time.perf_counter() - start)
+
+            if hasattr(bench, 'teardown'):
+                bench.teardown(*params)
+
+        result  = {'NAME': name, 'PARAMS': dict(zip(getattr(cls, 'param_names', []), params)), 'MIN_S': np.min(times), 'MEDIAN_S': np.median(times), 'NREPEAT': len(times)}
+
+        print('{}\t{}\t{:.4f}s'.format(name.ljust(70), str(result['PARAMS']).ljust(20), result['MIN_S']))
+
+        results.append(result)
+
+    return  results
+
+def compare(results, previous, threshold=1.2):
+    '''
+    Ratio of the min. time of each benchmark to that of a previous run;  regressions beyond threshold
+    are flagged.
+    '''
+    with open(previous, 'r') as ff:
+        previous = json.load(ff)
+
+    before      = {(xx['NAME'], json.dumps(xx['PARAMS'], sort_keys=True)): xx['MIN_S'] for xx in previous['RESULTS']}
+    regressions = []
+
+    print('\n\nCompared to {} ({}):\n'.format(previous['COMMIT'], previous['DATE']))
+
+    for result in results:
+        key     = (result['NAME'], json.dumps(result['PARAMS'], sort_keys=True))
+
+        if key not in before:
+            continue
+
+        ratio   = result['MIN_S'] / before[key]
+        flag    = 'REGRESSION' if ratio > threshold else ''
+
+        print('{}\t{}\t{:.3f}\t{}'.format(result['NAME'].ljust(70), str(result['PARAMS']).ljust(20), ratio, flag))
+
+        if flag:
+            regressions.append(result['NAME'])
+
+    return  regressions
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Run the benchmark suite, storing results per commit.')
+    parser.add_argument('--bench',     help='Only benchmarks matching these, e.g. Lumfn', nargs='+', default=None)
+    parser.add_argument('--repeat',    help='Repeats of each benchmark', type=int, default=None)
+    parser.add_argument('--compare',   help='Previous results to compare to;  defaults to the latest of another commit.', default=None)
+    parser.add_argument('--threshold', help='Slow down flagged as a regression.', type=float, default=1.2)
+
+    args    = parser.parse_args()
+
+    sha     = commit()
+
+    print(f'Benchmarking {sha}.\n')
+
+    results = []
+
+    for name, cls, method in discover(args.bench):
+        results += run_benchmark(name, cls, method, repeat=args.repeat)
+
+    odir    = root + '/results/'
+    opath   = odir + f'{sha}.json'
+
+    os.makedirs(odir, exist_ok=True)
+
+    previous = args.compare
+
+    if previous is None:
+        others   = sorted([xx for xx in glob.glob(odir + '*.json') if xx != opath], key=os.path.getmtime)
+        previous = others[-1] if others else None
+
+    machine = {'HOST': platform.node(), 'MACHINE': platform.machine(), 'PYTHON': platform.python_version(), 'NUMPY': np.__version__, 'NCPU': os.cpu_count()}
+
+    with open(opath, 'w') as ff:
+        json.dump({'COMMIT': sha, 'DATE': datetime.datetime.now().isoformat(), 'MACHINE': machine, 'RESULTS': results}, ff, indent=2)
+
+    print(f'\n\nWriting {opath}.')
+
+    if previous is not None:
+        regressions = compare(results, previous, threshold=args.threshold)
+
+        if regressions:
+            print('\n\nWARNING:  {} regressions.'.format(len(regressions)))
+
+    print('\n\nDone.\n\n')
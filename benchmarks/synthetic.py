@@ -0,0 +1,97 @@
+import os
+import numpy         as np
+
+from   astropy.table import Table
+from   cosmo         import volcom
+from   ddp_zlimits   import ddp_zlimits
+from   delta8_limits import delta8_tier_edges, d8_edges
+from   params        import sphere_radius
+
+
+def scales(default=[1.e4, 1.e5]):
+    '''
+    Benchmark scales [points]:  $BENCH_SCALES, e.g. 1e4,1e5,1e6,1e7,1e8 on a large node, else default.
+    '''
+    if 'BENCH_SCALES' in os.environ:
+        return  [int(float(xx)) for xx in os.environ['BENCH_SCALES'].split(',')]
+
+    return  [int(xx) for xx in default]
+
+def box_points(npoint, density=1., seed=314):
+    '''
+    Uniform randoms in a cube at the given density [(Mpc/h)^-3], as randoms.py.
+    '''
+    rng    = np.random.default_rng(seed)
+    side   = (npoint / density)**(1./3.)
+
+    return  side * rng.uniform(size=(int(npoint), 3))
+
+def x_chunks(points, nchunk, buff=.1):
+    '''
+    Chunks of points in x, with their complement within a sphere radius (and buffer), as fillfactor.py
+    and bound_dist.py.
+    '''
+    points = points[np.argsort(points[:,0])]
+    runs   = []
+
+    for idx in np.array_split(np.arange(len(points)), nchunk):
+        split      = points[idx]
+
+        xmin       = split[:,0].min()
+        xmax       = split[:,0].max()
+
+        complement = (points[:,0] > (xmin - sphere_radius - buff)) & (points[:,0] < (xmax + sphere_radius + buff))
+
+        runs.append([split, points[complement]])
+
+    return  runs
+
+def galaxies(ngal, seed=314, area=180.):
+    '''
+    vmax-like catalogue:  redshifts, limits, colours and abs. mags. spanning the lumfn binning.
+    '''
+    rng                          = np.random.default_rng(seed)
+    ngal                         = int(ngal)
+
+    zlo, zhi                     = ddp_zlimits['DDP1']
+
+    dat                          = Table()
+    dat['ZSURV']                 = rng.uniform(zlo, zhi, ngal)
+    dat['ZMIN']                  = dat['ZSURV'] * rng.uniform(0.2, 1.0, ngal)
+    dat['ZMAX']                  = dat['ZSURV'] + rng.uniform(0.0, 0.3, ngal)
+    dat['VMAX']                  = volcom(dat['ZMAX'], area) - volcom(dat['ZMIN'], area)
+
+    dat['GMR']                   = rng.uniform(0.2, 1.1, ngal)
+    dat['REST_GMR_0P1']          = rng.uniform(0.131, 1.067, ngal)
+    dat['REST_GMR_0P0']          = dat['REST_GMR_0P1'] - 0.05
+    dat['REST_GMR_0P1_INDEX']    = rng.integers(1, 8, ngal)
+    dat['DETMAG']                = rng.uniform(15., 19.8, ngal)
+    dat['DDPMALL_0P0']           = rng.uniform(-23., -16., ngal)
+
+    dat['MCOLOR_0P0']            = rng.uniform(-23., -16., ngal)
+    dat['STEPWISE_BRIGHTLIM_0P0'] = dat['MCOLOR_0P0'] - rng.uniform(0.5, 3., ngal)
+    dat['STEPWISE_FAINTLIM_0P0']  = dat['MCOLOR_0P0'] + rng.uniform(0.5, 3., ngal)
+
+    dat.meta['AREA']             = area
+    dat.meta['FORCE_VOL']        = volcom(zhi, area) - volcom(zlo, area)
+
+    return  dat
+
+def randoms(nrand, seed=314):
+    '''
+    Randoms with the columns of the volume average fillfactor index, see volfracs.volavg_index.
+    '''
+    rng                                  = np.random.default_rng(seed)
+    nrand                                = int(nrand)
+
+    zlo, zhi                             = ddp_zlimits['DDP1']
+
+    rand                                 = Table()
+    rand['Z']                            = zlo + (zhi - zlo) * rng.uniform(size=nrand)**(1./3.)
+    rand['FILLFACTOR']                   = rng.uniform(0.5, 1.0, nrand)
+    rand['DDP1_DELTA8']                  = rng.lognormal(0., 0.75, nrand) - 1.
+    rand['DDP1_DELTA8_ZEROPOINT']        = rand['DDP1_DELTA8'] + 0.05
+    rand['DDP1_DELTA8_TIER']             = delta8_tier_edges(rand['DDP1_DELTA8'].data, d8_edges())
+    rand['DDP1_DELTA8_TIER_ZEROPOINT']   = delta8_tier_edges(rand['DDP1_DELTA8_ZEROPOINT'].data, d8_edges())
+
+    return  rand
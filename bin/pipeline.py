@@ -12,16 +12,23 @@ from    submit     import customise_script
 from    config     import Configuration
 from    utils      import run_command
 from    params     import oversample_nrealisations
+from    dag        import pipeline_jobs, run_local, submit_jobs
+from    runtime    import aggregate_reports
 
 '''
 # --log                                                                                                                                                                                                                                                                                                                                     
 # Sbatch:  python3 pipeline.py --survey gama --use_sbatch --queue cosma --reset                                                                                                                                                                                                                                                             
-# Head:    python3 pipeline.py --survey desi --dryrun                                                                                                                                                                                                                                                                                       
+# Head:    python3 pipeline.py --survey desi --dryrun
+# Local:   python3 pipeline.py --survey gama --local --ncores 64 --local_memory 256                                                                                                                                                                                                                                                                                       
+# Profile: python3 pipeline.py --survey gama --local --profile  (or GOLD_PROFILE=1), see profiler.py
+# Sizing:  --time & --mem per job from the cost model, see costmodel.py;  --fixed_resources for the #SBATCH headers.
+# Arrays:  python3 pipeline.py --survey gama --use_sbatch --array  (one array job of realisations per field), or --per_node 8.
+# Testing: export PATH=$CODE_ROOT/bin/shim/:$PATH for a stand-in sbatch, see bin/shim/sbatch.
 #                                                                                                                                                                                                                                                                                                                                           
 # Note:    use sinfo to see available nodes to each queue.                                                                                                                                                                                                                                                                                  
 '''
 
-def pipeline(args, use_sbatch=False, reset=False, nooverwrite=False, dryrun=True, survey='gama', freshclone=False, log=False, custom=True, comments=None, stages=None):
+def pipeline(args, use_sbatch=False, reset=False, nooverwrite=False, dryrun=True, survey='gama', freshclone=False, log=False, custom=True, comments=None, stages=None, local=False, ncores=64, memory=256., resize=True, pack=True, array=False, per_node=None):
     if custom & (args != None):
         customise_script(args)
 
@@ -117,103 +124,26 @@ def pipeline(args, use_sbatch=False, reset=False, nooverwrite=False, dryrun=True
     Path(os.environ['GOLD_DIR'] + '/logs/').mkdir(parents=True, exist_ok=True)
     Path(os.environ['RANDOMS_DIR'] + '/logs/').mkdir(parents=True, exist_ok=True)
 
-    if stages == None:
-       # TODO:  difficulty is handing the dependency jobids.
-        stages = ['gold',\
-                  'rand',\
-                  'rand_ddp1',\
-                  'rand_d8',\
-                  'rand_ddp1_d8',\
-                  'gold_d8']
+    fields = fetch_fields(survey=survey)
 
-    #  ---------------------------------------------
-    # Generate all steps up to reference LF. 
-    cmd        = 'serialorparallel -n {} -p {:d} -e DRYRUN={},RESET={:d},NOOVERWRITE={},SURVEY={} -s gold_pipeline -c {}'.format('gold_pipeline', int(use_sbatch), dryrun, int(reset), nooverwrite, survey, code_root)
-    gold_jobid = run_command(cmd)
-
-    print('\n>>>>> GOLD JOB ID <<<<<')
-    print(gold_jobid)
-    print('\n\n')
-
-    #
-    # https://slurm.schedmd.com/sbatch.html
-    #
-
-    fields          = fetch_fields(survey=survey)
-    
-    rand_jobids     = {}
-    rand_ddp_jobids = {}
-    
-    for field in fields:
-        rand_jobids[field] = []
-
-        for realz in np.arange(oversample_nrealisations):
-            # No dependency.  Generate all steps up to random fill factor and bound_dist.      
-            cmd         = 'serialorparallel -n {} -p {:d} -e FIELD={},DRYRUN={},RESET={:d},NOOVERWRITE={},SURVEY={},REALZ={} -s rand_pipeline -c {}'
-            cmd         = cmd.format(f'rand_pipeline_{field}_{realz}', int(use_sbatch), field, dryrun, int(reset), nooverwrite, survey, realz, code_root)
-
-            jobid       = run_command(cmd)
-
-            rand_jobids[field].append(str(jobid))
-
-        rand_jobids[field] = ','.join(rand_jobids[field])
-
-    for field in fields:
-        rand_ddp_jobids[field] = []
+    #  ----  Job graph:  gold -> rand -> rand_ddp1 -> rand_d8 -> rand_ddp1_d8 -> gold_d8  ----
+    jobs   = pipeline_jobs(fields, dryrun=dryrun, reset=reset, nooverwrite=nooverwrite, survey=survey, stages=stages)
 
-        for realz in np.arange(oversample_nrealisations):
-            # Dependency on $GOLD_JOBID (gold ddp cat generated by gold_pipeline). 
-            # Generate ddp1 randoms limited to ddp1 z limits - with corresponding fillfactors, bound_dist etc. 
-            cmd                    = 'serialorparallel -n {} -p {:d} -e FIELD={},DRYRUN={},RESET={:d},NOOVERWRITE={},SURVEY={},REALZ={} -d {} -s rand_ddp1_pipeline -c {}'
-            cmd                    = cmd.format(f'rand_ddp1_pipeline_{field}_{realz}', int(use_sbatch), field, dryrun, int(reset), nooverwrite, survey, realz, gold_jobid, code_root)
-            
-            jobid                  = run_command(cmd)
-            
-            rand_ddp_jobids[field].append(str(jobid))
+    if local:
+        # No slurm:  run independent jobs concurrently within a core & memory budget.
+        state_path = os.environ['GOLD_DIR'] + '/logs/pipeline_state.json'
 
-        rand_ddp_jobids[field] =','.join(rand_ddp_jobids[field])
+        run_local(jobs, ncores=ncores, mem=memory, state_path=state_path, code_root=code_root)
 
-    print('\n\n>>>>> RANDOM JOB IDS <<<<<')
-    print(rand_jobids)
-    print(rand_ddp_jobids)
-    print('\n\n')
+        # Stage run reports to a single pipeline report.
+        aggregate_reports()
 
-    rand_d8_jobids     = {}
-    rand_ddp_d8_jobids = {}
-
-    for field in fields:
-        # Requires ddp cat, & randoms; no reset required. 
-        rand_jobid = rand_jobids[field]
-
-        cmd = 'serialorparallel -n {} -p {:d} -e FIELD={},DRYRUN={},RESET={:d},NOOVERWRITE={},SURVEY={} -d {},{} -s rand_d8_pipeline -c {}'        
-        cmd = cmd.format(f'rand_d8_pipeline_{field}', int(use_sbatch), field, dryrun, int(reset), nooverwrite, survey, gold_jobid, rand_jobid, code_root)
-
-        rand_d8_jobids[field] = run_command(cmd)        
+    else:
+        # Right-sized --time & --mem, and packing of short jobs, see costmodel.py;  realisations as array or node jobs, see dag.py.
+        submit_jobs(jobs, use_sbatch=use_sbatch, code_root=code_root, resize=resize, pack=pack, array=array, per_node=per_node)
 
-        rand_ddp_jobid        = rand_ddp_jobids[field]
-    
-        cmd = 'serialorparallel -n {} -p {:d} -e FIELD={},DRYRUN={},NOOVERWRITE={},SURVEY={} -d {},{} -s rand_ddp1_d8_pipeline -c {}'
-        cmd = cmd.format(f'rand_ddp1_d8_pipeline_{field}', int(use_sbatch), field, dryrun, nooverwrite, survey, gold_jobid, rand_ddp_jobid, code_root)
-        rand_ddp_d8_jobids[field] = run_command(cmd)
-
-    print('\n\n>>>>> RANDOM D8 JOB IDS <<<<<')
-    print(rand_d8_jobids)
-    print(rand_ddp_d8_jobids)
-    print('\n\n')
-
-    # Requires ddp cat. & random fill factor.                                                                                                                                                         
-    # Note: runs all fields simultaneously.  
-    dependencies = ','.join(str(rand_ddp_d8_jobids[field]) for field in fields)
-    
-    # possibly missing RESET=$RESET
-    cmd           = 'serialorparallel -n {} -p {:d} -e DRYRUN={},NOOVERWRITE={},SURVEY={} -d {} -s gold_d8_pipeline -c {}'
-    cmd           = cmd.format('gold_d8_pipeline', int(use_sbatch), dryrun, nooverwrite, survey, dependencies, code_root)
-    gold_d8_jobid = run_command(cmd)
-        
-    print('\n\n>>>>>  GOLD D8 JOB IDS  <<<<<')
-    print(gold_d8_jobid)
     print('\n\n>>>>>  DONE.  <<<<<\n\n')
-    
+
     if log:
         sys.stdout.close()
 
@@ -230,6 +160,14 @@ if __name__ == '__main__':
     parser.add_argument('--custom',       help='Customised submission scripts.', default=True)
     parser.add_argument('--config',       help='Path to configuration file', type=str, default=None)
     parser.add_argument('--comments',     help='Add comments to README.')
+    parser.add_argument('--local',        help='Run the job graph locally, without slurm.', action='store_true')
+    parser.add_argument('--ncores',       help='Local core budget.', type=int, default=64)
+    parser.add_argument('--local_memory', help='Local memory budget [GB].', type=float, default=256.)
+    parser.add_argument('--stages',       help='Stages to run, e.g. rand rand_d8;  defaults to all.', nargs='+', default=None)
+    parser.add_argument('--fixed_resources', help='Request the #SBATCH resources of the scripts, not those of the cost model.', action='store_true')
+    parser.add_argument('--nopack',       help='Do not pack short jobs.', action='store_true')
+    parser.add_argument('--array',        help='Submit the realisations of each field as one array job.', action='store_true')
+    parser.add_argument('--per_node',     help='Run this many realisations concurrently per node job.', type=int, default=None)
 
     # Customise submission scripts.                                                                                                                                                                      
     parser.add_argument('-s', '--script',  help='Script to customise.',    type=str, default=None)
@@ -251,6 +189,7 @@ if __name__ == '__main__':
     comments    = args.comments
     config      = args.config
     log         = args.log
+    local       = args.local
 
     config      = Configuration(config)
     config.update_attributes('pipeline', args)
@@ -264,4 +203,7 @@ if __name__ == '__main__':
         
     config.write()
     
-    pipeline(use_sbatch=use_sbatch, reset=reset, nooverwrite=nooverwrite, dryrun=dryrun, survey=survey, freshclone=freshclone, log=log, custom=custom, comments=comments, args=args)
+    # Explicit --memory or --time overrides the cost model.
+    resize      = not (args.fixed_resources or args.memory or args.time)
+
+    pipeline(use_sbatch=use_sbatch, reset=reset, nooverwrite=nooverwrite, dryrun=dryrun, survey=survey, freshclone=freshclone, log=log, custom=custom, comments=comments, args=args, stages=args.stages, local=local, ncores=args.ncores, memory=args.local_memory, resize=resize, pack=not args.nopack, array=args.array, per_node=args.per_node)
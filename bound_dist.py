@@ -13,8 +13,8 @@ import matplotlib.pyplot as plt
 from   scipy.spatial   import KDTree
 from   astropy.table   import Table
 from   multiprocessing import Pool
-from   runtime         import calc_runtime
-from   findfile        import findfile, overwrite_check, call_signature
+from   runtime         import calc_runtime, stage, pool_imap
+from   findfile        import findfile, overwrite_check, call_signature, stage_hash
 from   config          import Configuration
 from   fillfactor      import collate_fillfactors
 from   params          import oversample_nrealisations, sphere_radius
@@ -54,119 +54,124 @@ def bound_dist(log, field, dryrun, prefix, survey, nproc, realz, nooverwrite, co
 
         sys.stdout = open(logfile, 'w')
     
+    inhash = stage_hash(inputs=[fpath] if os.path.isfile(fpath) else [], params={'sphere_radius': sphere_radius, 'oversample_nrealisations': oversample_nrealisations})
+
     if nooverwrite:
-        overwrite_check(opath)
+        overwrite_check(opath, inhash=inhash)
 
-    call_signature(dryrun, sys.argv)
+    with stage('bound_dist', opath=opath):
+        call_signature(dryrun, sys.argv)
 
-    # Output is sorted by fillfactor.py;   
-    body      = Table.read(fpath)
-    boundary  = Table.read(fpath, 'BOUNDARY')
+        # Output is sorted by fillfactor.py;   
+        body      = Table.read(fpath)
+        boundary  = Table.read(fpath, 'BOUNDARY')
 
-    body.sort('CARTESIAN_X')
-    boundary.sort('CARTESIAN_X')
+        body.sort('CARTESIAN_X')
+        boundary.sort('CARTESIAN_X')
 
-    bids      = boundary['BOUNDID']
-    boundary  = np.c_[boundary['CARTESIAN_X'], boundary['CARTESIAN_Y'], boundary['CARTESIAN_Z']]
+        bids      = boundary['BOUNDID']
+        boundary  = np.c_[boundary['CARTESIAN_X'], boundary['CARTESIAN_Y'], boundary['CARTESIAN_Z']]
     
-    body      = np.c_[body['CARTESIAN_X'], body['CARTESIAN_Y'], body['CARTESIAN_Z']]
+        body      = np.c_[body['CARTESIAN_X'], body['CARTESIAN_Y'], body['CARTESIAN_Z']]
 
-    runtime   = calc_runtime(start, 'Reading {:.2f}M randoms'.format(len(body) / 1.e6), xx=body)
+        runtime   = calc_runtime(start, 'Reading {:.2f}M randoms'.format(len(body) / 1.e6), xx=body)
 
-    split_idx = np.arange(len(body))
-    split_idx = np.array_split(split_idx, 8 * nproc)
+        split_idx = np.arange(len(body))
+        split_idx = np.array_split(split_idx, 8 * nproc)
 
-    nchunk    = len(split_idx)
+        nchunk    = len(split_idx)
 
-    runs      = []
+        runs      = []
 
-    for i, idx in enumerate(split_idx):
-        split      = body[idx]
+        for i, idx in enumerate(split_idx):
+            split      = body[idx]
 
-        xmin       = split[:,0].min()
-        xmax       = split[:,0].max()
+            xmin       = split[:,0].min()
+            xmax       = split[:,0].max()
 
-        buff       = .2 # Mpc                                                                                                                                                                             
+            buff       = .2 # Mpc                                                                                                                                                                             
 
-        # Boundary complement. 
-        # TODO HARDCODE                                                                                                                                                                                 
-        complement = (boundary[:,0] > (xmin - sphere_radius - buff)) & (boundary[:,0] < (xmax + sphere_radius + buff))
-        complement =  boundary[complement]
+            # Boundary complement. 
+            # TODO HARDCODE                                                                                                                                                                                 
+            complement = (boundary[:,0] > (xmin - sphere_radius - buff)) & (boundary[:,0] < (xmax + sphere_radius + buff))
+            complement =  boundary[complement]
 
-        cmin       = complement[:,0].min()
-        cmax       = complement[:,0].max()
+            cmin       = complement[:,0].min()
+            cmax       = complement[:,0].max()
     
-        print('{:d}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:d}\t{:d}'.format(i, xmin, xmax, cmin, cmax, len(split), len(complement)))
+            print('{:d}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:d}\t{:d}'.format(i, xmin, xmax, cmin, cmax, len(split), len(complement)))
+
+            # leafsize=5                                                                                                                                                                                    
+            split      = [x for x in split]
+            complement = KDTree(complement)
 
-        # leafsize=5                                                                                                                                                                                    
-        split      = [x for x in split]
-        complement = KDTree(complement)
+            runs.append([split, complement])
 
-        runs.append([split, complement])
+        runtime   = calc_runtime(start, 'Created boundary trees.')
 
-    runtime   = calc_runtime(start, 'Created boundary trees.')
+        runtime = calc_runtime(start, 'POOL:  Querying bound dist for body points of {} splits.'.format(nchunk))
 
-    runtime = calc_runtime(start, 'POOL:  Querying bound dist for body points of {} splits.'.format(nchunk))
+        now     = time.time()
 
-    now     = time.time()
+        results = [process_one(runs[0], pid=0)]
 
-    results = [process_one(runs[0], pid=0)]
+        split_time  = time.time() - now
+        split_time /= 60.
 
-    split_time  = time.time() - now
-    split_time /= 60.
+        runtime = calc_runtime(start, 'POOL:  Expected runtime of {:.3f}.'.format(nchunk * split_time))
 
-    runtime = calc_runtime(start, 'POOL:  Expected runtime of {:.3f}.'.format(nchunk * split_time))
+        # https://britishgeologicalsurvey.github.io/science/python-forking-vs-spawn/
+        with multiprocessing.get_context('spawn').Pool(nproc) as pool:
+            for result in tqdm.tqdm(pool_imap(pool, process_one, runs[1:]), total=len(runs[1:])):
+                results.append(result)
 
-    # https://britishgeologicalsurvey.github.io/science/python-forking-vs-spawn/
-    with multiprocessing.get_context('spawn').Pool(nproc) as pool:
-        for result in tqdm.tqdm(pool.imap(process_one, iterable=runs[1:]), total=len(runs[1:])):
-            results.append(result)
+            pool.close()
 
-        pool.close()
+            # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join
+            pool.join()
 
-        # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join
-        pool.join()
+        runtime = calc_runtime(start, 'POOL:  Done with queries')
 
-    runtime = calc_runtime(start, 'POOL:  Done with queries')
+        flat_result = []
+        flat_ii     = []
 
-    flat_result = []
-    flat_ii     = []
+        for rr in results:
+            flat_result   += rr[0]
+            flat_ii       += rr[1]
 
-    for rr in results:
-        flat_result   += rr[0]
-        flat_ii       += rr[1]
+        rand               = Table.read(fpath)
+        rand.sort('CARTESIAN_X')
 
-    rand               = Table.read(fpath)
-    rand.sort('CARTESIAN_X')
+        # print(len(rand))
+        # print(len(flat_result))
 
-    # print(len(rand))
-    # print(len(flat_result))
+        rand['BOUND_DIST'] = np.array(flat_result)
+        rand['BOUNDID']    = bids[np.array(flat_ii)]
 
-    rand['BOUND_DIST'] = np.array(flat_result)
-    rand['BOUNDID']    = bids[np.array(flat_ii)]
+        rand['FILLFACTOR_POISSON'] = rand['FILLFACTOR']
+        rand['FILLFACTOR'][rand['BOUND_DIST'].data > sphere_radius] = 1.
 
-    rand['FILLFACTOR_POISSON'] = rand['FILLFACTOR']
-    rand['FILLFACTOR'][rand['BOUND_DIST'].data > sphere_radius] = 1.
+        # CHANGE:  Protect against exactly zero fillfactor (causes division errors). 
+        rand['FILLFACTOR'] = np.clip(rand['FILLFACTOR'], 1.e-99, None)
 
-    # CHANGE:  Protect against exactly zero fillfactor (causes division errors). 
-    rand['FILLFACTOR'] = np.clip(rand['FILLFACTOR'], 1.e-99, None)
+        runtime = calc_runtime(start, 'Shuffling')
 
-    runtime = calc_runtime(start, 'Shuffling')
+        # randomise rows.                                                                                                                                                
+        idx  = np.arange(len(rand))
+        idx  = np.random.choice(idx, size=len(idx), replace=False)
 
-    # randomise rows.                                                                                                                                                
-    idx  = np.arange(len(rand))
-    idx  = np.random.choice(idx, size=len(idx), replace=False)
+        rand = rand[idx]
 
-    rand = rand[idx]
+        # Bound dist.
+        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.KDTree.query.html#scipy.spatial.KDTree.query
 
-    # Bound dist.
-    # https://docs.scipy.org/doc/scipy/reference/generated/scipy.spatial.KDTree.query.html#scipy.spatial.KDTree.query
+        runtime  = calc_runtime(start, 'Writing {}'.format(opath), xx=rand)
 
-    runtime  = calc_runtime(start, 'Writing {}'.format(opath), xx=rand)
+        rand.meta['INHASH'] = inhash
 
-    rand.write(opath, format='fits', overwrite=True)
+        rand.write(opath, format='fits', overwrite=True)
 
-    runtime = calc_runtime(start, 'Finished')
+        runtime = calc_runtime(start, 'Finished')
 
     if log:
         sys.stdout.close()
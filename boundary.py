@@ -10,9 +10,9 @@ from   cosmo                   import cosmo, volcom
 from   scipy.interpolate       import interp1d
 from   astropy.table           import Table, vstack
 from   cartesian               import cartesian, rotate
-from   runtime                 import calc_runtime
+from   runtime                 import calc_runtime, stage
 from   desi_randoms            import desi_randoms
-from   findfile                import fetch_fields, findfile, overwrite_check, call_signature
+from   findfile                import fetch_fields, findfile, overwrite_check, call_signature, stage_hash
 from   gama_limits             import gama_limits, gama_field
 from   scipy.spatial.transform import Rotation as R
 from   ros_tools               import roscen, ros_limits
@@ -77,171 +77,177 @@ config = Configuration(args.config)
 config.update_attributes('boundary', args)
 config.write()
 '''
+# No input files:  arguments & code only.
+inhash   = stage_hash()
+
 if args.nooverwrite:
-    overwrite_check(opath, ext='BOUNDARY')
+    overwrite_check(opath, ext='BOUNDARY', inhash=inhash)
     
-if args.dryrun:
-    sampling   = 1000
+# Appends to opath;  a distinct report path.
+with stage('boundary', opath=opath.replace('.fits', '_boundary.fits')):
+    if args.dryrun:
+        sampling   = 1000
 
-call_signature(dryrun, sys.argv)
+    call_signature(dryrun, sys.argv)
 
-##  ras and decs.                                                                                                                                                              
-if survey == 'gama':    
-    area       = 60. 
+    ##  ras and decs.                                                                                                                                                              
+    if survey == 'gama':    
+        area       = 60. 
 
-    ra_min     = gama_limits[field]['ra_min']
-    ra_max     = gama_limits[field]['ra_max']
+        ra_min     = gama_limits[field]['ra_min']
+        ra_max     = gama_limits[field]['ra_max']
 
-    dec_min    = gama_limits[field]['dec_min']
-    dec_max    = gama_limits[field]['dec_max']
+        dec_min    = gama_limits[field]['dec_min']
+        dec_max    = gama_limits[field]['dec_max']
 
-    pairs      = {'RA': (ra_min, ra_max), 'DEC': (dec_min, dec_max), 'Z': (zmin, zmax)}
-    names      = list(pairs.keys())
+        pairs      = {'RA': (ra_min, ra_max), 'DEC': (dec_min, dec_max), 'Z': (zmin, zmax)}
+        names      = list(pairs.keys())
 
-    randoms    = []
+        randoms    = []
 
-    for key0 in names:
-        keys         = list(pairs.keys())
-        keys.remove(key0)
+        for key0 in names:
+            keys         = list(pairs.keys())
+            keys.remove(key0)
         
-        key1         = keys[0]
-        key2         = keys[1]
+            key1         = keys[0]
+            key2         = keys[1]
 
-        print('Solving for {} boundary ({}, {})'.format(key0, key1, key2))
+            print('Solving for {} boundary ({}, {})'.format(key0, key1, key2))
         
-        pair0        = pairs[key0]
-        pair1        = pairs[key1]
-        pair2        = pairs[key2]
+            pair0        = pairs[key0]
+            pair1        = pairs[key1]
+            pair2        = pairs[key2]
 
-        continuous   = np.linspace(pair1[0], pair1[1], sampling)
-        continuous   = np.tile(continuous, 2)
+            continuous   = np.linspace(pair1[0], pair1[1], sampling)
+            continuous   = np.tile(continuous, 2)
 
-        np.random.shuffle(continuous)
+            np.random.shuffle(continuous)
          
-        continuous2  = np.linspace(pair2[0], pair2[1], sampling)
-        continuous2  = np.tile(continuous2, 2)
+            continuous2  = np.linspace(pair2[0], pair2[1], sampling)
+            continuous2  = np.tile(continuous2, 2)
 
-        np.random.shuffle(continuous2)
+            np.random.shuffle(continuous2)
 
-        discrete      = pair0[0] * np.ones_like(continuous)
-        discrete[::2] = pair0[1]
+            discrete      = pair0[0] * np.ones_like(continuous)
+            discrete[::2] = pair0[1]
 
-        np.random.shuffle(discrete)
+            np.random.shuffle(discrete)
 
-        to_add        = Table(np.c_[discrete, continuous, continuous2], names=['BOUND_{}'.format(key0), 'BOUND_{}'.format(key1), 'BOUND_{}'.format(key2)])
-        to_add        = to_add['BOUND_RA', 'BOUND_DEC', 'BOUND_Z']
+            to_add        = Table(np.c_[discrete, continuous, continuous2], names=['BOUND_{}'.format(key0), 'BOUND_{}'.format(key1), 'BOUND_{}'.format(key2)])
+            to_add        = to_add['BOUND_RA', 'BOUND_DEC', 'BOUND_Z']
 
-        randoms.append(to_add)
+            randoms.append(to_add)
 
-    randoms = vstack(randoms)
-    randoms.rename_column('BOUND_Z', 'Z')
+        randoms = vstack(randoms)
+        randoms.rename_column('BOUND_Z', 'Z')
 
-elif survey == 'desi':
-    # No requirement on NERSC HOST for boundary.
-    inner = 0.20  # deg.                                                                                                                                                                            
-    outer = 1.75  # deg.                                                                                                                                                                                
+    elif survey == 'desi':
+        # No requirement on NERSC HOST for boundary.
+        inner = 0.20  # deg.                                                                                                                                                                            
+        outer = 1.75  # deg.                                                                                                                                                                                
 
-    # TODO/HACK?
-    area  = np.pi * (outer**2. - inner**2.)
+        # TODO/HACK?
+        area  = np.pi * (outer**2. - inner**2.)
         
-    ras   = np.arange(0., 360., 1.e-3)
+        ras   = np.arange(0., 360., 1.e-3)
     
-    idecs = (90. - inner) * np.ones_like(ras)
-    odecs = (90. - outer) * np.ones_like(ras)
+        idecs = (90. - inner) * np.ones_like(ras)
+        odecs = (90. - outer) * np.ones_like(ras)
         
-    np.random.shuffle(ras)
+        np.random.shuffle(ras)
 
-    randoms = np.c_[ras, idecs]
-    randoms = np.vstack((randoms, np.c_[ras, odecs]))
+        randoms = np.c_[ras, idecs]
+        randoms = np.vstack((randoms, np.c_[ras, odecs]))
 
-    randoms = Table(randoms, names=['BOUND_RA', 'BOUND_DEC'])
-    randoms['Z'] = 0.2
+        randoms = Table(randoms, names=['BOUND_RA', 'BOUND_DEC'])
+        randoms['Z'] = 0.2
         
-    chis    = np.ones_like(randoms['Z'])
-    chis   *= cosmo.comoving_distance(0.2).value # Mpc/h
+        chis    = np.ones_like(randoms['Z'])
+        chis   *= cosmo.comoving_distance(0.2).value # Mpc/h
     
-    xyz     = cartesian(randoms['BOUND_RA'], randoms['BOUND_DEC'], randoms['Z'], rotate=False)
+        xyz     = cartesian(randoms['BOUND_RA'], randoms['BOUND_DEC'], randoms['Z'], rotate=False)
 
-    rr      = int(field[1:])
-    rr      = roscen[rr]
+        rr      = int(field[1:])
+        rr      = roscen[rr]
 
-    ros_xyz = rotate2rosette(rr[0], rr[1], xyz)
+        ros_xyz = rotate2rosette(rr[0], rr[1], xyz)
 
-    ras     = np.degrees(np.arctan2(ros_xyz[:,1], ros_xyz[:,0]))
+        ras     = np.degrees(np.arctan2(ros_xyz[:,1], ros_xyz[:,0]))
       
-    thetas  = np.degrees(np.arccos(ros_xyz[:,2] / chis))
-    decs    = 90. - thetas
+        thetas  = np.degrees(np.arccos(ros_xyz[:,2] / chis))
+        decs    = 90. - thetas
 
-    to_wrap = ras < 0.0
-    ras[to_wrap] += 360.
+        to_wrap = ras < 0.0
+        ras[to_wrap] += 360.
 
-    randoms = Table(np.c_[ras, decs], names=['BOUND_RA', 'BOUND_DEC'])
-    randoms['Z'] = np.random.uniform(zmin, zmax, len(randoms))
+        randoms = Table(np.c_[ras, decs], names=['BOUND_RA', 'BOUND_DEC'])
+        randoms['Z'] = np.random.uniform(zmin, zmax, len(randoms))
 
-else:
-    raise  NotImplementedError(f'No implementation for survey: {survey}')
+    else:
+        raise  NotImplementedError(f'No implementation for survey: {survey}')
 
-if dryrun:
-    nrand = 500
+    if dryrun:
+        nrand = 500
 
-else:
-    nrand = len(randoms)
+    else:
+        nrand = len(randoms)
 
-print('Solved {:d} for field {}'.format(nrand, field))
+    print('Solved {:d} for field {}'.format(nrand, field))
 
-randoms.pprint()
+    randoms.pprint()
 
-randoms['V']          = volcom(randoms['Z'].data, area=area) - volcom(zmin, area=area)
-randoms['BOUNDID']    = np.arange(len(randoms))
+    randoms['V']          = volcom(randoms['Z'].data, area=area) - volcom(zmin, area=area)
+    randoms['BOUNDID']    = np.arange(len(randoms))
 
-randoms['FIELD']      = field
-randoms['GAMA_FIELD'] = gama_field(randoms['BOUND_RA'], randoms['BOUND_DEC'])
+    randoms['FIELD']      = field
+    randoms['GAMA_FIELD'] = gama_field(randoms['BOUND_RA'], randoms['BOUND_DEC'])
 
-xyz                    = cartesian(randoms['BOUND_RA'], randoms['BOUND_DEC'], randoms['Z'])
+    xyz                    = cartesian(randoms['BOUND_RA'], randoms['BOUND_DEC'], randoms['Z'])
 
-randoms['CARTESIAN_X'] = xyz[:,0]
-randoms['CARTESIAN_Y'] = xyz[:,1]
-randoms['CARTESIAN_Z'] = xyz[:,2]
+    randoms['CARTESIAN_X'] = xyz[:,0]
+    randoms['CARTESIAN_Y'] = xyz[:,1]
+    randoms['CARTESIAN_Z'] = xyz[:,2]
 
-xyz                    = rotate(randoms['BOUND_RA'], randoms['BOUND_DEC'], xyz)
+    xyz                    = rotate(randoms['BOUND_RA'], randoms['BOUND_DEC'], xyz)
 
-randoms['ROTCARTESIAN_X'] = xyz[:,0]
-randoms['ROTCARTESIAN_Y'] = xyz[:,1]
-randoms['ROTCARTESIAN_Z'] = xyz[:,2]
+    randoms['ROTCARTESIAN_X'] = xyz[:,0]
+    randoms['ROTCARTESIAN_Y'] = xyz[:,1]
+    randoms['ROTCARTESIAN_Z'] = xyz[:,2]
 
-randoms.meta = {'ZMIN': zmin,\
-                'ZMAX': zmax,\
-                'NBOUND': nrand,\
-                'FIELD': field,\
-                'SAMPLING': sampling,\
-                'AREA': area}
+    randoms.meta = {'ZMIN': zmin,\
+                    'ZMAX': zmax,\
+                    'NBOUND': nrand,\
+                    'FIELD': field,\
+                    'SAMPLING': sampling,\
+                    'AREA': area}
 
-print(randoms.meta)
+    print(randoms.meta)
 
-randoms.meta['EXTNAME'] = 'BOUNDARY'
+    randoms.meta['EXTNAME'] = 'BOUNDARY'
+    randoms.meta['INHASH']  = inhash
 
-if os.path.isfile(opath):
-    runtime = calc_runtime(start, f'Appending BOUNDARY extension to {opath}', xx=randoms)
+    if os.path.isfile(opath):
+        runtime = calc_runtime(start, f'Appending BOUNDARY extension to {opath}', xx=randoms)
 
-else:
-    raise  RuntimeError(f'Failed to find {opath} needed to append.')
+    else:
+        raise  RuntimeError(f'Failed to find {opath} needed to append.')
 
-boundary = Table(randoms, copy=True)
+    boundary = Table(randoms, copy=True)
 
-# https://github.com/desihub/redrock/blob/7952a4d8e2692a4a4f07b85286c4346579e447ce/py/redrock/external/desi.py#L64
-randoms  = Table.read(opath)
-randoms.meta['EXTNAME'] = 'RANDOMS'
+    # https://github.com/desihub/redrock/blob/7952a4d8e2692a4a4f07b85286c4346579e447ce/py/redrock/external/desi.py#L64
+    randoms  = Table.read(opath)
+    randoms.meta['EXTNAME'] = 'RANDOMS'
 
-header   = fits.Header()
+    header   = fits.Header()
 
-hx       = fits.HDUList()
-hx.append(fits.PrimaryHDU(header=header))
-hx.append(fits.convenience.table_to_hdu(randoms))
-hx.append(fits.convenience.table_to_hdu(boundary))
+    hx       = fits.HDUList()
+    hx.append(fits.PrimaryHDU(header=header))
+    hx.append(fits.convenience.table_to_hdu(randoms))
+    hx.append(fits.convenience.table_to_hdu(boundary))
 
-hx.writeto(opath, overwrite=True) 
+    hx.writeto(opath, overwrite=True) 
 
-runtime = calc_runtime(start, 'Finished'.format(opath))
+    runtime = calc_runtime(start, 'Finished'.format(opath))
 
 if log:
     sys.stdout.close()
@@ -0,0 +1,58 @@
+import os
+import argparse
+
+from   findfile import findfile, fetch_fields, convert_desitable, backends, columnar
+
+
+def convert_backend(backend, survey='gama', dryrun=False, prefix='randoms_ddp1', remove=False):
+    '''
+    Convert the intermediate (columnar) products on disk, of whichever backend, to the given backend;
+    e.g. a FITS run to parquet.  Final deliverables remain FITS.
+    '''
+    fpaths = []
+
+    for ftype in columnar:
+        if ftype == 'randoms_bd_ddp_n8':
+            fpaths += [findfile(ftype=ftype, dryrun=dryrun, field=ff, survey=survey, prefix=prefix, backend=backend) for ff in fetch_fields(survey)]
+
+        else:
+            fpaths += [findfile(ftype=ftype, dryrun=dryrun, survey=survey, backend=backend)]
+
+    opaths = []
+
+    for opath in fpaths:
+        if os.path.isfile(opath):
+            print(f'{opath} found on disk.')
+            continue
+
+        root    = os.path.splitext(opath)[0]
+        ipaths  = [root + ext for ext in backends.values() if os.path.isfile(root + ext)]
+
+        if not ipaths:
+            print(f'WARNING:  Failed to find {root}, nothing to convert.')
+            continue
+
+        opaths.append(convert_desitable(ipaths[0], backend, remove=remove))
+
+    return  opaths
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Convert intermediate products between backends.')
+    parser.add_argument('-b', '--backend', help='Backend to convert to.', choices=list(backends.keys()), default='parquet')
+    parser.add_argument('-d', '--dryrun',  help='Dryrun.', action='store_true')
+    parser.add_argument('-s', '--survey',  help='Select survey', default='gama')
+    parser.add_argument('--prefix',        help='randoms prefix', default='randoms_ddp1')
+    parser.add_argument('--remove',        help='Remove the original after conversion.', action='store_true')
+    parser.add_argument('--fpaths',        help='Convert only these files.', nargs='+', default=None)
+
+    args    = parser.parse_args()
+
+    if args.fpaths:
+        for fpath in args.fpaths:
+            convert_desitable(fpath, args.backend, remove=args.remove)
+
+    else:
+        convert_backend(args.backend, survey=args.survey.lower(), dryrun=args.dryrun, prefix=args.prefix, remove=args.remove)
+
+    print('\n\nDone.\n\n')
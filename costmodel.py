@@ -0,0 +1,364 @@
+import os
+import json
+import glob
+import argparse
+import subprocess
+import numpy       as np
+
+from   findfile    import findfile, read_desitable
+from   cosmo       import volcom
+from   ros_tools   import ros_limits
+from   ddp_zlimits import ddp_zlimits
+from   params      import oversample_nrealisations
+
+'''
+Cost model of the pipeline jobs:  wall time & peak memory of each stage script predicted from the input
+row count & nproc, calibrated from the job reports of past runs (local, or slurm via sacct), for right
+sized sbatch requests.
+
+    python3 costmodel.py                  # calibration & predictions of the current job graph.
+    python3 costmodel.py --sacct          # record the slurm jobs of the last submission.
+'''
+
+# As hardcoded in the #SBATCH headers of bin/, for stages without past runs.
+default_costs = {'gold_pipeline':            {'WALL_S': 7200., 'PEAK_RSS_MB':  20.e3},\
+                 'rand_field_pipeline':      {'WALL_S': 1800., 'PEAK_RSS_MB': 120.e3},\
+                 'rand_pipeline':            {'WALL_S': 2700., 'PEAK_RSS_MB': 120.e3},\
+                 'rand_ddp1_field_pipeline': {'WALL_S': 1200., 'PEAK_RSS_MB': 120.e3},\
+                 'rand_ddp1_pipeline':       {'WALL_S': 1800., 'PEAK_RSS_MB': 120.e3},\
+                 'rand_d8_pipeline':         {'WALL_S': 1200., 'PEAK_RSS_MB': 120.e3},\
+                 'rand_ddp1_d8_pipeline':    {'WALL_S': 1200., 'PEAK_RSS_MB': 120.e3},\
+                 'gold_d8_pipeline':         {'WALL_S': 2700., 'PEAK_RSS_MB':  50.e3}}
+
+# log(cost) = a + b log(NROWS) + c log(NPROC);  exponents assumed when the reports do not constrain them.
+prior_exponents = {'WALL_S': [1., -1.], 'PEAK_RSS_MB': [1., 0.]}
+
+def job_dir():
+    return  os.environ['GOLD_DIR'] + '/logs/jobs/'
+
+def job_report_path(name):
+    return  job_dir() + f'{name}.job.json'
+
+def expected_randoms(survey, field, dryrun=False, oversample=2, density=1., zmin=ddp_zlimits['DDP1'][0], zmax=ddp_zlimits['DDP1'][1]):
+    '''
+    Randoms per realisation, as generated by randoms.py.
+    '''
+    if survey == 'gama':
+        # Dryrun:  1x1 sq. deg. patch per field.
+        area   = 1. if dryrun else 60.
+
+    else:
+        limits = ros_limits(dryrun)
+        area   = np.pi * (limits[1]**2. - limits[0]**2.)
+
+    return  int(np.ceil((volcom(zmax, area) - volcom(zmin, area)) * density * oversample))
+
+def input_rows(job):
+    '''
+    Rows input to a job:  the gold catalogue for the gold stages, the randoms (of all realisations
+    for the d8 stages, the body randoms per field) otherwise.  None if not (yet) on disk.
+    '''
+    env     = job['env']
+    dryrun  = env.get('DRYRUN', '') != ''
+    survey  = env.get('SURVEY', 'gama')
+
+    if job['script'].startswith('gold'):
+        fpath = findfile(ftype='gold', dryrun=dryrun, survey=survey)
+
+        if not os.path.isfile(fpath):
+            return  None
+
+        return  len(read_desitable(fpath, columns=['ZSURV']))
+
+    if job['script'] in ['rand_field_pipeline', 'rand_ddp1_field_pipeline']:
+        # Body randoms, not oversampled.
+        return  expected_randoms(survey, env['FIELD'], dryrun=dryrun, oversample=1)
+
+    nrand   = expected_randoms(survey, env['FIELD'], dryrun=dryrun)
+
+    if job['script'] in ['rand_d8_pipeline', 'rand_ddp1_d8_pipeline']:
+        nrand *= oversample_nrealisations
+
+    return  nrand
+
+def job_features(job):
+    return  {'NROWS': input_rows(job), 'NPROC': job.get('cores', 1)}
+
+def write_job_report(job, wall_s, peak_rss_mb, success=True, start=None, features=None):
+    '''
+    Append a run of a job to its report, see calibrate.
+    '''
+    if features is None:
+        features = job_features(job)
+
+    rpath   = job_report_path(job['name'])
+    runs    = []
+
+    os.makedirs(job_dir(), exist_ok=True)
+
+    if os.path.isfile(rpath):
+        with open(rpath, 'r') as ff:
+            runs = json.load(ff)
+
+    runs.append({'NAME': job['name'], 'SCRIPT': job['script'], 'START': start, 'SUCCESS': bool(success), 'WALL_S': wall_s, 'PEAK_RSS_MB': peak_rss_mb, 'FEATURES': features})
+
+    with open(rpath, 'w') as ff:
+        json.dump(runs, ff, indent=2, default=str)
+
+    return  rpath
+
+def load_reports(script=None):
+    runs = []
+
+    for rpath in sorted(glob.glob(job_dir() + '*.job.json')):
+        with open(rpath, 'r') as ff:
+            runs += json.load(ff)
+
+    return  [run for run in runs if run['SUCCESS'] and (run['FEATURES']['NROWS'] is not None) and ((script is None) or (run['SCRIPT'] == script))]
+
+def fit_cost(runs, key):
+    '''
+    Least squares fit of log(cost) to log(NROWS) & log(NPROC), for the exponents constrained by the
+    spread of the runs;  prior_exponents otherwise.
+    '''
+    if len(runs) == 0:
+        return  None
+
+    X      = np.c_[np.ones(len(runs)), np.log([run['FEATURES']['NROWS'] for run in runs]), np.log([run['FEATURES']['NPROC'] for run in runs])]
+    y      = np.log([max(run[key], 1.e-3) for run in runs])
+
+    coeffs = np.array([0.] + prior_exponents[key])
+
+    free   = [0] + [ii for ii in [1, 2] if (np.ptp(X[:,ii]) > 0.) and (len(runs) > 2)]
+
+    if np.linalg.matrix_rank(X[:,free]) < len(free):
+        # Degenerate, e.g. nproc scaled with rows:  assume the nproc exponent.
+        free = free[:2]
+
+    fixed  = [ii for ii in [1, 2] if ii not in free]
+
+    coeffs[free], *_ = np.linalg.lstsq(X[:,free], y - X[:,fixed] @ coeffs[fixed], rcond=None)
+
+    scatter = np.std(y - X @ coeffs) if len(runs) > len(free) else 0.
+
+    return  {'COEFFS': coeffs.tolist(), 'SCATTER': scatter, 'NRUNS': len(runs)}
+
+def calibrate(scripts=None):
+    if scripts is None:
+        scripts = list(default_costs.keys())
+
+    return  {script: {key: fit_cost(load_reports(script), key) for key in ['WALL_S', 'PEAK_RSS_MB']} for script in scripts}
+
+def predict(job, calibration=None, features=None, safety={'WALL_S': 1.5, 'PEAK_RSS_MB': 1.25}):
+    '''
+    Wall time [s] & peak memory [MB] of a job, with a safety factor and twice the scatter of the
+    calibration;  the #SBATCH defaults without past runs.
+    '''
+    if job['script'] == 'packed_pipeline':
+        # Summed over members, see pack_jobs.
+        return  {'WALL_S': job['WALL_S'], 'PEAK_RSS_MB': job['PEAK_RSS_MB']}
+
+    if calibration is None:
+        calibration = calibrate([job['script']])
+
+    if features is None:
+        features = job_features(job)
+
+    if features['NROWS'] is None:
+        # Input not yet on disk, e.g. gold of a fresh run:  assume the size of the last run.
+        runs     = load_reports(job['script'])
+
+        if runs:
+            features = dict(features, NROWS=runs[-1]['FEATURES']['NROWS'])
+
+    result = {}
+
+    for key in ['WALL_S', 'PEAK_RSS_MB']:
+        fit = calibration[job['script']][key]
+
+        if (fit is None) or (features['NROWS'] is None):
+            result[key] = default_costs[job['script']][key]
+            continue
+
+        cost        = np.exp(np.dot(fit['COEFFS'], [1., np.log(features['NROWS']), np.log(features['NPROC'])]))
+        result[key] = cost * safety[key] * np.exp(2. * fit['SCATTER'])
+
+    return  result
+
+def sbatch_resources(job, calibration=None, min_time=600., max_time=72. * 3600., min_mem=4., max_mem=500.):
+    '''
+    --time & --mem of a job, rounded up to 5 mins & 1GB, within queue limits.
+    '''
+    cost    = predict(job, calibration=calibration)
+
+    wall    = np.clip(300. * np.ceil(cost['WALL_S'] / 300.), min_time, max_time)
+    mem     = np.clip(np.ceil(cost['PEAK_RSS_MB'] / 1.e3), min_mem, max_mem)
+
+    hours   = int(wall // 3600)
+    mins    = int((wall % 3600) // 60)
+
+    return  {'time': f'{hours:02d}:{mins:02d}:00', 'mem': f'{int(mem)}G', 'WALL_S': cost['WALL_S'], 'PEAK_RSS_MB': cost['PEAK_RSS_MB']}
+
+def write_pack(pack):
+    '''
+    Members of a pack to disk, for bin/packed_pipeline (see dag.run_packed).
+    '''
+    ppath = job_dir() + 'packed/{}.json'.format(pack['name'])
+
+    os.makedirs(os.path.dirname(ppath), exist_ok=True)
+
+    with open(ppath, 'w') as ff:
+        json.dump(pack['members'], ff, indent=2)
+
+    pack['env'] = dict(pack['members'][0]['env'], PACKED=ppath)
+
+    return  ppath
+
+def pack_jobs(jobs, calibration=None, min_wall=900., pack_wall=3600.):
+    '''
+    Pack short jobs (predicted below min_wall) of the same stage script & dependencies into a single job
+    running them in turn (see bin/packed_pipeline), of up to pack_wall;  dependents of a member depend on
+    its pack.
+    '''
+    if calibration is None:
+        calibration = calibrate()
+
+    result   = []
+    packs    = {}
+    renamed  = {}
+    unpacked = {}
+
+    for job in jobs:
+        deps = [renamed.get(dep, dep) for dep in job['deps']]
+        deps = list(dict.fromkeys(deps))
+
+        job  = dict(job, deps=deps)
+        cost = predict(job, calibration=calibration)
+
+        if (cost['WALL_S'] >= min_wall) or (job['script'] == 'packed_pipeline') or ('array' in job):
+            result.append(job)
+            continue
+
+        key  = (job['script'], tuple(deps))
+        pack = packs.get(key, None)
+
+        if (pack is None) or (pack['WALL_S'] + cost['WALL_S'] > pack_wall):
+            pack = {'name': '{}_packed{}'.format(job['script'], len([xx for xx in result if xx['script'] == 'packed_pipeline'])), 'script': 'packed_pipeline', 'env': {},\
+                    'deps': deps, 'cores': 0, 'mem': 0., 'members': [], 'WALL_S': 0., 'PEAK_RSS_MB': 0.}
+
+            packs[key] = pack
+
+            result.append(pack)
+
+        pack['members'].append(job)
+
+        pack['cores']        = max(pack['cores'], job['cores'])
+        pack['mem']          = max(pack['mem'],   job['mem'])
+        pack['WALL_S']      += cost['WALL_S']
+        pack['PEAK_RSS_MB']  = max(pack['PEAK_RSS_MB'], cost['PEAK_RSS_MB'])
+
+        renamed[job['name']] = pack['name']
+
+    for ii, pack in enumerate(result):
+        # Including node jobs, see dag.node_jobs, already written.
+        if (pack['script'] != 'packed_pipeline') or ('PACKED' in pack['env']):
+            continue
+
+        if len(pack['members']) == 1:
+            # Nothing to pack.
+            result[ii]              = pack['members'][0]
+            unpacked[pack['name']]  = pack['members'][0]['name']
+            continue
+
+        write_pack(pack)
+
+    for job in result:
+        job['deps'] = list(dict.fromkeys(unpacked.get(dep, dep) for dep in job['deps']))
+
+    return  result
+
+def parse_sacct(elapsed, maxrss):
+    days    = 0
+
+    if '-' in elapsed:
+        days, elapsed = elapsed.split('-')
+
+    parts   = [float(xx) for xx in elapsed.split(':')]
+    wall_s  = 86400. * float(days) + np.dot(parts[::-1], [1., 60., 3600.][:len(parts)])
+
+    units   = {'K': 1.e-3, 'M': 1., 'G': 1.e3, 'T': 1.e6}
+    rss_mb  = float(maxrss[:-1]) * units[maxrss[-1]] if maxrss and (maxrss[-1] in units) else float(maxrss or 0.) / 1.e6
+
+    return  wall_s, rss_mb
+
+def record_sacct(spath=None):
+    '''
+    Job reports of the slurm jobs of the last submission (see dag.submit_jobs), from sacct.
+    '''
+    if spath is None:
+        spath = job_dir() + 'submitted.json'
+
+    with open(spath, 'r') as ff:
+        submitted = json.load(ff)
+
+    for job in submitted:
+        out     = subprocess.check_output(['sacct', '-j', str(job['jobid']), '--format=JobID,Start,Elapsed,MaxRSS,State', '-P', '-n']).decode('utf-8')
+        lines   = [line.split('|') for line in out.strip().split('\n') if line]
+
+        if len(lines) == 0:
+            print('WARNING:  no accounting for {} ({}).'.format(job['name'], job['jobid']))
+            continue
+
+        # By job, or array task e.g. 1234_7;  its steps, e.g. 1234.batch, carry the MaxRSS.
+        tasks   = {}
+
+        for line in lines:
+            tasks.setdefault(line[0].split('.')[0], []).append(line)
+
+        for taskid, lines in tasks.items():
+            task    = dict(job)
+
+            if '_' in taskid:
+                # Array task of a realisation, see dag.array_jobs.
+                realz        = taskid.split('_')[1]
+                task['name'] = '{}_{}'.format(job['name'], realz)
+                task['env']  = dict(job['env'], REALZ=realz)
+
+            stats   = [parse_sacct(line[2], line[3]) for line in lines]
+
+            success = lines[0][4] == 'COMPLETED'
+
+            if success and job['script'] != 'packed_pipeline':
+                # Packed members report themselves.
+                write_job_report(task, max(xx[0] for xx in stats), max(xx[1] for xx in stats), success=success, start=lines[0][1])
+
+            print('{}\t{}\t{:.2f} mins\t{:.2f}MB'.format(task['name'].ljust(40), lines[0][4], max(xx[0] for xx in stats) / 60., max(xx[1] for xx in stats)))
+
+
+if __name__ == '__main__':
+    from   dag      import pipeline_jobs
+    from   findfile import fetch_fields
+
+    parser  = argparse.ArgumentParser(description='Cost model of pipeline jobs.')
+    parser.add_argument('--sacct',  help='Record the slurm jobs of the last submission.', action='store_true')
+    parser.add_argument('-s', '--survey', help='Select survey', default='gama')
+    parser.add_argument('-d', '--dryrun', help='Dryrun.', action='store_true')
+
+    args    = parser.parse_args()
+
+    if args.sacct:
+        record_sacct()
+
+    calibration = calibrate()
+
+    for script, fits in calibration.items():
+        print('{}\t{}'.format(script.ljust(30), '\t'.join('{}: {} runs'.format(key, 0 if fit is None else fit['NRUNS']) for key, fit in fits.items())))
+
+    print()
+
+    for job in pipeline_jobs(fetch_fields(args.survey), dryrun='--dryrun' if args.dryrun else '', survey=args.survey):
+        resources = sbatch_resources(job, calibration=calibration)
+
+        print('{}\t--time={}\t--mem={}'.format(job['name'].ljust(40), resources['time'], resources['mem']))
+
+    print('\n\nDone.\n\n')
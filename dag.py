@@ -0,0 +1,453 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import numpy      as     np
+
+from   pathlib    import Path
+from   params     import oversample_nrealisations
+from   utils      import run_command
+from   costmodel  import job_dir, write_job_report, calibrate, predict, sbatch_resources, pack_jobs, write_pack
+
+
+# Local (cores, memory [GB]) per job of each stage script;  a 64 core workstation runs e.g. 16 realisations at once.
+local_resources = {'gold_pipeline':            {'cores': 8, 'mem': 32.},\
+                   'rand_field_pipeline':      {'cores': 2, 'mem': 16.},\
+                   'rand_pipeline':            {'cores': 4, 'mem': 16.},\
+                   'rand_ddp1_field_pipeline': {'cores': 2, 'mem': 16.},\
+                   'rand_ddp1_pipeline':       {'cores': 4, 'mem': 16.},\
+                   'rand_d8_pipeline':         {'cores': 8, 'mem': 32.},\
+                   'rand_ddp1_d8_pipeline':    {'cores': 8, 'mem': 32.},\
+                   'gold_d8_pipeline':         {'cores': 16, 'mem': 64.}}
+
+# Stage scripts run once per field & realisation.
+realisation_scripts = ['rand_pipeline', 'rand_ddp1_pipeline']
+
+def pipeline_jobs(fields, dryrun='', reset=False, nooverwrite='', survey='gama', stages=None, nrealisations=oversample_nrealisations):
+    '''
+    Job graph of the pipeline, gold -> rand -> rand_ddp1 -> rand_d8 -> rand_ddp1_d8 -> gold_d8, in a
+    valid (topological) submission order.  Each job is a dict of name, stage script, env, dependencies
+    (job names) and local resources.  Dependencies on stages not requested are dropped.
+
+    The rand & rand_ddp1 stages are a job per field, for the body randoms & boundary, on which a job
+    per realisation, for the oversampled randoms & fill factors, depends.
+    '''
+    if stages == None:
+        stages = ['gold', 'rand', 'rand_ddp1', 'rand_d8', 'rand_ddp1_d8', 'gold_d8']
+
+    env     = {'DRYRUN': dryrun, 'RESET': str(int(reset)), 'NOOVERWRITE': nooverwrite, 'SURVEY': survey}
+    jobs    = []
+
+    def add(name, script, deps=[], **kwargs):
+        jenv = dict(env)
+        jenv.update({key.upper(): str(value) for key, value in kwargs.items()})
+
+        # As submitted previously, the d8 stages of the ddp1 randoms and gold do not reset.
+        if script in ['rand_ddp1_d8_pipeline', 'gold_d8_pipeline']:
+            jenv.pop('RESET')
+
+        jobs.append({'name': name, 'script': script, 'env': jenv, 'deps': list(deps)})
+        jobs[-1].update(local_resources[script])
+
+    # Generate all steps up to reference LF.
+    add('gold_pipeline', 'gold_pipeline')
+
+    for field in fields:
+        # No dependency.  Body randoms & boundary, shared by the realisations.
+        add(f'rand_field_pipeline_{field}', 'rand_field_pipeline', field=field)
+
+        for realz in np.arange(nrealisations):
+            # Generate all steps up to random fill factor and bound_dist.
+            add(f'rand_pipeline_{field}_{realz}', 'rand_pipeline', deps=[f'rand_field_pipeline_{field}'], field=field, realz=realz)
+
+    for field in fields:
+        # Requires gold ddp cat.  ddp1 randoms limited to ddp1 z limits - with corresponding fillfactors, bound_dist etc.
+        add(f'rand_ddp1_field_pipeline_{field}', 'rand_ddp1_field_pipeline', deps=['gold_pipeline'], field=field)
+
+        for realz in np.arange(nrealisations):
+            add(f'rand_ddp1_pipeline_{field}_{realz}', 'rand_ddp1_pipeline', deps=['gold_pipeline', f'rand_ddp1_field_pipeline_{field}'], field=field, realz=realz)
+
+    for field in fields:
+        # Requires ddp cat, & randoms; no reset required.
+        add(f'rand_d8_pipeline_{field}', 'rand_d8_pipeline', deps=['gold_pipeline'] + [f'rand_pipeline_{field}_{realz}' for realz in np.arange(nrealisations)], field=field)
+
+        add(f'rand_ddp1_d8_pipeline_{field}', 'rand_ddp1_d8_pipeline', deps=['gold_pipeline'] + [f'rand_ddp1_pipeline_{field}_{realz}' for realz in np.arange(nrealisations)], field=field)
+
+    # Requires ddp cat. & random fill factor;  runs all fields simultaneously.
+    add('gold_d8_pipeline', 'gold_d8_pipeline', deps=[f'rand_ddp1_d8_pipeline_{field}' for field in fields])
+
+    # Per field jobs are of the stage of their realisations.
+    jobs    = [job for job in jobs if job['script'].replace('_field', '').replace('_pipeline', '') in stages]
+    names   = set(job['name'] for job in jobs)
+
+    for job in jobs:
+        job['deps'] = [dep for dep in job['deps'] if dep in names]
+
+    return  jobs
+
+def load_state(state_path):
+    if (state_path is not None) and os.path.isfile(state_path):
+        with open(state_path, 'r') as ff:
+            return  json.load(ff)
+
+    return  {}
+
+def save_state(state_path, state):
+    if state_path is None:
+        return
+
+    with open(state_path + '.tmp', 'w') as ff:
+        json.dump(state, ff, indent=2)
+
+    os.replace(state_path + '.tmp', state_path)
+
+def run_local(jobs, ncores=64, mem=256., logdir=None, state_path=None, code_root=None, poll=5., echo=False):
+    '''
+    Run a job graph on the local machine:  jobs whose dependencies completed are launched as
+    subprocesses, in submission order, while their cores & memory fit in the budget.  Completion
+    is tracked in a json state file, such that a re-run skips completed jobs;  a failed job fails
+    its dependents.  The wall time & peak rss of each job is reported for the cost model, see
+    costmodel.py.  Returns the final state, {name: DONE | FAILED | SKIPPED}.
+    '''
+    if logdir is None:
+        logdir  = os.environ['GOLD_DIR'] + '/logs/'
+
+    if code_root is None:
+        code_root = os.environ.get('CODE_ROOT', os.getcwd())
+
+    Path(logdir).mkdir(parents=True, exist_ok=True)
+
+    state       = load_state(state_path)
+    state       = {job['name']: state[job['name']] for job in jobs if state.get(job['name'], None) == 'DONE'}
+
+    if len(state) > 0:
+        print(f'Skipping {len(state)} completed jobs.')
+
+    pending     = [job for job in jobs if job['name'] not in state]
+    running     = {}
+
+    free_cores  = ncores
+    free_mem    = mem
+
+    for job in pending:
+        if (job['cores'] > ncores) | (job['mem'] > mem):
+            print('WARNING:  {} requests {} cores & {:.1f}GB, exceeding the budget;  clipping.'.format(job['name'], job['cores'], job['mem']))
+
+            job['cores'] = min(job['cores'], ncores)
+            job['mem']   = min(job['mem'], mem)
+
+    while (len(pending) > 0) | (len(running) > 0):
+        launched = False
+
+        for job in list(pending):
+            status = [state.get(dep, None) for dep in job['deps']]
+
+            if any(ss in ['FAILED', 'SKIPPED'] for ss in status):
+                print('Skipping {}:  failed dependency.'.format(job['name']))
+
+                state[job['name']] = 'SKIPPED'
+                pending.remove(job)
+
+                continue
+
+            if not all(ss == 'DONE' for ss in status):
+                continue
+
+            if (job['cores'] > free_cores) | (job['mem'] > free_mem):
+                continue
+
+            env   = dict(os.environ)
+            env.update(job['env'])
+            env['CODE_ROOT'] = code_root
+
+            log   = '{}/{}.log'.format(logdir, job['name'])
+            cmd   = [job['script']] if not echo else ['echo', job['script']]
+
+            print('Launching {} ({} cores, {:.1f}GB);  logging to {}'.format(job['name'], job['cores'], job['mem'], log))
+
+            ff    = open(log, 'w')
+
+            try:
+                proc  = subprocess.Popen(cmd, env=env, stdout=ff, stderr=subprocess.STDOUT)
+
+            except OSError as exc:
+                # E.g. a missing or non-executable script;  fails its dependents, as a non-zero exit.
+                print('{} FAILED to launch:  {}'.format(job['name'], exc))
+
+                ff.write('Failed to launch {}:  {}\n'.format(cmd, exc))
+                ff.close()
+
+                state[job['name']] = 'FAILED'
+                pending.remove(job)
+
+                save_state(state_path, state)
+
+                launched = True
+
+                continue
+
+            running[job['name']] = (job, proc, ff, time.time())
+
+            free_cores -= job['cores']
+            free_mem   -= job['mem']
+
+            pending.remove(job)
+
+            launched    = True
+
+        finished = False
+
+        for name in list(running):
+            job, proc, ff, start = running[name]
+
+            # As proc.poll, with the resource usage of the job (& its waited for children).
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+
+            if pid == 0:
+                continue
+
+            proc.returncode = os.waitstatus_to_exitcode(status)
+
+            ff.close()
+
+            state[name] = 'DONE' if proc.returncode == 0 else 'FAILED'
+
+            if not echo:
+                write_job_report(job, time.time() - start, usage.ru_maxrss / 1.e3, success=proc.returncode == 0, start=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start)))
+
+            print('{} {} in {:.1f} minutes (exit code {}).'.format(name, state[name], (time.time() - start) / 60., proc.returncode))
+
+            free_cores += job['cores']
+            free_mem   += job['mem']
+
+            del running[name]
+
+            finished    = True
+
+        if finished:
+            save_state(state_path, state)
+
+        if (not launched) & (not finished) & (len(running) > 0):
+            time.sleep(poll)
+
+        elif (not launched) & (not finished) & (len(running) == 0) & (len(pending) > 0):
+            # Unsatisfiable dependencies, e.g. not in the graph.
+            for job in pending:
+                print('Skipping {}:  unresolved dependencies {}.'.format(job['name'], job['deps']))
+
+                state[job['name']] = 'SKIPPED'
+
+            pending = []
+
+    save_state(state_path, state)
+
+    ndone = sum(ss == 'DONE' for ss in state.values())
+
+    print(f'\n\n>>>>>  {ndone} of {len(jobs)} jobs completed.  <<<<<\n\n')
+
+    return  state
+
+def run_packed(ppath, ncores=None, mem=1.e6, code_root=None):
+    '''
+    Run the member jobs of a pack (see costmodel.pack_jobs), e.g. within a slurm job of
+    bin/packed_pipeline;  by default one at a time.  Returns the number of failed members.
+    '''
+    with open(ppath, 'r') as ff:
+        members = json.load(ff)
+
+    # Dependencies of the pack are satisfied.
+    members = [dict(job, deps=[]) for job in members]
+
+    if ncores is None:
+        ncores = max(job['cores'] for job in members)
+
+    state   = run_local(members, ncores=ncores, mem=mem, state_path=ppath.replace('.json', '.state.json'), code_root=code_root)
+
+    return  sum(ss != 'DONE' for ss in state.values())
+
+def array_spec(indices):
+    '''
+    sbatch --array of a list of indices, e.g. [0, 1, 2, 5] -> 0-2,5.
+    '''
+    indices = sorted(indices)
+    parts   = []
+
+    for ii in indices:
+        if parts and (ii == parts[-1][1] + 1):
+            parts[-1][1] = ii
+
+        else:
+            parts.append([ii, ii])
+
+    return  ','.join(str(lo) if lo == hi else f'{lo}-{hi}' for lo, hi in parts)
+
+def array_jobs(jobs):
+    '''
+    One slurm array job per realisation stage script & field, the array task index being the
+    realisation (see bin/rand_pipeline);  dependents of a realisation depend on the whole array.
+    '''
+    result  = []
+    arrays  = {}
+    renamed = {}
+
+    for job in jobs:
+        deps = list(dict.fromkeys(renamed.get(dep, dep) for dep in job['deps']))
+        job  = dict(job, deps=deps)
+
+        if job['script'] not in realisation_scripts:
+            result.append(job)
+            continue
+
+        key  = (job['script'], job['env']['FIELD'], tuple(deps))
+
+        if key not in arrays:
+            env         = {kk: vv for kk, vv in job['env'].items() if kk != 'REALZ'}
+            arrays[key] = dict(job, name='{}_{}'.format(job['script'], job['env']['FIELD']), env=env, array=[])
+
+            result.append(arrays[key])
+
+        arrays[key]['array'].append(int(job['env']['REALZ']))
+
+        renamed[job['name']] = arrays[key]['name']
+
+    for job in arrays.values():
+        job['array'] = array_spec(job['array'])
+
+    return  result
+
+def node_jobs(jobs, per_node=8, node_mem=500.e3, calibration=None):
+    '''
+    Pack up to per_node realisations of a stage script & field into a single node job, running them
+    concurrently (see bin/packed_pipeline), within node_mem [MB] predicted;  dependents of a
+    realisation depend on its node job.
+    '''
+    if calibration is None:
+        calibration = calibrate(realisation_scripts)
+
+    result  = []
+    packs   = []
+    nodes   = {}
+    counts  = {}
+    renamed = {}
+
+    for job in jobs:
+        deps = list(dict.fromkeys(renamed.get(dep, dep) for dep in job['deps']))
+        job  = dict(job, deps=deps)
+
+        if job['script'] not in realisation_scripts:
+            result.append(job)
+            continue
+
+        cost = predict(job, calibration=calibration)
+        key  = (job['script'], job['env']['FIELD'], tuple(deps))
+        node = nodes.get(key, None)
+
+        if (node is None) or (len(node['members']) == per_node) or (node['PEAK_RSS_MB'] + cost['PEAK_RSS_MB'] > node_mem):
+            count       = counts[key[:2]] = counts.get(key[:2], -1) + 1
+
+            node        = {'name': '{}_{}_node{}'.format(job['script'], job['env']['FIELD'], count), 'script': 'packed_pipeline', 'env': {},\
+                           'deps': deps, 'cores': 0, 'mem': 0., 'members': [], 'WALL_S': 0., 'PEAK_RSS_MB': 0.}
+
+            nodes[key]  = node
+
+            packs.append(node)
+            result.append(node)
+
+        node['members'].append(job)
+
+        node['cores']       += job['cores']
+        node['mem']         += job['mem']
+        node['WALL_S']       = max(node['WALL_S'], cost['WALL_S'])
+        node['PEAK_RSS_MB'] += cost['PEAK_RSS_MB']
+
+        renamed[job['name']] = node['name']
+
+    for node in packs:
+        write_pack(node)
+
+        # All members at once.
+        node['env']['PACKED_NCORES'] = str(node['cores'])
+
+    return  result
+
+def submit_jobs(jobs, use_sbatch=1, code_root=None, resize=True, pack=True, array=False, per_node=None):
+    '''
+    Submit a job graph via serialorparallel, with dependencies;  with slurm, each job requests the
+    --time & --mem predicted by the cost model, and short jobs are packed.  The realisations of each
+    field may be submitted as an array job, or per_node at once to a multi-core node job.  The
+    submitted jobs are recorded for costmodel.record_sacct.  Returns {name: jobid}.
+    '''
+    if code_root is None:
+        code_root = os.environ['CODE_ROOT']
+
+    if use_sbatch & (resize | pack | (per_node is not None)):
+        calibration = calibrate()
+
+    if use_sbatch & (per_node is not None):
+        njobs = len(jobs)
+        jobs  = node_jobs(jobs, per_node=per_node, calibration=calibration)
+
+        print('Packed {} jobs to {}, with concurrent node jobs of realisations.'.format(njobs, len(jobs)))
+
+    elif use_sbatch & array:
+        njobs = len(jobs)
+        jobs  = array_jobs(jobs)
+
+        print('Submitting {} jobs as {}, with array jobs of realisations.'.format(njobs, len(jobs)))
+
+    if use_sbatch & pack:
+        njobs = len(jobs)
+        jobs  = pack_jobs(jobs, calibration=calibration)
+
+        print('Packed {} jobs to {}.'.format(njobs, len(jobs)))
+
+    jobids    = {}
+    submitted = []
+
+    #
+    # https://slurm.schedmd.com/sbatch.html
+    #
+    for job in jobs:
+        cmd = 'serialorparallel -n {} -p {:d} -e {}'.format(job['name'], int(use_sbatch), ','.join(f'{key}={value}' for key, value in job['env'].items()))
+
+        if len(job['deps']) > 0:
+            cmd += ' -d {}'.format(','.join(str(jobids[dep]) for dep in job['deps']))
+
+        if use_sbatch & resize:
+            resources = sbatch_resources(job, calibration=calibration)
+
+            cmd += ' -m {} -t {}'.format(resources['mem'], resources['time'])
+
+        if use_sbatch & ('array' in job):
+            cmd += ' -a {}'.format(job['array'])
+
+        if use_sbatch & ('PACKED_NCORES' in job['env']):
+            cmd += ' -k {}'.format(job['cores'])
+
+        cmd += ' -s {} -c {}'.format(job['script'], code_root)
+
+        jobids[job['name']] = run_command(cmd)
+
+        submitted.append({'name': job['name'], 'script': job['script'], 'env': job['env'], 'cores': job['cores'], 'array': job.get('array', None), 'jobid': jobids[job['name']]})
+
+        print('\n>>>>> {} JOB ID:  {} <<<<<'.format(job['name'].upper(), jobids[job['name']]))
+
+    if use_sbatch:
+        os.makedirs(job_dir(), exist_ok=True)
+
+        with open(job_dir() + 'submitted.json', 'w') as ff:
+            json.dump(submitted, ff, indent=2)
+
+    return  jobids
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Run the member jobs of a pack, see bin/packed_pipeline.')
+    parser.add_argument('--packed', help='Pack of jobs (json), see costmodel.pack_jobs.', type=str, required=True)
+    parser.add_argument('--ncores', help='Cores to run members concurrently;  defaults to one at a time.', type=int, default=None)
+
+    args    = parser.parse_args()
+
+    sys.exit(run_packed(args.packed, ncores=args.ncores))
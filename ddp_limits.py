@@ -61,28 +61,12 @@ def grab_ddplimit(fpath):
     
     return result
 
-if __name__ == '__main__':
-    parser   = argparse.ArgumentParser(description='Gen kE DDP limit curves')
-    parser.add_argument('--log', help='Create a log file of stdout.', action='store_true')
-    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
-    parser.add_argument('--config',       help='Path to configuration file', type=str, default=findfile('config'))
-    parser.add_argument('-s', '--survey', help='Select survey', default='gama')
-
-    args     = parser.parse_args()
-    log      = args.log
-    survey   = args.survey.lower()
-    
-    config   = Configuration(args.config)
-    config.update_attributes('ddp_limits', args)
-    config.write()
-    
-    if log:
-        logfile = findfile(ftype='ddp_limit', dryrun=False, survey=survey, log=True)
-
-        print(f'Logging to {logfile}')
-
-        sys.stdout = open(logfile, 'w')
-
+def ddp_limit_curves(survey='gama', rlims=None, nooverwrite=False):
+    '''
+    Limiting abs. mag. curves of each rest-frame colour (and Q) for the bright and faint
+    limits, [rmax, rlim];  written to $GOLD_DIR/ddrp_limits/ with a summary, as read by
+    limiting_curve_path.
+    '''
     kcorr_r  = GAMA_KCorrection(band='R')
     kcorr_RG = GAMA_KCorrection_color()
 
@@ -91,8 +75,9 @@ if __name__ == '__main__':
     gmrs_0p0 = np.array([0.158, 0.298, 0.419, 0.553, 0.708, 0.796, 0.960])
 
     # bright and faint limits.   
-    rlims    = [fetch_header(ftype='gold', name='RMAX', survey=survey),\
-                fetch_header(ftype='gold', name='RLIM', survey=survey)]
+    if rlims is None:
+        rlims = [fetch_header(ftype='gold', name='RMAX', survey=survey),\
+                 fetch_header(ftype='gold', name='RLIM', survey=survey)]
 
     root     = os.environ['GOLD_DIR'] + f'/ddrp_limits/'
 
@@ -119,7 +104,7 @@ if __name__ == '__main__':
                 # Fortran indexing.
                 color_idx += 1
 
-                if args.nooverwrite & os.path.isfile(opath):
+                if nooverwrite & os.path.isfile(opath):
                     hdul = fits.open(opath)
                     hdr  = hdul[0].header  # the primary HDU header
 
@@ -171,5 +156,32 @@ if __name__ == '__main__':
 
     print('\n\nDone.\n\n')
 
+    return  opath
+
+
+if __name__ == '__main__':
+    parser   = argparse.ArgumentParser(description='Gen kE DDP limit curves')
+    parser.add_argument('--log', help='Create a log file of stdout.', action='store_true')
+    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
+    parser.add_argument('--config',       help='Path to configuration file', type=str, default=findfile('config'))
+    parser.add_argument('-s', '--survey', help='Select survey', default='gama')
+
+    args     = parser.parse_args()
+    log      = args.log
+    survey   = args.survey.lower()
+    
+    config   = Configuration(args.config)
+    config.update_attributes('ddp_limits', args)
+    config.write()
+    
+    if log:
+        logfile = findfile(ftype='ddp_limit', dryrun=False, survey=survey, log=True)
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    ddp_limit_curves(survey=survey, nooverwrite=args.nooverwrite)
+
     if log:
         sys.stdout.close()
@@ -24,3 +24,27 @@ def delta8_tier(delta8):
         result[(delta8 >= lims[0]) & (delta8 < lims[1])] = i
 
     return  result
+
+def d8_edges(limits=d8_limits):
+    '''
+    Tier edges for contiguous delta8 limits, e.g. d8_limits.
+    '''
+    limits = np.array(limits)
+
+    assert  np.all(limits[1:,0] == limits[:-1,1])
+
+    return  np.append(limits[:,0], limits[-1,1])
+
+def delta8_tier_edges(delta8, edges):
+    '''
+    As delta8_tier, for arbitrary (increasing) tier edges:  edges[i] <= delta8 < edges[i+1] is tier i,
+    -99 outwith.
+    '''
+    edges  = np.array(edges, dtype=float)
+
+    assert  np.all(np.diff(edges) > 0.)
+
+    result = np.searchsorted(edges, delta8, side='right') - 1
+    result[(result < 0) | (result >= len(edges) - 1)] = -99
+
+    return  result
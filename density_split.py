@@ -0,0 +1,178 @@
+import sys
+import argparse
+import numpy           as     np
+import astropy.io.fits as     fits
+
+from   astropy.table   import Table
+from   delta8_limits   import d8_limits, d8_edges, delta8_tier_edges
+from   volfracs        import volavg_index, volavg_retier
+from   gen_gold_lf     import process_tier
+from   params          import fillfactor_threshold
+from   findfile        import findfile, call_signature, overwrite_check
+
+
+def tier_volfracs(index, edges, zmin, zmax):
+    '''
+    Volume fraction and mean delta8 of each tier (and self count tier) for arbitrary delta8 tier edges,
+    from the randoms with zmin < z < zmax passing the fillfactor cut.  Equivalent to the DDP1_d{ut}_VOLFRAC,
+    DDP1_d{ut}_TIERMEDd8 (& ZEROPOINT) header keywords of volfracs for edges of d8_limits.
+    '''
+    ntier      = len(edges) - 1
+
+    # Index is sorted by Z.
+    lo         = np.searchsorted(index['Z'], zmin, side='right')
+    hi         = np.searchsorted(index['Z'], zmax, side='left')
+
+    isin       = index['FILLFACTOR'][lo:hi] >= fillfactor_threshold
+    nrand      = np.count_nonzero(isin)
+
+    result     = Table()
+    result['TIER']  = np.arange(ntier)
+    result['D8LO']  = edges[:-1]
+    result['D8HI']  = edges[1:]
+
+    for zp in ['', '_ZEROPOINT']:
+        delta8 = index['DDP1_DELTA8{}'.format(zp)][lo:hi][isin]
+        tiers  = delta8_tier_edges(delta8, edges)
+
+        valid  = tiers >= 0
+
+        counts = np.bincount(tiers[valid], minlength=ntier)
+        sums   = np.bincount(tiers[valid], weights=delta8[valid], minlength=ntier)
+
+        # Empty tiers default to the tier mid point, as volfracs.
+        med    = np.where(counts > 0, sums / np.maximum(counts, 1), 0.5 * (edges[:-1] + edges[1:]))
+
+        result['VOLFRAC{}'.format(zp)]   = counts / nrand
+        result['TIERMEDd8{}'.format(zp)] = med
+
+    result.meta['NRAND']   = nrand
+    result.meta['ZMIN']    = zmin
+    result.meta['ZMAX']    = zmax
+    result.meta['EXTNAME'] = 'TIERS'
+
+    return  result
+
+def density_split_lumfn(dat, edges=None, index=None, Mcols=['MCOLOR_0P0'], stepwise=False, nproc=12):
+    '''
+    Density split luminosity functions for arbitrary delta8 tier edges, straight from the (multi-field)
+    ddp_n8 catalogue.  Galaxies are assigned tiers by a sorted search on DDP1_DELTA8 and grouped by
+    a single sort;  the volume average fillfactor index is re-tiered, such that each tier LF is
+    equivalent to that of the ddp_n8_d0 catalogues (for edges of d8_limits).
+
+    Returns the tier volume fractions and a dict of (vmax, lumfn, lumfn_step, reference) per tier.
+    '''
+    if edges is None:
+        edges      = d8_edges(d8_limits)
+
+    edges          = np.array(edges, dtype=float)
+
+    if index is None:
+        # HACK SURVEYHACK: must match vmaxer.
+        index      = volavg_index(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1')
+
+    retiered       = volavg_retier(index, edges)
+
+    # Limited to DDP1 (and redshift range), see gen_ddp_n8.py.
+    dat            = dat[(dat['ZSURV'] > dat.meta['DDP1_ZMIN']) & (dat['ZSURV'] < dat.meta['DDP1_ZMAX'])]
+
+    volfracs       = tier_volfracs(retiered, edges, dat.meta['DDP1_ZMIN'], dat.meta['DDP1_ZMAX'])
+
+    volfracs.pprint()
+
+    tiers          = delta8_tier_edges(dat['DDP1_DELTA8'].data, edges)
+
+    # Group galaxies by tier with one sort;  -99 leads.
+    idx            = np.argsort(tiers, kind='stable')
+    tiers          = tiers[idx]
+    dat            = dat[idx]
+
+    dat['DDP1_DELTA8_TIER'] = tiers
+
+    bounds         = np.searchsorted(tiers, np.arange(len(edges)), side='left')
+
+    results        = {}
+
+    for tier in range(len(edges) - 1):
+        zmax       = dat[bounds[tier]:bounds[tier + 1]]
+
+        if len(zmax) == 0:
+            print(f'No galaxies in tier {tier}, nothing to be done.')
+            continue
+
+        print(f'\n\n\n\n----------------  Solving for density tier {tier}: {edges[tier]:.3f} <= d8 < {edges[tier+1]:.3f}  ----------------\n\n')
+
+        d8         = float(volfracs['TIERMEDd8'][tier])
+
+        vmax, lf, lf_step, ref = process_tier(zmax, fillfactor=True, tier=tier, d8=d8, index=retiered, Mcols=Mcols, stepwise=stepwise, nproc=nproc)
+
+        for tab in lf + lf_step:
+            tab.meta['DDP1_D8']      = d8
+            tab.meta['DDP1_VOLFRAC'] = volfracs['VOLFRAC'][tier]
+            tab.meta['D8LO']         = edges[tier]
+            tab.meta['D8HI']         = edges[tier + 1]
+            tab.meta['EXTNAME']      = '{}_D{}'.format(tab.meta['EXTNAME'], tier)
+
+        ref.meta['EXTNAME'] = 'REFERENCE_D{}'.format(tier)
+
+        results[tier] = [vmax, lf, lf_step, ref]
+
+    return  volfracs, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gold density split LFs for arbitrary delta8 tier edges.')
+    parser.add_argument('--log', help='Create a log file of stdout.', action='store_true')
+    parser.add_argument('--survey', help='Select survey', default='gama')
+    parser.add_argument('--dryrun', action='store_true', help='dryrun.')
+    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
+    parser.add_argument('--edges', type=float, nargs='+', help='Increasing delta8 tier edges; defaults to d8_limits.', default=None)
+    parser.add_argument('--Mcols', type=str, nargs='+', help='Abs. mag. definitions.', default=['MCOLOR_0P0'])
+    parser.add_argument('--stepwise', help='Include stepwise LFs.', action='store_true')
+    parser.add_argument('--nproc', type=int, help='Number of processors', default=12)
+
+    args   = parser.parse_args()
+
+    log    = args.log
+    dryrun = args.dryrun
+    survey = args.survey
+
+    fpath  = findfile(ftype='ddp_n8',           dryrun=dryrun, survey=survey)
+    opath  = findfile(ftype='ddp_n8_lumfn_split', dryrun=dryrun, survey=survey)
+
+    if log:
+        logfile = findfile(ftype='ddp_n8_lumfn_split', dryrun=False, survey=survey, log=True)
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    if args.nooverwrite:
+        overwrite_check(opath)
+
+    call_signature(dryrun, sys.argv)
+
+    print(f'Reading: {fpath}')
+
+    dat    = Table.read(fpath)
+
+    volfracs, results = density_split_lumfn(dat, edges=args.edges, Mcols=args.Mcols, stepwise=args.stepwise, nproc=args.nproc)
+
+    print(f'Writing: {opath}')
+
+    hx     = fits.HDUList()
+    hx.append(fits.PrimaryHDU())
+    hx.append(fits.convenience.table_to_hdu(volfracs))
+
+    for tier in results:
+        _, lf, lf_step, ref = results[tier]
+
+        for tab in lf + lf_step + [ref]:
+            hx.append(fits.convenience.table_to_hdu(tab))
+
+    hx.writeto(opath, overwrite=True)
+
+    print('Done.')
+
+    if log:
+        sys.stdout.close()
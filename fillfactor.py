@@ -15,8 +15,8 @@ from   datetime            import datetime
 from   scipy.spatial       import KDTree
 from   astropy.table       import Table
 from   multiprocessing     import Pool
-from   runtime             import calc_runtime
-from   findfile            import findfile, fetch_fields, overwrite_check, call_signature, gather_cat
+from   runtime             import calc_runtime, stage, pool_imap
+from   findfile            import findfile, fetch_fields, overwrite_check, call_signature, gather_cat, stage_hash
 from   config              import Configuration
 from   ddp_zlimits         import ddp_zlimits
 from   params              import sphere_radius
@@ -126,179 +126,187 @@ def process_one(run, pid=0, start=0.0):
 def fillfactor(log, field, dryrun, prefix, survey, oversample, nproc, realz, nooverwrite, debug=False):
     opath    = findfile(ftype='randoms_n8', dryrun=dryrun, field=field, survey=survey, prefix=prefix, realz=realz)
 
+    # Oversampled realisation & realisation zero.
+    inpaths  = [findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix, oversample=oversample, realz=realz),\
+                findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix, realz=0)]
+
+    inhash   = stage_hash(inputs=[x for x in inpaths if os.path.isfile(x)], params={'sphere_radius': sphere_radius})
+
     if nooverwrite:
-        overwrite_check(opath)
+        overwrite_check(opath, inhash=inhash)
 
-    start    = time.time()
+    with stage('fillfactor', opath=opath):
+        start    = time.time()
 
-    call_signature(dryrun, sys.argv)
+        call_signature(dryrun, sys.argv)
     
-    fpath          = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix, oversample=oversample, realz=realz)
-    overpoints_hdr = fitsio.read_header(fpath, ext=1)
+        fpath          = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix, oversample=oversample, realz=realz)
+        overpoints_hdr = fitsio.read_header(fpath, ext=1)
 
-    _overpoints    = fitsio.read(fpath, ext=1, columns=['CARTESIAN_X', 'CARTESIAN_Y', 'CARTESIAN_Z'])
-    overpoints     = np.c_[_overpoints['CARTESIAN_X'], _overpoints['CARTESIAN_Y'], _overpoints['CARTESIAN_Z']]
+        _overpoints    = fitsio.read(fpath, ext=1, columns=['CARTESIAN_X', 'CARTESIAN_Y', 'CARTESIAN_Z'])
+        overpoints     = np.c_[_overpoints['CARTESIAN_X'], _overpoints['CARTESIAN_Y'], _overpoints['CARTESIAN_Z']]
 
-    print(f'Fetching {fpath}')
-    print('Fetched x{} oversampled randoms.'.format(overpoints_hdr['OVERSAMPLE']))
+        print(f'Fetching {fpath}')
+        print('Fetched x{} oversampled randoms.'.format(overpoints_hdr['OVERSAMPLE']))
 
-    # Read randoms file, split by field (DDP1, or not).                                                                                                                                                  
-    # Note: realz handles oversampled realizations only.
-    fpath          = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix, realz=0)
-    points_hdr     = fitsio.read_header(fpath, ext=1)
+        # Read randoms file, split by field (DDP1, or not).                                                                                                                                                  
+        # Note: realz handles oversampled realizations only.
+        fpath          = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix, realz=0)
+        points_hdr     = fitsio.read_header(fpath, ext=1)
 
-    _points        = fitsio.read(fpath, ext=1, columns=['CARTESIAN_X', 'CARTESIAN_Y', 'CARTESIAN_Z'])
-    points         = np.c_[_points['CARTESIAN_X'], _points['CARTESIAN_Y'], _points['CARTESIAN_Z']]
+        _points        = fitsio.read(fpath, ext=1, columns=['CARTESIAN_X', 'CARTESIAN_Y', 'CARTESIAN_Z'])
+        points         = np.c_[_points['CARTESIAN_X'], _points['CARTESIAN_Y'], _points['CARTESIAN_Z']]
  
-    print(f'Fetching {fpath}')
-    print('Fetched randoms of density {}.'.format(points_hdr['RAND_DENS']))
+        print(f'Fetching {fpath}')
+        print('Fetched randoms of density {}.'.format(points_hdr['RAND_DENS']))
     
-    del _points
-    del _overpoints
+        del _points
+        del _overpoints
 
-    runtime        = calc_runtime(start, 'Reading {:.2f}M randoms'.format(len(overpoints) / 1.e6), xx=overpoints)
+        runtime        = calc_runtime(start, 'Reading {:.2f}M randoms'.format(len(overpoints) / 1.e6), xx=overpoints)
 
-    print('Sorting.')
+        print('Sorting.')
 
-    idx            = np.argsort(points[:,0])
-    points         = points[idx]
+        idx            = np.argsort(points[:,0])
+        points         = points[idx]
 
-    idx            = np.argsort(overpoints[:,0])
-    overpoints     = overpoints[idx]
+        idx            = np.argsort(overpoints[:,0])
+        overpoints     = overpoints[idx]
 
-    if debug:
-        print('Assuming debug configuration.')
+        if debug:
+            print('Assuming debug configuration.')
 
-        debug_downsample = 5
+            debug_downsample = 5
 
-        points           = points[::debug_downsample] 
-        overpoints       = overpoints[::debug_downsample]
+            points           = points[::debug_downsample] 
+            overpoints       = overpoints[::debug_downsample]
 
-        print(f'Downsampling randoms by x{debug_downsample}.')
+            print(f'Downsampling randoms by x{debug_downsample}.')
 
-    runtime     = calc_runtime(start, 'Sorted randoms by X')
+        runtime     = calc_runtime(start, 'Sorted randoms by X')
 
-    # Chunked in x.
-    split_idx   = np.arange(len(points))
-    split_idx   = np.array_split(split_idx, 4 * nproc)
+        # Chunked in x.
+        split_idx   = np.arange(len(points))
+        split_idx   = np.array_split(split_idx, 4 * nproc)
 
-    nchunk      = len(split_idx)
+        nchunk      = len(split_idx)
 
-    runs        = []
+        runs        = []
 
-    for i, idx in enumerate(split_idx):
-        split      = points[idx]
+        for i, idx in enumerate(split_idx):
+            split      = points[idx]
 
-        xmin       = split[:,0].min()
-        xmax       = split[:,0].max()
+            xmin       = split[:,0].min()
+            xmax       = split[:,0].max()
     
-        buff       = .1  # [Mpc/h] 
+            buff       = .1  # [Mpc/h] 
     
-        # Complement uses the oversampled version
-        complement = (overpoints[:,0] > (xmin - sphere_radius - buff)) & (overpoints[:,0] < (xmax + sphere_radius + buff))
-        complement = overpoints[complement]
+            # Complement uses the oversampled version
+            complement = (overpoints[:,0] > (xmin - sphere_radius - buff)) & (overpoints[:,0] < (xmax + sphere_radius + buff))
+            complement = overpoints[complement]
     
-        cmin       = complement[:,0].min()
-        cmax       = complement[:,0].max() 
+            cmin       = complement[:,0].min()
+            cmax       = complement[:,0].max() 
 
-        print('{:d}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:d}\t{:d}'.format(i, xmin, xmax, cmin, cmax, len(split), len(complement)))
+            print('{:d}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:d}\t{:d}'.format(i, xmin, xmax, cmin, cmax, len(split), len(complement)))
 
-        # leafsize=5
-        split_tree = KDTree(split)
+            # leafsize=5
+            split_tree = KDTree(split)
 
-        runs.append([split_tree, complement])
+            runs.append([split_tree, complement])
 
-    runtime = calc_runtime(start, 'Created {} big trees and complement chunked by ...'.format(nchunk))
+        runtime = calc_runtime(start, 'Created {} big trees and complement chunked by ...'.format(nchunk))
 
-    del points
-    del overpoints
-    del split
-    del split_idx
+        del points
+        del overpoints
+        del split
+        del split_idx
 
-    runtime     = calc_runtime(start, 'Deleted rand.')
+        runtime     = calc_runtime(start, 'Deleted rand.')
 
-    runtime     = calc_runtime(start, 'POOL:  Counting < 8 Mpc/h pairs for small trees.')
+        runtime     = calc_runtime(start, 'POOL:  Counting < 8 Mpc/h pairs for small trees.')
 
-    pool_start  = time.time()
+        pool_start  = time.time()
 
-    results     = [process_one(runs[0], pid=0, start=start)]
+        results     = [process_one(runs[0], pid=0, start=start)]
 
-    split_time  = time.time() - pool_start
-    split_time /= 60.
+        split_time  = time.time() - pool_start
+        split_time /= 60.
 
-    runtime     = calc_runtime(start, 'POOL:  Expected runtime of {:.6f} minutes with {:d} proc. and split time {:.6f} mins'.format(nchunk * split_time / nproc, nproc, split_time))
+        runtime     = calc_runtime(start, 'POOL:  Expected runtime of {:.6f} minutes with {:d} proc. and split time {:.6f} mins'.format(nchunk * split_time / nproc, nproc, split_time))
 
-    done_nsplit = 1
+        done_nsplit = 1
 
-    # maxtasksperchild:  restart process after max tasks to contain resource leaks;
-    with multiprocessing.get_context('spawn').Pool(nproc, maxtasksperchild=4) as pool:
-        total   = (nchunk-1)
+        # maxtasksperchild:  restart process after max tasks to contain resource leaks;
+        with multiprocessing.get_context('spawn').Pool(nproc, maxtasksperchild=4) as pool:
+            total   = (nchunk-1)
 
-        with tqdm.tqdm(total=total) as pbar:
-            for result in pool.imap(partial(process_one, start=start), iterable=runs[1:], chunksize=4):
-                results.append(result)
+            with tqdm.tqdm(total=total) as pbar:
+                for result in pool_imap(pool, partial(process_one, start=start), runs[1:], chunksize=4):
+                    results.append(result)
 
-                pbar.update()
+                    pbar.update()
 
-                done_nsplit  += 1
+                    done_nsplit  += 1
                 
-                '''
-                if (done_nsplit % nproc) == 0:
-                    pool_time = (time.time() - pool_start)  / 60.
-                    runtime   = calc_runtime(start, 'POOL:  New expected runtime of {:.3f} minutes with {:d} proc.'.format(nchunk * pool_time / done_nsplit, nproc))
-                '''
+                    '''
+                    if (done_nsplit % nproc) == 0:
+                        pool_time = (time.time() - pool_start)  / 60.
+                        runtime   = calc_runtime(start, 'POOL:  New expected runtime of {:.3f} minutes with {:d} proc.'.format(nchunk * pool_time / done_nsplit, nproc))
+                    '''
 
-        pool.close()
+            pool.close()
 
-        # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join                                                                                                       
-        pool.join()
+            # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join                                                                                                       
+            pool.join()
 
-    runtime     = calc_runtime(start, 'POOL:  Done with queries of {} splits'.format(done_nsplit))
-    # runtime   = calc_runtime(start, 'POOL:  Done with queries of {} splits with effective split time {}'.format(done_nsplit, pool_time / done_nsplit))
+        runtime     = calc_runtime(start, 'POOL:  Done with queries of {} splits'.format(done_nsplit))
+        # runtime   = calc_runtime(start, 'POOL:  Done with queries of {} splits with effective split time {}'.format(done_nsplit, pool_time / done_nsplit))
 
-    flat_result = []
+        flat_result = []
     
-    for rr in results:
-        flat_result += rr
+        for rr in results:
+            flat_result += rr
  
-    runtime                = calc_runtime(start, 'Reading randoms')
+        runtime                = calc_runtime(start, 'Reading randoms')
 
-    fpath                  = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix)
-    rand                   = Table.read(fpath)
+        fpath                  = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix)
+        rand                   = Table.read(fpath)
 
-    runtime                = calc_runtime(start, 'Sorting randoms by X')
+        runtime                = calc_runtime(start, 'Sorting randoms by X')
     
-    rand.sort('CARTESIAN_X')
+        rand.sort('CARTESIAN_X')
 
-    if debug:
-        rand               = rand[::debug_downsample] 
+        if debug:
+            rand               = rand[::debug_downsample] 
 
-    # print(len(rand), len(flat_result))
+        # print(len(rand), len(flat_result))
 
-    runtime                = calc_runtime(start, 'Assigning counts to randoms')
+        runtime                = calc_runtime(start, 'Assigning counts to randoms')
 
-    rand['RAND_N8']        = np.array(flat_result).astype(np.int32)
-    rand['FILLFACTOR']     = rand['RAND_N8'] / overpoints_hdr['NRAND8']
+        rand['RAND_N8']        = np.array(flat_result).astype(np.int32)
+        rand['FILLFACTOR']     = rand['RAND_N8'] / overpoints_hdr['NRAND8']
 
-    rand.meta['RSPHERE']   = sphere_radius
-    rand.meta['IMMUTABLE'] = 'FALSE'
+        rand.meta['RSPHERE']   = sphere_radius
+        rand.meta['IMMUTABLE'] = 'FALSE'
 
-    runtime                = calc_runtime(start, f'Reading {fpath}')
+        runtime                = calc_runtime(start, f'Reading {fpath}')
 
-    boundary               = Table.read(fpath, 'BOUNDARY')
+        boundary               = Table.read(fpath, 'BOUNDARY')
     
-    header                 = fits.Header()
+        header                 = fits.Header()
+        header['INHASH']       = inhash
 
-    hx                     = fits.HDUList()
-    hx.append(fits.PrimaryHDU(header=header))
-    hx.append(fits.convenience.table_to_hdu(rand))
-    hx.append(fits.convenience.table_to_hdu(boundary))
+        hx                     = fits.HDUList()
+        hx.append(fits.PrimaryHDU(header=header))
+        hx.append(fits.convenience.table_to_hdu(rand))
+        hx.append(fits.convenience.table_to_hdu(boundary))
 
-    runtime                = calc_runtime(start, 'Writing {}.'.format(opath), xx=rand)
+        runtime                = calc_runtime(start, 'Writing {}.'.format(opath), xx=rand)
 
-    hx.writeto(opath, overwrite=True)
+        hx.writeto(opath, overwrite=True)
 
-    runtime                = calc_runtime(start, 'Finished')
+        runtime                = calc_runtime(start, 'Finished')
 
     if log:
         sys.stdout.close()
@@ -0,0 +1,243 @@
+import os
+import sys
+import argparse
+import numpy           as     np
+import astropy.io.fits as     fits
+
+from   astropy.table   import Table
+from   cosmo           import volcom
+from   volfracs        import volavg_index
+from   bitmask         import lumfn_mask
+from   schechter       import named_schechter
+from   ddp             import tmr_DDP1
+from   params          import fillfactor_threshold
+from   findfile        import findfile, call_signature, overwrite_check
+
+
+def sweep_fractions(index, zmins, zmaxs, thresholds, tier=None, self_count=False):
+    '''
+    Fraction of (Z sorted) indexed randoms with zmin < z < zmax that pass FILLFACTOR > threshold
+    (and are in tier), for each threshold.  The redshift limits are located once, each threshold
+    then requires only a cumulative sum over the randoms.  Returns [nthreshold, ngalaxy].
+    '''
+    zs         = index['Z']
+
+    lo         = np.searchsorted(zs, zmins, side='right')
+    hi         = np.searchsorted(zs, zmaxs, side='left')
+
+    nall       = hi - lo
+    isin       = nall > 0
+
+    if self_count:
+        tcol   = 'DDP1_DELTA8_TIER_ZEROPOINT'
+
+    else:
+        tcol   = 'DDP1_DELTA8_TIER'
+
+    if tier is None:
+        in_tier = np.ones(len(zs), dtype=bool)
+
+    else:
+        in_tier = (index[tcol] == tier)
+
+    result     = np.zeros((len(thresholds), len(zmins)), dtype=float)
+
+    for ii, threshold in enumerate(thresholds):
+        cum    = np.concatenate(([0], np.cumsum((index['FILLFACTOR'] > threshold) & in_tier)))
+        ncut   = cum[hi] - cum[lo]
+
+        # No randoms in (zmin, zmax):  no volume to correct, see volavg_fraction.
+        result[ii, isin] = ncut[isin] / nall[isin]
+
+    return  result
+
+def sweep_lumfn(Ms, dM, vol, mag, vmax, d8=None):
+    '''
+    1/VMAX luminosity function for a set of galaxies, binned as lumfn.
+    '''
+    nbin       = len(Ms)
+
+    # default:  bins[i-1] <= x < bins[i]
+    idxs       = np.digitize(mag, bins=Ms)
+
+    ns         = np.bincount(idxs, minlength=nbin + 1)[:nbin]
+    ivmax      = np.bincount(idxs, weights=1. / vmax,    minlength=nbin + 1)[:nbin]
+    ivmax2     = np.bincount(idxs, weights=1. / vmax**2, minlength=nbin + 1)[:nbin]
+
+    result                    = Table()
+    result['MID_M']           = Ms + dM/2.
+    result['PHI_N']           = ns / dM / vol
+    result['PHI_N_ERROR']     = np.sqrt(ns) / dM / vol
+    result['PHI_IVMAX']       = ivmax / dM
+    result['PHI_IVMAX_ERROR'] = np.sqrt(ivmax2) / dM
+    result['N']               = ns
+    result['VALID']           = ns >= 5
+    result['REF_SCHECHTER']   = named_schechter(result['MID_M'], named_type='TMR')
+
+    if d8 != None:
+        # TODO HARDCODE 0.007
+        result['REF_SCHECHTER'] *= (1. + d8) / (1. + 0.007)
+
+    result['REF_RATIO']       = result['PHI_IVMAX'] / result['REF_SCHECHTER']
+
+    return  result
+
+def fillfactor_sweep(dat, thresholds, Mcol='MCOLOR_0P0', bitmasks=['IN_D8LUMFN'], tier=None, d8=None, index=None, Ms=None):
+    '''
+    Volume fractions and 1/VMAX luminosity functions for a vector of fillfactor thresholds in one pass,
+    equivalent to gen_gold_lf.process_cat with params.fillfactor_threshold set to each in turn.
+    Galaxies are sorted by FILLFACTOR once, such that each threshold is a leading slice; the
+    randoms fraction for each is a cumulative sum, see sweep_fractions.
+    '''
+    if index is None:
+        # HACK SURVEYHACK: must match vmaxer.
+        index      = volavg_index(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1')
+
+    if Ms is None:
+        Ms         = np.linspace(-23.,  -16.,  36)
+
+    dM             = np.round(np.diff(Ms)[0], decimals=4)
+    thresholds     = np.sort(np.atleast_1d(thresholds))
+
+    # Redshift limits of the catalogue, as vmaxer.
+    zmin           = dat['ZSURV'].min()
+    zmax           = dat['ZSURV'].max()
+    area           = dat.meta['AREA']
+
+    print('Found redshift limits: {:.3f} < z < {:.3f}'.format(zmin, zmax))
+
+    # All mask bits bar FILLFACTOR, which is set per threshold.
+    isin           = np.ones(len(dat), dtype=bool)
+
+    for bmask in bitmasks:
+        isin      &= (dat[bmask].data & ~lumfn_mask['FILLFACTOR']) == 0
+
+    dat            = dat[isin]
+
+    # Sort by FILLFACTOR, descending, once.
+    idx            = np.argsort(-dat['FILLFACTOR'].data, kind='stable')
+    dat            = dat[idx]
+
+    ffs            = dat['FILLFACTOR'].data
+    zsurv          = dat['ZSURV'].data
+    mag            = dat[Mcol].data
+
+    # Abs. mag. window of the LF;  as vmaxer, FORCE_VOL is defined before this cut.
+    inwin          = (mag >= Ms.min()) & (mag <= Ms.max())
+
+    zmins          = np.clip(dat['ZMIN'].data, zmin, None)
+    zmaxs          = np.clip(dat['ZMAX'].data, None, zmax)
+
+    vmaxs          = volcom(zmaxs, area) - volcom(zmins, area)
+
+    fracs          = sweep_fractions(index, zmins, zmaxs, thresholds, tier=tier)
+
+    if tier != None:
+        # Note: must match eval_volavg_fillfactor.
+        is_ddp1    = (dat['DDPMALL_0P0'] > tmr_DDP1[0]) & (dat['DDPMALL_0P0'] < tmr_DDP1[1])
+        is_ddp1    = np.array(is_ddp1, dtype=bool)
+
+        fracs[:, is_ddp1] = sweep_fractions(index, zmins[is_ddp1], zmaxs[is_ddp1], thresholds, tier=tier, self_count=True)
+
+    # Randoms volume fraction in the catalogue redshift limits.
+    volfracs       = sweep_fractions(index, np.array([zmin]), np.array([zmax]), thresholds, tier=tier)[:,0]
+
+    # Galaxies passing FILLFACTOR >= threshold, i.e. not masked by update_bit, lead.
+    npass          = np.searchsorted(-ffs, -thresholds, side='right')
+
+    summary        = []
+    results        = []
+
+    for ii, (threshold, nn) in enumerate(zip(thresholds, npass)):
+        if nn == 0:
+            print('No galaxies pass fillfactor threshold {:.3f}.'.format(threshold))
+            continue
+
+        # Include impact of the cut on the sample limits, as vmaxer.
+        vol        = volcom(zsurv[:nn].max(), area) - volcom(zsurv[:nn].min(), area)
+
+        win        = inwin[:nn]
+
+        result     = sweep_lumfn(Ms, dM, vol, mag[:nn][win], vmaxs[:nn][win] * fracs[ii, :nn][win], d8=d8)
+
+        nn         = np.count_nonzero(win)
+
+        result.meta['FILLFACTOR_THRESHOLD'] = threshold
+        result.meta['FORCE_VOL']            = vol
+        result.meta['VOLFRAC']              = volfracs[ii]
+        result.meta['ABSMAG_DEF']           = Mcol
+        result.meta['EXTNAME']              = 'LUMFN_FF{:03d}'.format(int(np.round(100. * threshold)))
+
+        if d8 != None:
+            result.meta['DDP1_D8']          = d8
+
+        results.append(result)
+        summary.append([threshold, nn, vol, volfracs[ii]])
+
+        print('{:.3f}\t{:d}\t{:.6e}\t{:.6f}'.format(threshold, nn, vol, volfracs[ii]))
+
+    summary              = Table(np.array(summary), names=['THRESHOLD', 'NGAL', 'FORCE_VOL', 'VOLFRAC'])
+    summary['NGAL']      = summary['NGAL'].astype(int)
+    summary.meta['TIER'] = -99 if tier is None else tier
+    summary.meta['EXTNAME'] = 'FFSWEEP'
+
+    return  summary, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gold reference LF for a sweep of fillfactor thresholds.')
+    parser.add_argument('--log', help='Create a log file of stdout.', action='store_true')
+    parser.add_argument('--survey', help='Select survey', default='gama')
+    parser.add_argument('--dryrun', action='store_true', help='dryrun.')
+    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
+    parser.add_argument('--thresholds', type=float, nargs='+', help='Fillfactor thresholds.', default=np.arange(0.5, 1.0, 0.05).tolist())
+    parser.add_argument('--Mcol', type=str, help='Abs. mag. definition.', default='MCOLOR_0P0')
+
+    args   = parser.parse_args()
+
+    log    = args.log
+    dryrun = args.dryrun
+    survey = args.survey
+
+    fpath  = findfile(ftype='ddp_n8',        dryrun=dryrun, survey=survey)
+    opath  = findfile(ftype='lumfn_ffsweep', dryrun=dryrun, survey=survey)
+
+    if log:
+        logfile = findfile(ftype='lumfn_ffsweep', dryrun=False, survey=survey, log=True)
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    if args.nooverwrite:
+        overwrite_check(opath)
+
+    call_signature(dryrun, sys.argv)
+
+    print(f'Reading: {fpath}')
+
+    dat    = Table.read(fpath)
+
+    thresholds       = np.array(args.thresholds)
+
+    # Always include the fiducial threshold.
+    if not np.any(np.isclose(thresholds, fillfactor_threshold)):
+        thresholds   = np.append(thresholds, fillfactor_threshold)
+
+    summary, results = fillfactor_sweep(dat, thresholds, Mcol=args.Mcol)
+
+    print(f'Writing: {opath}')
+
+    hx     = fits.HDUList()
+    hx.append(fits.PrimaryHDU())
+    hx.append(fits.convenience.table_to_hdu(summary))
+
+    for result in results:
+        hx.append(fits.convenience.table_to_hdu(result))
+
+    hx.writeto(opath, overwrite=True)
+
+    print('Done.')
+
+    if log:
+        sys.stdout.close()
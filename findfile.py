@@ -1,10 +1,16 @@
 import re
 import os
+import sys
+import grp
+import queue
+import atexit
+import threading
 import time
+import hashlib
 import glob
 import datetime
 import fitsio
-import subprocess
+import yaml
 import numpy as np
 import astropy.io.fits as   fits
 
@@ -23,7 +29,24 @@ supported = ['gold',\
              'lumfn',\
              'lumfn_step',\
              'ddp',\
-             'ddp_n8']
+             'ddp_n8',\
+             'ddp_n8_d0_parts']
+
+# Single table intermediates that may be written by a columnar backend;  final deliverables, and
+# randoms with a BOUNDARY extension, remain FITS.
+columnar = ['gold',\
+            'kE',\
+            'zmax',\
+            'ddp',\
+            'ddp_n8',\
+            'randoms_bd_ddp_n8']
+
+backends = {'fits': '.fits', 'parquet': '.parquet', 'hdf5': '.hdf5'}
+
+_backend = {}
+
+# Background writer thread & its queue, see write_background.
+_writer  = {}
 
 def safe_reset(supported=True, printonly=False, debug=False):
     if supported:
@@ -77,7 +100,242 @@ def gather_cat(fpaths):
 
     return  tables 
 
-def write_desitable(opath, table, test=False):
+def fetch_backend():
+    '''
+    Backend of the intermediate (columnar) products:  fits (default), parquet or hdf5, from
+    $GOLD_BACKEND, or io: backend: of $CODE_ROOT/configs/config.yaml.
+    '''
+    if 'GOLD_BACKEND' in os.environ:
+        backend = os.environ['GOLD_BACKEND']
+
+    elif 'BACKEND' in _backend:
+        backend = _backend['BACKEND']
+
+    else:
+        backend = 'fits'
+
+        try:
+            with open(os.environ['CODE_ROOT'] + '/configs/config.yaml') as ff:
+                backend = yaml.safe_load(ff).get('io', {}).get('backend', 'fits')
+
+        except (KeyError, OSError):
+            pass
+
+        _backend['BACKEND'] = backend
+
+    assert backend in backends, f'Backend {backend} is not supported ({list(backends.keys())})'
+
+    return  backend
+
+def table_backend(fpath):
+    for backend, ext in backends.items():
+        if fpath.endswith(ext):
+            return  backend
+
+    raise  ValueError(f'Unsupported file type: {fpath}')
+
+def read_desitable(fpath, columns=None):
+    '''
+    Read a (single table) product of any backend, optionally only the given columns;  with
+    header / schema meta data.
+    '''
+    backend = table_backend(fpath)
+
+    if backend == 'parquet':
+        return  Table.read(fpath, format='parquet', include_names=columns)
+
+    if backend == 'hdf5':
+        # No column projection;  chunked compressed datasets are read in full.
+        table = Table.read(fpath, format='hdf5', path='data')
+
+        return  table if columns is None else table[columns]
+
+    if columns is None:
+        return  Table.read(fpath)
+
+    data, hdr  = fitsio.read(fpath, ext=1, columns=columns, header=True)
+
+    table      = Table(data)
+    table.meta = fetch_meta(fpath, hdr=hdr)
+
+    return  table
+
+def fetch_meta(fpath, ext=1, hdr=None):
+    '''
+    Header (FITS), or serialized meta (parquet, hdf5), of a product as a dict.
+    '''
+    backend = table_backend(fpath)
+
+    if backend == 'parquet':
+        return  dict(Table.read(fpath, format='parquet', schema_only=True).meta)
+
+    if backend == 'hdf5':
+        # Serialized meta dataset only (written by astropy with serialize_meta), not the table.
+        import h5py
+
+        from   astropy.table import meta as table_meta
+
+        with h5py.File(fpath, 'r') as ff:
+            if 'data.__table_column_meta__' not in ff:
+                return  dict(ff['data'].attrs)
+
+            header  = table_meta.get_header_from_yaml(xx.decode('utf-8') for xx in ff['data.__table_column_meta__'])
+
+        result  = dict(header.get('meta', {}))
+        result.pop('__serialized_columns__', None)
+
+        return  result
+
+    if hdr is None:
+        hdr = fitsio.read_header(fpath, ext=ext)
+
+    return  {key: hdr[key] for key in hdr.keys() if key[:5] not in ['TUNIT', 'TNULL', 'TTYPE', 'TFORM', 'XTENS', 'NAXIS', 'BITPI', 'PCOUN', 'GCOUN', 'TFIEL', 'EXTNA']}
+
+def convert_desitable(fpath, backend, remove=False):
+    '''
+    Convert a product to the given backend, e.g. an existing FITS intermediate to parquet.
+    '''
+    opath = os.path.splitext(fpath)[0] + backends[backend]
+
+    if opath == fpath:
+        return  opath
+
+    print(f'Converting {fpath} to {opath}.')
+
+    write_desitable(opath, read_desitable(fpath))
+
+    if remove:
+        os.remove(fpath)
+
+    return  opath
+
+def file_hash(fpath):
+    '''
+    Content address of a stage input:  its INHASH header, if written by a hashed stage (capturing
+    its own inputs, arguments & code), or its size and modification time otherwise.
+    '''
+    try:
+        for ext in [0, 1]:
+            hdr = fetch_meta(fpath, ext=ext)
+
+            if 'INHASH' in hdr:
+                return  hdr['INHASH']
+
+            if table_backend(fpath) != 'fits':
+                break
+
+    except (OSError, IOError, ValueError):
+        pass
+
+    stat = os.stat(fpath)
+
+    return  '{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+
+# Pure configuration, excluded from the code hash:  a stage passes the values it uses to stage_hash as params.
+config_modules = ['params.py']
+
+def repo_modules():
+    '''
+    Source paths of the imported modules of this repository, i.e. the code a stage depends upon, bar
+    config_modules.
+    '''
+    root       = os.path.dirname(os.path.abspath(__file__))
+
+    paths      = [getattr(mod, '__file__', None) for mod in list(sys.modules.values())]
+    paths      = [os.path.abspath(x) for x in paths if (x is not None) and x.endswith('.py')]
+
+    return  sorted(set(x for x in paths if x.startswith(root + os.sep) and (os.path.relpath(x, root) not in config_modules)))
+
+def stage_hash(inputs=[], argv=None, params={}, code=None):
+    '''
+    Hash of a stage's input files, arguments (bar --log, --nooverwrite), relevant parameters,
+    e.g. {'fillfactor_threshold': 0.9}, and code (by default, the source of the calling script 
+    and of all imported repo modules bar configuration, see repo_modules).  Recorded as INHASH in the output header, 
+    see overwrite_check.
+    '''
+    if argv is None:
+        argv   = sys.argv
+
+    if code is None:
+        code   = [argv[0]] + repo_modules()
+
+    sha        = hashlib.sha256()
+
+    for fpath in inputs:
+        sha.update('{}={};'.format(os.path.basename(fpath), file_hash(fpath)).encode('utf-8'))
+
+    sha.update(' '.join(x for x in argv[1:] if x not in ['--log', '--nooverwrite']).encode('utf-8'))
+
+    for key in sorted(params):
+        sha.update('{}={};'.format(key, params[key]).encode('utf-8'))
+
+    for fpath in code:
+        if os.path.isfile(fpath):
+            with open(fpath, 'rb') as ff:
+                sha.update(ff.read())
+
+    return  sha.hexdigest()[:16]
+
+def set_permissions(opath, group='desi', mode=0o700):
+    '''
+    In-process equivalent of chgrp desi & chmod 700;  the group is left unchanged where it does
+    not exist, e.g. off nersc & cosma.
+    '''
+    try:
+        os.chown(opath, -1, grp.getgrnam(group).gr_gid)
+
+    except KeyError:
+        pass
+
+    os.chmod(opath, mode)
+
+def _write_worker():
+    while True:
+        func, args, kwargs = _writer['QUEUE'].get()
+
+        try:
+            func(*args, **kwargs)
+
+        except Exception as E:
+            print(f'WARNING:  background write {func.__name__}{args[:1]} failed with {E}.')
+
+            _writer['ERRORS'].append(E)
+
+        finally:
+            _writer['QUEUE'].task_done()
+
+def write_background(func, *args, **kwargs):
+    '''
+    Queue func(*args, **kwargs), e.g. write_desitable, to the background writer thread and return
+    for compute to continue.  Queued tables must not be modified thereafter.  A full queue blocks,
+    bounding memory.  See flush_writes for the end of stage barrier.
+    '''
+    if 'THREAD' not in _writer:
+        _writer['QUEUE']  = queue.Queue(maxsize=16)
+        _writer['ERRORS'] = []
+        _writer['THREAD'] = threading.Thread(target=_write_worker, name='writer', daemon=True)
+        _writer['THREAD'].start()
+
+        # Daemon threads do not outlive the interpreter.
+        atexit.register(flush_writes)
+
+    _writer['QUEUE'].put((func, args, kwargs))
+
+def flush_writes():
+    '''
+    Barrier:  wait for all queued writes to complete, raising the first failure.
+    '''
+    if 'QUEUE' not in _writer:
+        return
+
+    _writer['QUEUE'].join()
+
+    errors, _writer['ERRORS'] = _writer['ERRORS'], []
+
+    if errors:
+        raise  errors[0]
+
+def write_desitable(opath, table, test=False, inhash=None, background=False):
     if test:
         table      = Table()
         table['a'] = [1, 4]
@@ -86,20 +344,146 @@ def write_desitable(opath, table, test=False):
 
         opath      = './test.fits'
 
+    backend = table_backend(opath)
+
+    if inhash != None:
+        table.meta['INHASH'] = inhash
+
+    if background:
+        write_background(write_desitable, opath, table)
+
+        return
+
+    if backend == 'parquet':
+        # Columnar, snappy compressed;  meta serialized to the schema.
+        table.write(opath, format='parquet', overwrite=True)
+
+    elif backend == 'hdf5':
+        table.write(opath, format='hdf5', path='data', compression=True, serialize_meta=True, overwrite=True)
+
+    else:
+        table.write(opath, overwrite=True)
+
+    set_permissions(opath)
+
+def write_partitioned(opath, table, keys, part_cols={}):
+    '''
+    Write a table as a single partitioned file:  rows sorted by keys (e.g. tier, field) in a DATA
+    extension, with a PARTITIONS extension of the START, STOP row offsets of each unique key.  
+    part_cols is a dict of per-partition header values by key tuple, e.g. {(tier, field): {'AREA': area}},
+    stored as further columns of PARTITIONS.  See read_partition.
+    '''
     assert 'fits' in opath
 
-    table.write(opath, overwrite=True)
+    # Sort by keys, first key slowest.
+    idx         = np.lexsort([table[key].data for key in keys[::-1]])
+    table       = table[idx]
 
-    cmds   = []
-    cmds.append(f'chgrp desi {opath}')
-    cmds.append(f'chmod  700 {opath}')
-    
-    print('\n\n')
+    values      = [table[key].data for key in keys]
 
-    for cmd in cmds:
-        output = subprocess.check_output(cmd, shell=True)
-        
-        print(cmd, output)
+    change      = np.zeros(len(table), dtype=bool)
+    change[:1]  = True
+
+    for vv in values:
+        change[1:] |= (vv[1:] != vv[:-1])
+
+    starts      = np.where(change)[0]
+    stops       = np.append(starts[1:], len(table))
+
+    parts       = Table([vv[starts] for vv in values], names=keys)
+    parts['START'] = starts
+    parts['STOP']  = stops
+
+    extra       = sorted(set([col for xx in part_cols.values() for col in xx]))
+
+    for col in extra:
+        parts[col] = [part_cols.get(tuple(row[key] for key in keys), {}).get(col, np.nan) for row in parts]
+
+    parts.meta['EXTNAME'] = 'PARTITIONS'
+    parts.meta['KEYS']    = ','.join(keys)
+
+    table.meta['EXTNAME'] = 'DATA'
+
+    hx          = fits.HDUList()
+    hx.append(fits.PrimaryHDU())
+    hx.append(fits.convenience.table_to_hdu(table))
+    hx.append(fits.convenience.table_to_hdu(parts))
+
+    hx.writeto(opath, overwrite=True)
+
+    set_permissions(opath)
+
+def fetch_partitions(fpath):
+    parts       = Table(fitsio.read(fpath, ext='PARTITIONS'))
+    parts.convert_bytestring_to_unicode()
+
+    return  parts
+
+def read_partition(fpath, columns=None, **keys):
+    '''
+    Lazy read of the rows of a single partition of a partitioned file, e.g. 
+    read_partition(fpath, DDP1_DELTA8_TIER=3, FIELD='G9');  only the partition rows (and columns) 
+    are read.  Returns the DATA header as meta, updated by any per-partition values.
+    '''
+    parts       = fetch_partitions(fpath)
+
+    isin        = np.ones(len(parts), dtype=bool)
+
+    for key, value in keys.items():
+        isin   &= (parts[key].data == value)
+
+    with fitsio.FITS(fpath) as ff:
+        hdu     = ff['DATA']
+
+        if columns is not None:
+            hdu = hdu[columns]
+
+        if np.count_nonzero(isin) == 0:
+            # Zero length, with the expected columns;  from the dtype, as DATA may itself be empty.
+            result = Table(np.zeros(0, dtype=ff['DATA'].get_rec_dtype()[0]))
+
+            if columns is not None:
+                result = result[columns]
+
+        else:
+            assert  np.count_nonzero(isin) == 1
+
+            row    = parts[isin][0]
+            result = Table(hdu[row['START']:row['STOP']])
+
+        header  = ff['DATA'].read_header()
+
+    result.convert_bytestring_to_unicode()
+
+    structural  = ('XTENSION', 'BITPIX', 'NAXIS', 'PCOUNT', 'GCOUNT', 'TFIELDS', 'EXTNAME', 'TTYPE', 'TFORM', 'TUNIT', 'TDIM', 'TNULL')
+
+    result.meta = OrderedDict([(key, header[key]) for key in header.keys() if not key.startswith(structural)])
+
+    if np.count_nonzero(isin) == 1:
+        for col in parts.colnames:
+            if col not in list(keys.keys()) + ['START', 'STOP']:
+                result.meta[col] = parts[isin][col][0]
+
+    return  result
+
+def fetch_partition(ftype, field, utier, dryrun=False, survey='gama', columns=None):
+    '''
+    Per (tier, field) view of a partitioned product, e.g. ddp_n8_d0, in place of 
+    Table.read(findfile(ftype, field=field, utier=utier)).  The partitioned file is 
+    preferred, the (legacy) per field and tier file is read only in its absence.
+    '''
+    assert  ftype in ['ddp_n8_d0']
+
+    fpath       = findfile(ftype=f'{ftype}_parts', dryrun=dryrun, survey=survey)
+
+    if not os.path.isfile(fpath):
+        fpath   = findfile(ftype=ftype, dryrun=dryrun, field=field, utier=utier, survey=survey)
+
+        print(f'WARNING:  No partitioned {ftype};  reading {fpath}')
+
+        return  Table.read(fpath) if columns is None else Table.read(fpath)[columns]
+
+    return  read_partition(fpath, columns=columns, DDP1_DELTA8_TIER=utier, FIELD=field)
 
 def fetch_fields(survey):
     assert survey in ['desi', 'gama'], f'Fields for {survey} survey are not supported.'
@@ -123,7 +507,12 @@ def release_dir(user=os.environ['USER'], survey='gama', version=None):
     else:
         return '/cosma/home/durham/{}/data/GAMA4/'.format(user)
 
-def overwrite_check(opath, ext=None):
+def overwrite_check(opath, ext=None, inhash=None):
+    '''
+    Exit if opath is on disk and overwrite is forbidden (--nooverwrite).  Given the stage_hash of
+    the inputs, exit only if it matches the INHASH of opath (or of its ext extension), i.e. outputs 
+    are otherwise stale.
+    '''
     if os.path.isfile(opath):
         exist     = True
 
@@ -138,14 +527,30 @@ def overwrite_check(opath, ext=None):
                 hdr = hdu.header
 
                 try:
-                    if hdr['EXTNAME'] == 'BOUNDARY':
+                    if hdr['EXTNAME'] == ext:
+                        if (inhash != None) and (hdr.get('INHASH', None) != inhash):
+                            print(f'Found existing {ext} extension to {opath} with stale input hash ({hdr.get("INHASH", None)} != {inhash});  regenerating.')
+
+                            continue
+
                         exist = True
 
-                        print(f'WARNING:  Found existing BOUNDARY extension to {opath} and overwrite forbidden (--nooverwrite).')
+                        print(f'WARNING:  Found existing {ext} extension to {opath} and overwrite forbidden (--nooverwrite).')
                         
                 except KeyError as E:
                     pass
 
+        elif inhash != None:
+            found = [fetch_meta(opath, ext=xx).get('INHASH', None) for xx in ([0, 1] if table_backend(opath) == 'fits' else [1])]
+            found = [xx for xx in found if xx != None]
+            exist = inhash in found
+
+            if exist:
+                print(f'{opath} found on disk with matching input hash {inhash} and overwrite forbidden (--nooverwrite).')
+
+            else:
+                print(f'{opath} found on disk with stale input hash ({found} != {inhash});  regenerating.')
+
         else:
             print(f'{opath} found on disk and overwrite forbidden (--nooverwrite).')
 
@@ -178,6 +583,11 @@ def fetch_header(ftype=None, name=None, ext=1, allsupported=False, dryrun=False,
         if debug:
             print(f'Fetching header of {fpath}')
  
+    if table_backend(fpath) != 'fits':
+        meta = fetch_meta(fpath)
+
+        return  meta[name] if name else meta
+
     if name:
         return  getval(fpath, name, ext)
 
@@ -196,7 +606,7 @@ def fetch_header(ftype=None, name=None, ext=1, allsupported=False, dryrun=False,
 
         return  result
 
-def findfile(ftype, dryrun=False, prefix=None, field=None, utier='{utier}', survey=None, realz=0, debug=False, version=None, oversample=1, log=False, ddp_count=-1):        
+def findfile(ftype, dryrun=False, prefix=None, field=None, utier='{utier}', survey=None, realz=0, debug=False, version=None, oversample=1, log=False, ddp_count=-1, backend=None):        
     if version == None:
         if 'NERSC_HOST' in os.environ:
             gold_dir = os.environ['CSCRATCH'] + '/norberg/GAMA4/'
@@ -283,8 +693,11 @@ def findfile(ftype, dryrun=False, prefix=None, field=None, utier='{utier}', surv
                       'vmax':       {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'vmax'},\
                       'lumfn':      {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'lumfn'},\
                       'lumfn_step': {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'lumfn_step'},\
+                      'lumfn_ffsweep': {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'lumfn_ffsweep'},\
                       'ddp':        {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'ddp'},\
-                      'ddp_n8':     {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'ddp_n8'}}
+                      'ddp_n8':     {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'ddp_n8'},\
+                      'ddp_n8_lumfn_split': {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'ddp_n8_lumfn_split'},\
+                      'ddp_n8_d0_parts':    {'dir': gold_dir, 'id': f'{survey}_gold', 'ftype': 'ddp_n8_d0_parts'}}
 
         parts      = file_types[ftype]
         fpath      = parts['dir'] + '/{}_{}{}.fits'.format(parts['id'], parts['ftype'], dryrun)
@@ -299,6 +712,7 @@ def findfile(ftype, dryrun=False, prefix=None, field=None, utier='{utier}', surv
                       'randoms_bd':           {'dir': rand_dir, 'id': 'randoms_bd',             'ftype': realz},\
                       'randoms_bd_ddp_n8':    {'dir': rand_dir, 'id': 'randoms_bd_ddp_n8',      'ftype': realz},\
                       'volavg_fillfactor':    {'dir': rand_dir, 'id': 'volavg_fillfactor',      'ftype': '_{}_{}'.format(realz, utier)},\
+                      'volavg_index':         {'dir': rand_dir, 'id': 'randoms_volavg_index',   'ftype': realz},\
                       'boundary':             {'dir': rand_dir, 'id': 'boundary',               'ftype': realz}
                      }
         
@@ -330,6 +744,12 @@ def findfile(ftype, dryrun=False, prefix=None, field=None, utier='{utier}', surv
 
     if log:
         fpath = os.path.dirname(fpath) + '/logs/' + os.path.basename(fpath).split('.')[0] + '.log'
+
+    elif ftype in columnar:
+        if backend is None:
+            backend = fetch_backend()
+
+        fpath = fpath.replace('.fits', backends[backend])
         
     return  fpath
 
@@ -16,28 +16,18 @@ from   config           import Configuration
 from   ddp_zlimits      import ddp_zlimits
 
 
-def gama_gold(argset):
-    if argset.log:
-        logfile = findfile(ftype='gold', dryrun=False, survey='gama', log=True)
-
-        print(f'Logging to {logfile}')
-
-        sys.stdout = open(logfile, 'w')
-
-    root   = os.environ['TILING_CATDIR']
-    fpath  = root + '/TilingCatv46.fits'
-
-    opath  = findfile(ftype='gold', dryrun=False, survey='gama')
-
-    if argset.dryrun:
-        dpath = findfile(ftype='gold', dryrun=True, survey='gama')
-
-        if os.path.isfile(dpath):
-            print('Dryrun gama_gold created on full run; Exiting.')
-            return 0
+# Gold header, bar the area & number of galaxies.
+gold_meta = {'IMMUTABLE': 'FALSE',\
+             'RLIM': 19.8,\
+             'RMAX': 12.0,\
+             'MAX_SEP': 70.0}
 
-    if argset.nooverwrite:
-        overwrite_check(opath)
+def gama_gold_cat(fpath=None):
+    '''
+    GAMA gold catalogue, in memory, from the tiling catalogue.
+    '''
+    if fpath is None:
+        fpath = os.environ['TILING_CATDIR'] + '/TilingCatv46.fits'
 
     dat     = Table.read(fpath)
     dat     = Table(dat, masked=False)
@@ -122,26 +112,21 @@ def gama_gold(argset):
 
     print('Solved for GAMA gold')
 
-    if not os.path.isdir(os.environ['GOLD_DIR']):
-        print('Creating {}'.format(os.environ['GOLD_DIR']))
-        
-        os.makedirs(os.environ['GOLD_DIR'])
-
     # 113687 vs TMR 80922.
     dat.meta['GOLD_NGAL'] = len(dat)
     dat.pprint()
     
     dat.meta = {'AREA': dat.meta['AREA'],\
-                'GOLD_NGAL': dat.meta['GOLD_NGAL'],\
-                'IMMUTABLE': 'FALSE',\
-                'RLIM': 19.8,\
-                'RMAX': 12.0,\
-                'MAX_SEP': 70.0} 
+                'GOLD_NGAL': dat.meta['GOLD_NGAL']} 
 
-    print('Writing {}.'.format(opath))
+    dat.meta.update(gold_meta)
 
-    write_desitable(opath, dat)
-    
+    return  dat
+
+def gama_gold_dryrun(dat):
+    '''
+    Dryrun subset of the gold catalogue.
+    '''
     # Dryrun:  2x2 sq. patch of sky.
     # G12
     delta_deg = 0.5
@@ -163,7 +148,40 @@ def gama_gold(argset):
 
     allin |= isin
 
-    dat    = dat[allin]
+    return  dat[allin]
+
+def gama_gold(argset):
+    if argset.log:
+        logfile = findfile(ftype='gold', dryrun=False, survey='gama', log=True)
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    opath  = findfile(ftype='gold', dryrun=False, survey='gama')
+
+    if argset.dryrun:
+        dpath = findfile(ftype='gold', dryrun=True, survey='gama')
+
+        if os.path.isfile(dpath):
+            print('Dryrun gama_gold created on full run; Exiting.')
+            return 0
+
+    if argset.nooverwrite:
+        overwrite_check(opath)
+
+    dat    = gama_gold_cat()
+
+    if not os.path.isdir(os.environ['GOLD_DIR']):
+        print('Creating {}'.format(os.environ['GOLD_DIR']))
+        
+        os.makedirs(os.environ['GOLD_DIR'])
+
+    print('Writing {}.'.format(opath))
+
+    write_desitable(opath, dat)
+
+    dat    = gama_gold_dryrun(dat)
 
     opath  = findfile(ftype='gold', dryrun=True, survey='gama')
 
@@ -3,39 +3,41 @@ import sys
 import yaml
 import runtime
 import argparse
+import multiprocessing
 import pylab            as     pl
 import numpy            as     np
 import astropy.io.fits  as     fits
 
 from   astropy.table    import Table, vstack
 from   vmaxer           import vmaxer, vmaxer_rand
-from   lumfn            import lumfn
-from   lumfn_stepwise   import lumfn_stepwise
+from   volfracs         import volavg_index
+from   lumfn            import lumfn, multifield_lumfn
+from   lumfn_stepwise   import lumfn_stepwise, stepwise_Mcol
+from   lumfn_cminus     import lumfn_cminus
+from   sty              import sty_fit, sty_meta
 from   schechter        import schechter, named_schechter, ref_schechter
 from   renormalise_d8LF import renormalise_d8LF
 from   delta8_limits    import d8_limits
 from   config           import Configuration
-from   findfile         import findfile, fetch_fields, overwrite_check, gather_cat, call_signature, write_desitable, fetch_header
+from   findfile         import findfile, fetch_fields, overwrite_check, gather_cat, call_signature, write_desitable, read_desitable, write_background, flush_writes, fetch_header, fetch_partition, stage_hash
 from   jackknife_limits import solve_jackknife, set_jackknife, jackknife_mean
 from   bitmask          import update_bit, lumfn_mask
 from   params           import fillfactor_threshold
-from   runtime          import calc_runtime
+from   runtime          import calc_runtime, stage, pool_map
+from   resample         import solve_regions, region_limits, assign_regions, resample_lumfn, realisation_lumfns, jackknife_weights, bootstrap_weights, resample_tier_volfracs, resample_mean
 
 
-def process_cat(fpath, vmax_opath, survey='gama', extra_cols=[], bitmasks=['IN_D8LUMFN'], fillfactor=False, conservative=False, tier=None, d8=None, fdelta=None, fdelta_zp=None):        
-    opath = vmax_opath
-
-    if not os.path.isfile(fpath):
-        # Do not crash and burn, but proceed on gracefully. 
-        print('WARNING:  Failed to find {}'.format(fpath))
-        return  1
-
-    zmax  = Table.read(fpath)
+def process_tier(zmax, survey='gama', extra_cols=[], bitmasks=['IN_D8LUMFN'], fillfactor=False, tier=None, d8=None, index=None, nproc=12, Mcols=['MCOLOR_0P0'], stepwise=True, sty=False):
+    '''
+    VMAX catalogue, 1/VMAX and stepwise luminosity functions and the reference Schechter for a 
+    (density tier of a) zmax catalogue, in memory.  LFs are lists, one per abs. mag. definition 
+    in Mcols, sharing the vmax & fillfactor calculation.  Stepwise is empty if not requested, bar
+    the C- estimate;  the STY fit, if requested, is recorded in the LUMFN header.  Stepwise, C- & STY are limited
+    to the abs. mag. definition of the stepwise limits, lumfn_stepwise.stepwise_Mcol.
+    '''
+    # Single definition retains the LUMFN & LUMFN_STEP extensions.
+    Mcol  = Mcols[0] if len(Mcols) == 1 else list(Mcols)
 
-    if len(zmax) == 0:
-        print('Zero length catalogue, nothing to be done.') 
-        return -99
-             
     minz  = zmax['ZSURV'].min()
     maxz  = zmax['ZSURV'].max()
     
@@ -43,18 +45,18 @@ def process_cat(fpath, vmax_opath, survey='gama', extra_cols=[], bitmasks=['IN_D
 
     update_bit(zmax['IN_D8LUMFN'], lumfn_mask, 'FILLFACTOR', zmax['FILLFACTOR'].data < fillfactor_threshold)
 
-    vmax  = vmaxer(zmax, minz, maxz, fillfactor=fillfactor, bitmasks=bitmasks, extra_cols=extra_cols, tier=tier)
+    vmax  = vmaxer(zmax, minz, maxz, fillfactor=fillfactor, bitmasks=list(bitmasks), extra_cols=list(extra_cols), tier=tier, index=index)
     vmax.meta['EXTNAME'] = 'VMAX'
-        
-    print('Writing {}.'.format(opath))
-
-    write_desitable(opath, vmax)
     
     ##  Luminosity function estimate
-    result = lumfn(vmax, d8=d8)
+    result = lumfn(vmax, Mcol=Mcol, d8=d8)
 
     ##  Stepwise luminosity function estimate
-    result_stepwise = lumfn_stepwise(vmax, d8=d8) 
+    if stepwise:
+        result_stepwise = lumfn_stepwise(vmax, Mcol=Mcol, d8=d8, nproc=nproc) 
+
+    else:
+        result_stepwise = []
     '''
     if fdelta != None:
         result_stepwise = renormalise_d8LF(tier, result_stepwise, fdelta, fdelta_zp, self_count=True)
@@ -62,23 +64,319 @@ def process_cat(fpath, vmax_opath, survey='gama', extra_cols=[], bitmasks=['IN_D
     ##  Reference Schechter - finer binning                                                                                                                                                           
     ref_result = ref_schechter(d8=d8)
 
-    ##  Write.
-    opath      = opath.replace('vmax', 'lumfn')
+    if isinstance(result, Table):
+        result          = [result]
+
+    if isinstance(result_stepwise, Table):
+        result_stepwise = [result_stepwise]
+
+    ##  C- luminosity function estimate, if stepwise limits are available (for their abs. mag. definition only);  as LUMFN_STEP.
+    if 'STEPWISE_FAINTLIM_0P0' in vmax.dtype.names:
+        for xx in [yy for yy in Mcols if yy == stepwise_Mcol]:
+            result_cminus = lumfn_cminus(vmax, Mcol=xx, d8=d8)
+
+            if len(Mcols) > 1:
+                result_cminus.meta['EXTNAME'] = 'LUMFN_CMINUS_{}'.format(xx)
+
+            result_stepwise.append(result_cminus)
 
+        ##  Unbinned STY Schechter fit, recorded in the LUMFN header(s);  optional, as it dominates the cost of a tier.
+        for xx, lf in zip(Mcols, result):
+            if (not sty) or (xx != stepwise_Mcol):
+                continue
+
+            fit = sty_fit(vmax, Mcol=xx)
+
+            print('STY fit for {}:  Mstar={:.3f} +- {:.3f}, alpha={:.3f} +- {:.3f}, log10phistar={:.3f}'.format(xx, fit['MSTAR'], fit['MSTAR_ERR'], fit['ALPHA'], fit['ALPHA_ERR'], fit['LOG10PHISTAR']))
+
+            sty_meta(lf, fit)
+
+    return  vmax, result, result_stepwise, ref_result
+
+def write_lumfn(opath, result, result_stepwise, ref_result, inhash=None):
+    '''
+    Write a lumfn file:  LUMFN (or LUMFN_{MCOL}) extension(s), then LUMFN_STEP (or LUMFN_STEP_{MCOL}) 
+    & LUMFN_CMINUS extension(s) and the REFERENCE Schechter.
+    '''
     print(f'Writing {opath}')
 
+    if isinstance(result, Table):
+        result          = [result]
+
+    if isinstance(result_stepwise, Table):
+        result_stepwise = [result_stepwise]
+
     header     = fits.Header()
 
+    if inhash != None:
+        header['INHASH'] = inhash
+
     hx         = fits.HDUList()
     hx.append(fits.PrimaryHDU(header=header))
-    hx.append(fits.convenience.table_to_hdu(result))
-    hx.append(fits.convenience.table_to_hdu(result_stepwise))
+
+    for tab in result + result_stepwise:
+        hx.append(fits.convenience.table_to_hdu(tab))
+
     hx.append(fits.convenience.table_to_hdu(ref_result))
 
     hx.writeto(opath, overwrite=True)
+
+def process_cat(fpath, vmax_opath, survey='gama', extra_cols=[], bitmasks=['IN_D8LUMFN'], fillfactor=False, conservative=False, tier=None, d8=None, fdelta=None, fdelta_zp=None, index=None, Mcols=['MCOLOR_0P0'], inhash=None, sty=False):        
+    opath = vmax_opath
+
+    if isinstance(fpath, Table):
+        # E.g. a partition view, see findfile.fetch_partition
+        zmax  = fpath
+
+    elif not os.path.isfile(fpath):
+        # Do not crash and burn, but proceed on gracefully. 
+        print('WARNING:  Failed to find {}'.format(fpath))
+        return  1
+
+    else:
+        zmax  = Table.read(fpath)
+
+    if len(zmax) == 0:
+        print('Zero length catalogue, nothing to be done.') 
+        return -99
+
+    vmax, result, result_stepwise, ref_result = process_tier(zmax, survey=survey, extra_cols=list(extra_cols), bitmasks=list(bitmasks), fillfactor=fillfactor, tier=tier, d8=d8, index=index, Mcols=Mcols, sty=sty)
+        
+    print('Writing {}.'.format(opath))
+
+    write_desitable(opath, vmax, inhash=inhash)
+
+    ##  Write.
+    opath      = opath.replace('vmax', 'lumfn')
+
+    write_lumfn(opath, result, result_stepwise, ref_result, inhash=inhash)
     
     return  0
 
+def ddp_n8_d0(dat, tier, field, nfields):
+    '''
+    In-memory equivalent of the ddp_n8_d0 catalogue for a given tier and field, see gen_ddp_n8.py.
+    '''
+    isin          = (dat['DDP1_DELTA8_TIER'].data == tier) & (dat['FIELD'].data == field)
+
+    result        = dat[isin]
+    result.meta   = dict(dat.meta)
+
+    result.meta['AREA'] = dat.meta['AREA'] / nfields
+
+    return  result
+
+def tier_jackknife(lf, vmax, regions, rand_ids, Mcols, volfracs=None, d8s=None, tier=None):
+    '''
+    LUMFN_JK & per region LUMFN_JK{n} (or LUMFN_JK_{MCOL} & LUMFN_JK{n}_{MCOL}) extensions for the LFs of a
+    (density tier of a) vmax catalogue, from region sums of the catalogue & its randoms;  the jack knife mean
+    & error are added to the LFs.  The tier volume fraction & d8 of each realisation are recorded, if given.
+    '''
+    njack       = regions['NREGION']
+    weights     = jackknife_weights(njack)
+
+    ids         = assign_regions(vmax['RA'].data, vmax['DEC'].data, regions)
+
+    result      = []
+
+    for tab, xx in zip(list(lf), Mcols):
+        suffix                 = '' if len(Mcols) == 1 else f'_{xx}'
+
+        result_jk, volfracs_jk = resample_lumfn(vmax, ids, njack, weights, rand_ids=rand_ids, Mcol=xx, kind='JK')
+
+        result_jk.meta['JK_VOLFRAC'] = np.mean(volfracs_jk)
+        result_jk.meta['NJACK']      = njack
+        result_jk.meta['EXTNAME']    = f'LUMFN_JK{suffix}'
+
+        if 'DDP1_D8' in tab.meta:
+            result_jk.meta['DDP1_D8'] = tab.meta['DDP1_D8']
+
+        tab['PHI_IVMAX_JK']          = result_jk['PHI_IVMAX_JK']
+        tab['PHI_IVMAX_ERROR_JK']    = result_jk['PHI_IVMAX_ERROR_JK']
+
+        result.append(result_jk)
+
+        for ii, realz in enumerate(realisation_lumfns(result_jk, volfracs_jk, kind='JK', suffix=suffix)):
+            realz.meta['NJACK']      = njack
+
+            if volfracs is not None:
+                realz.meta[f'DDP1_d{tier}_VOLFRAC'] = volfracs[ii]
+
+            if d8s is not None:
+                realz.meta['DDP1_D8']               = d8s[ii]
+
+            result.append(realz)
+
+    return  result
+
+# Volume average fillfactor index, abs. mag. definitions & STY request of each batch worker, see density_split_batch. 
+_batch_index = None
+_batch_Mcols = ['MCOLOR_0P0']
+_batch_sty   = False
+
+def _init_batch(index, Mcols, sty=False):
+    global _batch_index, _batch_Mcols, _batch_sty
+
+    _batch_index = index
+    _batch_Mcols = Mcols
+    _batch_sty   = sty
+
+def _process_batch(run):
+    field, tier, zmax, d8 = run
+
+    print(f'\n\n\n\n----------------  Solving for field {field} and density tier {tier}  ----------------\n\n')
+
+    # Note: nested pools are unsupported in pool workers, hence serial stepwise.
+    return  process_tier(zmax, fillfactor=True, tier=tier, d8=d8, index=_batch_index, nproc=1, Mcols=_batch_Mcols, sty=_batch_sty)
+
+def density_split_batch(survey='gama', dryrun=False, nproc=12, write=True, Mcols=['MCOLOR_0P0'], sty=False, jackknife=False, regions='percentile'):
+    '''
+    Density split luminosity functions (vmax, 1/VMAX, stepwise & reference Schechter) for all tiers and 
+    fields in one process.  The ddp_n8 catalogue and randoms are read once, and the (field, tier) jobs solved 
+    concurrently by a worker pool.  Multi-field combinations are returned (and written) for each tier;  with
+    jackknife, also their jack knife realisations, from region sums of the vmax catalogues and randoms.
+    '''
+    fields        = fetch_fields(survey)
+    prefix        = 'randoms_ddp1'
+
+    if dryrun:
+        # A few galaxies have a high probability to be in highest density only. 
+        utiers    = np.array([8])
+
+    else:
+        utiers    = np.arange(len(d8_limits))
+
+    fpath         = findfile(ftype='ddp_n8', dryrun=dryrun, survey=survey)
+
+    print(f'Reading: {fpath}')
+
+    dat           = read_desitable(fpath)
+
+    # Limited to DDP1 (and redshift range), see gen_ddp_n8.py.
+    dat           = dat[(dat['ZSURV'] > dat.meta['DDP1_ZMIN']) & (dat['ZSURV'] < dat.meta['DDP1_ZMAX'])]
+
+    print('Calculating multi-field volume fractions.')
+
+    rand_vmax_all = vmaxer_rand(survey=survey, ftype='randoms_bd_ddp_n8', dryrun=dryrun, prefix=prefix, write=False)
+
+    # HACK SURVEYHACK: must match vmaxer. 
+    index         = volavg_index(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix=prefix)
+
+    if jackknife:
+        # Regions solved once, on all randoms;  the tier volume fractions & d8 of each realisation from their region sums.
+        rand_regions  = solve_regions(rand_vmax_all['RANDOM_RA'].data, rand_vmax_all['RANDOM_DEC'].data, kind=regions, ndiv=2)
+        rand_ids      = assign_regions(rand_vmax_all['RANDOM_RA'].data, rand_vmax_all['RANDOM_DEC'].data, rand_regions)
+        rand_tiers    = rand_vmax_all['DDP1_DELTA8_TIER'].data
+
+        jk_weights    = jackknife_weights(rand_regions['NREGION'])
+
+        jk_volfracs   = resample_tier_volfracs(rand_ids, rand_tiers, rand_regions['NREGION'], len(d8_limits), jk_weights)
+        jk_d8s        = resample_mean(rand_ids, rand_vmax_all['DDP1_DELTA8'].data, rand_regions['NREGION'], jk_weights, bins=rand_tiers, nbin=len(d8_limits))
+
+    runs          = []
+    ngals         = {}
+
+    for idx in utiers:
+        d8        = float(rand_vmax_all.meta['DDP1_d{}_TIERMEDd8'.format(idx)])
+
+        # As written to the ddp_n8_d0 catalogues by gen_ddp_n8.py.
+        ngals[idx] = np.count_nonzero(dat['DDP1_DELTA8_TIER'].data == idx)
+
+        for field in fields:
+            zmax  = ddp_n8_d0(dat, idx, field, len(fields))
+
+            if len(zmax) == 0:
+                print(f'Zero length catalogue for field {field} and tier {idx}, nothing to be done.')
+                continue
+
+            runs.append([field, idx, zmax, d8])
+
+    del dat
+
+    print('Solving for {} (field, tier) luminosity functions with {} processes.'.format(len(runs), nproc))
+
+    with multiprocessing.get_context('spawn').Pool(nproc, initializer=_init_batch, initargs=(index, Mcols, sty)) as pool:
+        results = pool_map(pool, _process_batch, runs)
+
+        pool.close()
+
+        # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join
+        pool.join()
+
+    solved    = {}
+
+    for run, result in zip(runs, results):
+        field, idx, _, _ = run
+
+        vmax, lf, lf_step, ref = result
+
+        solved[(field, idx)]   = result
+
+        if write:
+            opath = findfile(ftype='ddp_n8_d0_vmax', dryrun=dryrun, field=field, survey=survey, utier=idx)
+
+            print('Writing {}.'.format(opath))
+
+            write_desitable(opath, vmax, background=True)
+            write_background(write_lumfn, opath.replace('vmax', 'lumfn'), lf, lf_step, ref)
+
+    multifield = {}
+
+    for idx in utiers:
+        tier_results = [solved[(field, idx)] for field in fields if (field, idx) in solved]
+
+        if len(tier_results) == 0:
+            continue
+
+        print(f'Solving for multi-field luminosity function of tier {idx}.')
+
+        lf      = []
+        lf_step = []
+
+        # Per abs. mag. definition.
+        for ii, tab in enumerate(tier_results[0][1]):
+            ext     = tab.meta['EXTNAME']
+
+            lf.append(multifield_lumfn([x[1][ii] for x in tier_results], ext=ext, sub_cols=tab.colnames))
+
+            lf[-1].meta['EXTNAME']    = ext
+            lf[-1].meta['ABSMAG_DEF'] = tab.meta['ABSMAG_DEF']
+
+        for ii, tab in enumerate(tier_results[0][2]):
+            ext     = tab.meta['EXTNAME']
+
+            lf_step.append(multifield_lumfn([x[2][ii] for x in tier_results], ext=ext, sub_cols=tab.colnames))
+
+            lf_step[-1].meta['EXTNAME']    = ext
+            lf_step[-1].meta['ABSMAG_DEF'] = tab.meta['ABSMAG_DEF']
+
+        ref     = multifield_lumfn([x[3] for x in tier_results], ext='REFERENCE')
+        ref.meta['EXTNAME'] = 'REFERENCE'
+
+        for tab in lf + lf_step:
+            tab.meta['DDP1_D8'] = tier_results[0][1][0].meta['DDP1_D8']
+            tab.meta['NFIELD']  = len(tier_results)
+
+            tab.meta['DDP1_D{}_NGAL'.format(idx)] = ngals[idx]
+
+        if jackknife:
+            # Multi-field 1/VMAX is the mean over fields, i.e. of the total volume.
+            vmax    = vstack([x[0] for x in tier_results], metadata_conflicts='silent')
+            vmax['VMAX'] *= len(tier_results)
+
+            lf     += tier_jackknife(lf, vmax, rand_regions, rand_ids[rand_tiers == idx], Mcols, volfracs=jk_volfracs[:,idx], d8s=jk_d8s[:,idx], tier=idx)
+
+        multifield[idx] = [lf, lf_step, ref]
+
+        if write:
+            opath = findfile(ftype='ddp_n8_d0_lumfn', dryrun=dryrun, field='GALL', survey=survey, utier=idx)
+
+            write_background(write_lumfn, opath, lf, lf_step, ref)
+
+    flush_writes()
+
+    return  solved, multifield
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Generate Gold luminosity function.')
@@ -89,7 +387,12 @@ if __name__ == '__main__':
     parser.add_argument('--dryrun', action='store_true', help='dryrun.')
     parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
     parser.add_argument('--jackknife', help='Apply jack knife.', action='store_true')
+    parser.add_argument('--regions', help='Jack knife regions on the sky:  RA/DEC percentiles or k-means, see resample.', choices=['percentile', 'kmeans'], default='percentile')
     parser.add_argument('--conservative', help='Conservative analysis choices', action='store_true')
+    parser.add_argument('--batch', help='Solve density split LFs for all fields and tiers in one process.', action='store_true')
+    parser.add_argument('--nproc', type=int, help='Number of processors', default=12)
+    parser.add_argument('--sty', help='Unbinned STY Schechter fit of each LF, recorded in the LUMFN header.', action='store_true')
+    parser.add_argument('--Mcols', type=str, nargs='+', help='Abs. mag. definitions, e.g. MCOLOR_0P0 MALL_0P0 MQZERO_0P0 DDPMALL_0P0; one LUMFN extension each.', default=['MCOLOR_0P0'])
     
     args          = parser.parse_args()
 
@@ -99,9 +402,35 @@ if __name__ == '__main__':
     survey        = args.survey
     density_split = args.density_split
     jackknife     = args.jackknife
+    region_kind   = args.regions
     conservative  = args.conservative
+    batch         = args.batch
+    nproc         = args.nproc
+    Mcols         = args.Mcols
+    sty           = args.sty
     
-    if not density_split:
+    if density_split & batch:
+        if log:
+            # HACK
+            logfile = findfile(ftype='ddp_n8_d0_vmax', dryrun=False, field='GALL', survey=survey, log=True).replace('vmax', 'lumfn').replace('_{utier}', '')
+
+            print(f'Logging to {logfile}')
+
+            sys.stdout = open(logfile, 'w')
+
+        print('Generating Gold density-split LF for all fields.')
+
+        call_signature(dryrun, sys.argv)
+
+        with stage('density_split_batch', opath=findfile(ftype='ddp_n8_d0_lumfn', dryrun=dryrun, field='GALL', survey=survey, utier='all')):
+            density_split_batch(survey=survey, dryrun=dryrun, nproc=nproc, write=True, Mcols=Mcols, sty=sty, jackknife=jackknife, regions=region_kind)
+
+        print('Done.')
+
+        if log:
+            sys.stdout.close()
+
+    elif not density_split:
         if log:
             logfile = findfile(ftype='lumfn', dryrun=False, survey=survey, log=True)
             
@@ -120,46 +449,78 @@ if __name__ == '__main__':
         fpath  = findfile(ftype='ddp_n8', dryrun=dryrun, survey=survey)
         opath  = findfile(ftype='vmax',   dryrun=dryrun, survey=survey)
 
+        inhash = stage_hash(inputs=[fpath], params={'fillfactor_threshold': fillfactor_threshold, 'sty': sty})
+
         if args.nooverwrite:
-            overwrite_check(opath)
+            overwrite_check(opath, inhash=inhash)
 
-        print(f'Reading: {fpath}')
-        print(f'Writing: {opath}')
+        with stage('reference_lf', opath=opath):
+            print(f'Reading: {fpath}')
+            print(f'Writing: {opath}')
 
-        process_cat(fpath, opath, survey=survey, fillfactor=True)
+            process_cat(fpath, opath, survey=survey, fillfactor=True, Mcols=Mcols, inhash=inhash, sty=sty)
 
-        if jackknife:
-            vmax                           = Table.read(opath)
-            rand_vmax                      = vmaxer_rand(survey=survey, ftype='randoms_bd_ddp_n8', dryrun=dryrun, prefix=prefix, conservative=conservative, write=False)
+            if jackknife:
+                with stage('jackknife'):
+                    prefix                         = 'randoms_ddp1'
+
+                    vmax                           = Table.read(opath)
+                    rand_vmax                      = vmaxer_rand(survey=survey, ftype='randoms_bd_ddp_n8', dryrun=dryrun, prefix=prefix, conservative=conservative, write=False)
+
+                    # Solve for jack knife regions, once, on the randoms.
+                    regions                        = solve_regions(rand_vmax['RANDOM_RA'].data, rand_vmax['RANDOM_DEC'].data, kind=region_kind, ndiv=2)
+                    limits                         = region_limits(regions)
+                    njack                          = regions['NREGION']
+
+                    rand_ids                       = assign_regions(rand_vmax['RANDOM_RA'].data, rand_vmax['RANDOM_DEC'].data, regions)
+                    ids                            = assign_regions(vmax['RA'].data, vmax['DEC'].data, regions)
+
+                    # Save jack knife limits.
+                    jpath                          = findfile(ftype='jackknife', prefix=prefix, dryrun=dryrun)
+
+                    with open(jpath, 'w') as ofile:
+                        yaml.dump(dict(limits), ofile, default_flow_style=False)
 
-            # Solve for jack knife limits.
-            njack, jk_volfrac, limits, jks = solve_jackknife(rand_vmax)
+                    print(f'Writing: {jpath}')
 
-            rand_vmax['JK']                = jks
-            rand_vmax.meta['NJACK']        = njack
-            rand_vmax.meta['JK_VOLFRAC']   = jk_volfrac
+                    lpath                          = findfile(ftype='lumfn', dryrun=dryrun, survey=survey, prefix=prefix)
 
-            # Set jack knife limits to data.
-            vmax['JK']                     = set_jackknife(vmax['RA'], vmax['DEC'], limits=limits, debug=False)
-            vmax.meta['NJACK']             = njack
-            vmax.meta['JK_VOLFRAC']        = jk_volfrac
+                    with fits.open(lpath, mode='update') as hdulist:
+                        for xx in Mcols:
+                            # Single definition retains the LUMFN extension, see process_tier.
+                            suffix                 = '' if len(Mcols) == 1 else f'_{xx}'
+                            extname                = f'LUMFN{suffix}'
 
-            # Save jack knife limits.
-            jpath                          = findfile(ftype='jackknife', prefix=prefix, dryrun=dryrun)
+                            # Jack knife & bootstrap realisations from the same per-region partial sums;  randoms weighted volumes for both.
+                            result_jk, volfracs_jk = resample_lumfn(vmax, ids, njack, jackknife_weights(njack), rand_ids=rand_ids, Mcol=xx, kind='JK')
+                            result_boot, _         = resample_lumfn(vmax, ids, njack, bootstrap_weights(njack), rand_ids=rand_ids, Mcol=xx, kind='BOOT')
 
-            with open(jpath, 'w') as ofile:
-                yaml.dump(dict(limits), ofile, default_flow_style=False)
+                            result_jk.meta['JK_VOLFRAC']   = np.mean(volfracs_jk)
+                            result_jk.meta['NJACK']        = njack
+                            result_jk.meta['EXTNAME']      = f'LUMFN_JK{suffix}'
+                            result_boot.meta['EXTNAME']    = f'LUMFN_BOOT{suffix}'
 
-            print(f'Writing: {jpath}')
+                            hdr                    = hdulist[extname].header
 
-            lpath                          = findfile(ftype='lumfn', dryrun=dryrun, survey=survey, prefix=prefix)
-            jackknife                      = np.arange(njack)
+                            lf                     = Table(hdulist[extname].data)
 
-            lumfn(vmax, jackknife=jackknife, opath=lpath)
+                            for col in ['PHI_IVMAX_JK', 'PHI_IVMAX_ERROR_JK', 'PHI_IVMAX_BOOT', 'PHI_IVMAX_ERROR_BOOT']:
+                                lf[col]            = result_jk[col] if col in result_jk.colnames else result_boot[col]
 
-            print(f'Written {lpath}')
+                            hdulist[extname]       = fits.BinTableHDU(lf, name=extname, header=hdr)
 
-            jackknife_mean(lpath)
+                            hdulist.append(fits.convenience.table_to_hdu(result_jk))
+                            hdulist.append(fits.convenience.table_to_hdu(result_boot))
+
+                            # Per region LUMFN_JK{n} (or LUMFN_JK{n}_{MCOL}) extensions, as lumfn with a jack knife array.
+                            for realz in realisation_lumfns(result_jk, volfracs_jk, kind='JK', suffix=suffix):
+                                realz.meta['NJACK'] = njack
+
+                                hdulist.append(fits.convenience.table_to_hdu(realz))
+
+                        hdulist.flush()
+
+                    print(f'Written {lpath}')
         
         print('Done.')
 
@@ -190,15 +551,28 @@ if __name__ == '__main__':
                     
         rand_vmax_all   = None 
 
+        # Randoms sorted by z for the volume averaged fillfactor of all tiers; read from cache if available.
+        # HACK SURVEYHACK: must match vmaxer. 
+        index           = volavg_index(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1')
+
         for idx in utiers:
             print(f'\n\n\n\n----------------  Solving for density tier {idx}  ----------------\n\n')
 
             # Bounded by DDP1 z limits. 
             ddp_fpath                      = findfile(ftype='ddp_n8_d0', dryrun=dryrun, field=field, survey=survey, utier=idx)
             ddp_opath                      = findfile(ftype='ddp_n8_d0_vmax', dryrun=dryrun, field=field, survey=survey, utier=idx)
-    
+            ddp_ppath                      = findfile(ftype='ddp_n8_d0_parts', dryrun=dryrun, survey=survey)
+
             print()
-            print('Reading: {}'.format(ddp_fpath))
+
+            if os.path.isfile(ddp_ppath):
+                # Partitioned ddp_n8_d0 preferred to a (possibly stale) legacy file, see gen_ddp_n8.py
+                print('Reading: {}'.format(ddp_ppath))
+
+                ddp_fpath                  = fetch_partition('ddp_n8_d0', field, idx, dryrun=dryrun, survey=survey)
+
+            else:
+                print('Reading: {}'.format(ddp_fpath))
 
             prefix                         = 'randoms_ddp1'
             rpath                          = findfile(ftype='randoms_bd_ddp_n8', dryrun=dryrun, field=field, survey=survey, prefix=prefix)
@@ -219,7 +593,7 @@ if __name__ == '__main__':
 
             rand_vmax                      = rand_vmax_all[rand_vmax_all['DDP1_DELTA8_TIER'] == idx]
         
-            failure                        = process_cat(ddp_fpath, ddp_opath, fillfactor=True, tier=idx, d8=d8, fdelta=fdelta, fdelta_zp=fdelta_zp)
+            failure                        = process_cat(ddp_fpath, ddp_opath, fillfactor=True, tier=idx, d8=d8, fdelta=fdelta, fdelta_zp=fdelta_zp, index=index, Mcols=Mcols, sty=sty)
 
             print('LF process cat. complete.')
 
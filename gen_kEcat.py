@@ -10,10 +10,11 @@ from   smith_kcorr     import GAMA_KCorrection
 from   rest_gmr        import smith_rest_gmr
 from   tmr_ecorr       import tmr_ecorr, tmr_q
 from   abs_mag         import abs_mag
-from   findfile        import findfile, fetch_fields, overwrite_check, write_desitable
+from   findfile        import findfile, fetch_fields, overwrite_check, write_desitable, read_desitable, stage_hash
 from   multiprocessing import Pool
 from   functools       import partial
 from   config          import Configuration
+from   runtime         import stage, pool_map
 
 np.random.seed(314)
 
@@ -58,33 +59,15 @@ def sub_kE(dat, kcorr_r, kcorr_g):
 
     return dat
 
-def gen_kE(log, dryrun, survey, nooverwrite, nproc=12):
-    root      = os.environ['GOLD_DIR']
-
-    fpath     = findfile(ftype='gold', dryrun=dryrun, survey=survey)
-    opath     = findfile(ftype='kE',   dryrun=dryrun, survey=survey)
-
-    if log:
-        logfile = findfile(ftype='kE', dryrun=False, survey=survey, log=True)
-
-        print(f'Logging to {logfile}')
-
-        sys.stdout = open(logfile, 'w')
-
-    if args.nooverwrite:
-        overwrite_check(opath)
-
-    fields    = fetch_fields(survey)
-
-    print(f'Reading {fpath}')
-    print(f'Writing {opath}')
-  
-    dat       = Table.read(fpath)
-    dat.pprint()
-
+def kE_cat(dat, nproc=12):
+    '''
+    k & e corrections, rest-frame colours and abs. mags. of a gold catalogue, in memory.
+    '''
     kcorr_r   = GAMA_KCorrection(band='R')
     kcorr_g   = GAMA_KCorrection(band='G')
 
+    meta      = dat.meta
+
     split_idx = np.arange(len(dat))
     split_idx = np.array_split(split_idx, 10)
     dat       = [dat[x] for x in split_idx]
@@ -95,13 +78,15 @@ def gen_kE(log, dryrun, survey, nooverwrite, nproc=12):
 
     # --  Multi-processing  --
     with multiprocessing.get_context('spawn').Pool(nproc) as pool:
-        dat = vstack(pool.map(partial(sub_kE, kcorr_r=kcorr_r, kcorr_g=kcorr_g), dat))
+        dat = vstack(pool_map(pool, partial(sub_kE, kcorr_r=kcorr_r, kcorr_g=kcorr_g), dat))
 
         pool.close()
 
         # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join                                                                                                       
         pool.join()
 
+    dat.meta  = meta
+
     nwarn   = (dat['REST_GMR_0P1_WARN'].data > 0)
     nwarn   = np.count_nonzero(nwarn)
 
@@ -113,11 +98,42 @@ def gen_kE(log, dryrun, survey, nooverwrite, nproc=12):
     ##  Stack
     dat.meta['IMMUTABLE'] = 'False'
 
-    dat.pprint()
+    return  dat
+
+def gen_kE(log, dryrun, survey, nooverwrite, nproc=12):
+    root      = os.environ['GOLD_DIR']
+
+    fpath     = findfile(ftype='gold', dryrun=dryrun, survey=survey)
+    opath     = findfile(ftype='kE',   dryrun=dryrun, survey=survey)
+
+    if log:
+        logfile = findfile(ftype='kE', dryrun=False, survey=survey, log=True)
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    inhash    = stage_hash(inputs=[fpath] if os.path.isfile(fpath) else [])
+
+    if nooverwrite:
+        overwrite_check(opath, inhash=inhash)
+
+    print(f'Reading {fpath}')
+    print(f'Writing {opath}')
+
+    with stage('kE', opath=opath):
+        with stage('read'):
+            dat   = read_desitable(fpath)
+            dat.pprint()
+
+        with stage('kE_cat'):
+            dat   = kE_cat(dat, nproc=nproc)
+            dat.pprint()
 
-    print('Writing {}.'.format(opath))
+        print('Writing {}.'.format(opath))
 
-    write_desitable(opath, dat)
+        with stage('write'):
+            write_desitable(opath, dat, inhash=inhash)
 
     if log:
         sys.stdout.close()
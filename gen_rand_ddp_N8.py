@@ -12,8 +12,8 @@ from   astropy.table     import Table
 from   scipy.spatial     import KDTree
 from   cartesian         import cartesian
 from   delta8_limits     import d8_limits, delta8_tier
-from   runtime           import calc_runtime
-from   findfile          import fetch_fields, findfile, overwrite_check
+from   runtime           import calc_runtime, stage
+from   findfile          import fetch_fields, findfile, overwrite_check, stage_hash, read_desitable, write_desitable
 from   config            import Configuration
 from   volfracs          import volfracs
 from   bitmask           import lumfn_mask, consv_mask, update_bit
@@ -53,7 +53,7 @@ start   = time.time()
 
 fpath   = findfile(ftype='ddp', dryrun=dryrun, survey=survey, prefix=prefix)
 
-dat     = Table.read(fpath)
+dat     = read_desitable(fpath, columns=['FIELD', 'DDP', 'CARTESIAN_X', 'CARTESIAN_Y', 'CARTESIAN_Z'])
 dat     = dat[dat['FIELD'] == field]
 
 runtime = calc_runtime(start, 'Reading {:.2f}M Gold DDP'.format(len(dat) / 1.e6), xx=dat)
@@ -61,96 +61,99 @@ runtime = calc_runtime(start, 'Reading {:.2f}M Gold DDP'.format(len(dat) / 1.e6)
 fpath   = findfile(ftype='randoms_bd', dryrun=dryrun, field=field, survey=survey, prefix=prefix)
 opath   = findfile(ftype='randoms_bd_ddp_n8', dryrun=dryrun, field=field, survey=survey, prefix=prefix)
 
+inhash  = stage_hash(inputs=[findfile(ftype='ddp', dryrun=dryrun, survey=survey, prefix=prefix), fpath], params={'fillfactor_threshold': fillfactor_threshold})
+
 if nooverwrite:
-    overwrite_check(opath)
+    overwrite_check(opath, inhash=inhash)
 
-# Should be solid angle and DDP1 z-limit defined randoms.     
-rand    = Table.read(fpath)
-runtime = calc_runtime(start, 'Reading {:.2f}M randoms'.format(len(rand) / 1.e6), xx=rand)
+with stage('rand_ddp_n8', opath=opath):
+    # Should be solid angle and DDP1 z-limit defined randoms.     
+    rand    = Table.read(fpath)
+    runtime = calc_runtime(start, 'Reading {:.2f}M randoms'.format(len(rand) / 1.e6), xx=rand)
 
-# Remove anything already in randoms header. 
-present = list(dat.meta.keys()) 
+    # Remove anything already in randoms header. 
+    present = list(dat.meta.keys()) 
 
-for pp in present:
-    if pp in rand.meta.keys():
-        del dat.meta[pp]
+    for pp in present:
+        if pp in rand.meta.keys():
+            del dat.meta[pp]
 
-assert 'AREA' not in dat.meta.keys()
+    assert 'AREA' not in dat.meta.keys()
 
-# Propagate header 'DDP1_ZMIN' etc. to randoms.
-rand.meta.update(dat.meta)
+    # Propagate header 'DDP1_ZMIN' etc. to randoms.
+    rand.meta.update(dat.meta)
 
-points       = np.c_[rand['CARTESIAN_X'], rand['CARTESIAN_Y'], rand['CARTESIAN_Z']]
-points       = np.array(points, copy=True)
+    points       = np.c_[rand['CARTESIAN_X'], rand['CARTESIAN_Y'], rand['CARTESIAN_Z']]
+    points       = np.array(points, copy=True)
 
-kd_tree_rand = KDTree(points)
+    kd_tree_rand = KDTree(points)
 
-del points 
+    del points 
 
-gc.collect()
+    gc.collect()
 
-# Calculate DDP1/2/3 8-sphere counts for each random. 
-for idx in range(3):
-    ddp_idx      = idx + 1
+    # Calculate DDP1/2/3 8-sphere counts for each random. 
+    for idx in range(3):
+        ddp_idx      = idx + 1
 
-    runtime      = calc_runtime(start, 'Solving for DDP {}'.format(ddp_idx))
+        runtime      = calc_runtime(start, 'Solving for DDP {}'.format(ddp_idx))
     
-    ddp          = dat[dat['DDP'][:,idx] == 1]
-    points_ddp   = np.c_[ddp['CARTESIAN_X'], ddp['CARTESIAN_Y'], ddp['CARTESIAN_Z']]
-    points_ddp   = np.array(points_ddp, copy=True)
+        ddp          = dat[dat['DDP'][:,idx] == 1]
+        points_ddp   = np.c_[ddp['CARTESIAN_X'], ddp['CARTESIAN_Y'], ddp['CARTESIAN_Z']]
+        points_ddp   = np.array(points_ddp, copy=True)
     
-    kd_tree_ddp  = KDTree(points_ddp)    
-    indexes_ddp  = kd_tree_rand.query_ball_tree(kd_tree_ddp, r=8.)
+        kd_tree_ddp  = KDTree(points_ddp)    
+        indexes_ddp  = kd_tree_rand.query_ball_tree(kd_tree_ddp, r=8.)
 
-    rand['DDP{:d}_N8'.format(ddp_idx)] = np.array([len(idx) for idx in indexes_ddp])
+        rand['DDP{:d}_N8'.format(ddp_idx)] = np.array([len(idx) for idx in indexes_ddp])
                                       
-ddp1_zmin           = dat.meta['DDP1_ZMIN']
-ddp1_zmax           = dat.meta['DDP1_ZMAX']
+    ddp1_zmin           = dat.meta['DDP1_ZMIN']
+    ddp1_zmax           = dat.meta['DDP1_ZMAX']
 
-ddp2_zmin           = dat.meta['DDP2_ZMIN']
-ddp2_zmax           = dat.meta['DDP2_ZMAX']
+    ddp2_zmin           = dat.meta['DDP2_ZMIN']
+    ddp2_zmax           = dat.meta['DDP2_ZMAX']
 
-ddp3_zmin           = dat.meta['DDP3_ZMIN']
-ddp3_zmax           = dat.meta['DDP3_ZMAX']
+    ddp3_zmin           = dat.meta['DDP3_ZMIN']
+    ddp3_zmax           = dat.meta['DDP3_ZMAX']
 
-print('Found redshift limits: {:.3f} < z < {:.3f}'.format(ddp1_zmin, ddp1_zmax))
+    print('Found redshift limits: {:.3f} < z < {:.3f}'.format(ddp1_zmin, ddp1_zmax))
 
-rand['DDPZLIMS']      = np.zeros(len(rand) * 3, dtype=int).reshape(len(rand), 3)
+    rand['DDPZLIMS']      = np.zeros(len(rand) * 3, dtype=int).reshape(len(rand), 3)
 
-rand['DDPZLIMS'][:,0] = (rand['Z'].data > ddp1_zmin) & (rand['Z'].data < ddp1_zmax)
-rand['DDPZLIMS'][:,1] = (rand['Z'].data > ddp2_zmin) & (rand['Z'].data < ddp2_zmax)
-rand['DDPZLIMS'][:,2] = (rand['Z'].data > ddp3_zmin) & (rand['Z'].data < ddp3_zmax)
+    rand['DDPZLIMS'][:,0] = (rand['Z'].data > ddp1_zmin) & (rand['Z'].data < ddp1_zmax)
+    rand['DDPZLIMS'][:,1] = (rand['Z'].data > ddp2_zmin) & (rand['Z'].data < ddp2_zmax)
+    rand['DDPZLIMS'][:,2] = (rand['Z'].data > ddp3_zmin) & (rand['Z'].data < ddp3_zmax)
 
-rand['DDP1_DELTA8']   = (rand['DDP1_N8'] / (rand.meta['VOL8'] * dat.meta['DDP1_DENS']) / rand['FILLFACTOR']) - 1.
-rand['DDP2_DELTA8']   = (rand['DDP2_N8'] / (rand.meta['VOL8'] * dat.meta['DDP2_DENS']) / rand['FILLFACTOR']) - 1.
-rand['DDP3_DELTA8']   = (rand['DDP3_N8'] / (rand.meta['VOL8'] * dat.meta['DDP3_DENS']) / rand['FILLFACTOR']) - 1.
+    rand['DDP1_DELTA8']   = (rand['DDP1_N8'] / (rand.meta['VOL8'] * dat.meta['DDP1_DENS']) / rand['FILLFACTOR']) - 1.
+    rand['DDP2_DELTA8']   = (rand['DDP2_N8'] / (rand.meta['VOL8'] * dat.meta['DDP2_DENS']) / rand['FILLFACTOR']) - 1.
+    rand['DDP3_DELTA8']   = (rand['DDP3_N8'] / (rand.meta['VOL8'] * dat.meta['DDP3_DENS']) / rand['FILLFACTOR']) - 1.
 
-rand['DDP1_DELTA8_TIER']      = delta8_tier(rand['DDP1_DELTA8'].data)
+    rand['DDP1_DELTA8_TIER']      = delta8_tier(rand['DDP1_DELTA8'].data)
 
-# Same again, but random included in sphere-8 count for volume fractions used within DDP1 magnitude limits.
-rand['DDP1_DELTA8_ZEROPOINT'] = ((1 + rand['DDP1_N8']) / (rand.meta['VOL8'] * dat.meta['DDP1_DENS']) / rand['FILLFACTOR']) - 1.
-rand['DDP2_DELTA8_ZEROPOINT'] = ((1 + rand['DDP2_N8']) / (rand.meta['VOL8'] * dat.meta['DDP2_DENS']) / rand['FILLFACTOR']) - 1.
-rand['DDP3_DELTA8_ZEROPOINT'] = ((1 + rand['DDP3_N8']) / (rand.meta['VOL8'] * dat.meta['DDP3_DENS']) / rand['FILLFACTOR']) - 1.
+    # Same again, but random included in sphere-8 count for volume fractions used within DDP1 magnitude limits.
+    rand['DDP1_DELTA8_ZEROPOINT'] = ((1 + rand['DDP1_N8']) / (rand.meta['VOL8'] * dat.meta['DDP1_DENS']) / rand['FILLFACTOR']) - 1.
+    rand['DDP2_DELTA8_ZEROPOINT'] = ((1 + rand['DDP2_N8']) / (rand.meta['VOL8'] * dat.meta['DDP2_DENS']) / rand['FILLFACTOR']) - 1.
+    rand['DDP3_DELTA8_ZEROPOINT'] = ((1 + rand['DDP3_N8']) / (rand.meta['VOL8'] * dat.meta['DDP3_DENS']) / rand['FILLFACTOR']) - 1.
 
-rand['DDP1_DELTA8_TIER_ZEROPOINT'] = delta8_tier(rand['DDP1_DELTA8_ZEROPOINT'])
+    rand['DDP1_DELTA8_TIER_ZEROPOINT'] = delta8_tier(rand['DDP1_DELTA8_ZEROPOINT'])
 
-# Meeting sphere-completeness cut.  Ultimately, this will correct VMAX from solid angle and DDP1                                                                                                         
-# redshift limits to that meeting the completeness cut (in volume).                                                                                                                                        
-update_bit(rand['IN_D8LUMFN'], lumfn_mask, 'FILLFACTOR', rand['FILLFACTOR'].data < fillfactor_threshold)
+    # Meeting sphere-completeness cut.  Ultimately, this will correct VMAX from solid angle and DDP1                                                                                                         
+    # redshift limits to that meeting the completeness cut (in volume).                                                                                                                                        
+    update_bit(rand['IN_D8LUMFN'], lumfn_mask, 'FILLFACTOR', rand['FILLFACTOR'].data < fillfactor_threshold)
 
-print('Fraction of randoms meeting IN_D8LUMFN cut: {}'.format(np.mean(rand['IN_D8LUMFN'])))
+    print('Fraction of randoms meeting IN_D8LUMFN cut: {}'.format(np.mean(rand['IN_D8LUMFN'])))
 
-for ii, xx in enumerate(d8_limits):
-    rand.meta['D8{}LIMS'.format(ii)] = str(xx)
+    for ii, xx in enumerate(d8_limits):
+        rand.meta['D8{}LIMS'.format(ii)] = str(xx)
 
-# Single-field values defined in header.
-rand    = volfracs(rand, bitmasks=['IN_D8LUMFN'])
+    # Single-field values defined in header.
+    rand    = volfracs(rand, bitmasks=['IN_D8LUMFN'])
         
-runtime = calc_runtime(start, 'Writing {}'.format(opath), xx=rand)
+    runtime = calc_runtime(start, 'Writing {}'.format(opath), xx=rand)
 
-rand.write(opath, format='fits', overwrite=True)
+    write_desitable(opath, rand, inhash=inhash)
 
-runtime = calc_runtime(start, 'Finished')
+    runtime = calc_runtime(start, 'Finished')
 
 if log:
     sys.stdout.close()
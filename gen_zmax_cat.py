@@ -14,9 +14,10 @@ from   scipy.optimize  import brent, minimize, brentq
 from   astropy.table   import Table
 from   functools       import partial
 from   multiprocessing import Pool
-from   findfile        import findfile, overwrite_check, write_desitable, fetch_header
+from   findfile        import findfile, overwrite_check, write_desitable, read_desitable, fetch_header, stage_hash
 from   config          import Configuration
 from   abs_mag         import abs_mag
+from   runtime         import stage, pool_map
 
 
 kcorr_r          = GAMA_KCorrection(band='R')
@@ -79,7 +80,7 @@ def zmax(rest_gmrs_0p1, rest_gmrs_0p0, theta_zs, drs, aall=False, debug=True, np
 
    with multiprocessing.get_context('spawn').Pool(processes=nproc) as pool:
        arglist = list(zip(rest_gmrs_0p1, rest_gmrs_0p0, theta_zs, drs))
-       result  = pool.starmap(partial(solve_theta, aall=aall, startz=startz), arglist)
+       result  = pool_map(pool, partial(solve_theta, aall=aall, startz=startz), arglist, star=True)
    
        pool.close()
 
@@ -90,56 +91,11 @@ def zmax(rest_gmrs_0p1, rest_gmrs_0p0, theta_zs, drs, aall=False, debug=True, np
 
    return  result[:,0], result[:,1], result[:,2]
 
-
-if __name__ == '__main__':
-    parser  = argparse.ArgumentParser(description='Gen zmax cat.')
-    parser.add_argument('--log', help='Create a log file of stdout.', action='store_true')  
-    parser.add_argument('-a', '--aall',   help='All Q, no red/blue split.', action='store_true')
-    parser.add_argument('-d', '--dryrun', help='Dryrun.', action='store_true')
-    parser.add_argument('--nproc', type=int, help='Number of processors', default=14)
-    parser.add_argument('-s', '--survey', help='Select survey', default='gama')
-    parser.add_argument('--theta_def',    help='Specifier for definition of theta', default='Z_THETA_QCOLOR')
-    parser.add_argument('--config',       help='Path to configuration file', type=str, default=findfile('config'))
-    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
-    
-    args      = parser.parse_args()
-    log       = args.log
-    aall      = args.aall
-    nproc     = args.nproc 
-    dryrun    = args.dryrun
-    survey    = args.survey.lower()
-    theta_def = args.theta_def
-
-    config    = Configuration(args.config)
-    config.update_attributes('zmax', args)
-    config.write()
-
-    rlim      = fetch_header(ftype='gold', name='RLIM', survey=survey)
-    rmax      = fetch_header(ftype='gold', name='RMAX', survey=survey)
-
-    start     = time.time()
-
-    if log:
-        logfile = findfile(ftype='zmax', dryrun=False, survey=survey, log=True)
-
-        print(f'Logging to {logfile}')
-
-        sys.stdout = open(logfile, 'w')
-
-    print('Assuming {:.4f} < r < {:.4f}'.format(rmax, rlim))
-    print('Assuming Q ALL = {}'.format(aall))
-    
-    fpath  = findfile(ftype='kE',   dryrun=dryrun, survey=survey)
-    opath  = findfile(ftype='zmax', dryrun=dryrun, survey=survey)
-    
-    if args.nooverwrite:
-        overwrite_check(opath)
-
-    print('Reading {}.'.format(fpath))
-        
-    dat = Table.read(fpath)
-    dat.pprint()
-
+def zmax_cat(dat, rlim, rmax, theta_def='Z_THETA_QCOLOR', aall=False, nproc=14):
+    '''
+    Min. & max. redshift (and VMAX) each galaxy would be visible given the bright (rmax) and
+    faint (rlim) limits, for a kE catalogue in memory.
+    '''
     dat['DELTA_DETMAG_FAINT'] = rlim - dat['DETMAG']
 
     print('Solving for {} bounding curve'.format(rlim))
@@ -178,12 +134,6 @@ if __name__ == '__main__':
     dat['VMAX']  = volcom(dat['ZMAX'], dat.meta['AREA'])
     dat['VMAX'] -= volcom(dat['ZMIN'], dat.meta['AREA'])
 
-    print('Writing {}.'.format(opath))
-
-    dat.pprint()
-
-    write_desitable(opath, dat)
-
     nwarn   = (dat['ZMAX_WARN'].data > 0) | (dat['ZMIN_WARN'].data > 0)
     nwarn   = np.count_nonzero(nwarn)
 
@@ -200,6 +150,71 @@ if __name__ == '__main__':
     for method, name in zip(range(3), ['BRENTQ', 'NELDER', 'BRENT']):
         print('{}\t{:d}\t{:d}'.format(name, np.count_nonzero(dat['ZMAX_METHOD'] == method), np.count_nonzero(dat['ZMIN_METHOD'] == method)))
 
+    return  dat
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Gen zmax cat.')
+    parser.add_argument('--log', help='Create a log file of stdout.', action='store_true')  
+    parser.add_argument('-a', '--aall',   help='All Q, no red/blue split.', action='store_true')
+    parser.add_argument('-d', '--dryrun', help='Dryrun.', action='store_true')
+    parser.add_argument('--nproc', type=int, help='Number of processors', default=14)
+    parser.add_argument('-s', '--survey', help='Select survey', default='gama')
+    parser.add_argument('--theta_def',    help='Specifier for definition of theta', default='Z_THETA_QCOLOR')
+    parser.add_argument('--config',       help='Path to configuration file', type=str, default=findfile('config'))
+    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
+    
+    args      = parser.parse_args()
+    log       = args.log
+    aall      = args.aall
+    nproc     = args.nproc 
+    dryrun    = args.dryrun
+    survey    = args.survey.lower()
+    theta_def = args.theta_def
+
+    config    = Configuration(args.config)
+    config.update_attributes('zmax', args)
+    config.write()
+
+    rlim      = fetch_header(ftype='gold', name='RLIM', survey=survey)
+    rmax      = fetch_header(ftype='gold', name='RMAX', survey=survey)
+
+    start     = time.time()
+
+    if log:
+        logfile = findfile(ftype='zmax', dryrun=False, survey=survey, log=True)
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    print('Assuming {:.4f} < r < {:.4f}'.format(rmax, rlim))
+    print('Assuming Q ALL = {}'.format(aall))
+    
+    fpath  = findfile(ftype='kE',   dryrun=dryrun, survey=survey)
+    opath  = findfile(ftype='zmax', dryrun=dryrun, survey=survey)
+    
+    inhash = stage_hash(inputs=[fpath] if os.path.isfile(fpath) else [], params={'rlim': rlim, 'rmax': rmax})
+
+    if args.nooverwrite:
+        overwrite_check(opath, inhash=inhash)
+
+    print('Reading {}.'.format(fpath))
+
+    with stage('zmax', opath=opath):
+        with stage('read'):
+            dat = read_desitable(fpath)
+            dat.pprint()
+
+        with stage('zmax_cat'):
+            dat = zmax_cat(dat, rlim, rmax, theta_def=theta_def, aall=aall, nproc=nproc)
+
+        print('Writing {}.'.format(opath))
+
+        dat.pprint()
+
+        with stage('write'):
+            write_desitable(opath, dat, inhash=inhash)
 
     runtime = (time.time() - start) / 60.
 
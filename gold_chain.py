@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import argparse
+
+from   astropy.table  import Table
+from   gama_gold      import gama_gold_cat, gama_gold_dryrun, gold_meta
+from   gen_kEcat      import kE_cat
+from   gen_zmax_cat   import zmax_cat
+from   ddp_limits     import ddp_limit_curves
+from   gen_ddp_cat    import ddp_cat
+from   findfile       import findfile, overwrite_check, write_desitable, read_desitable, call_signature, stage_hash
+from   config         import Configuration
+from   runtime        import stage
+
+
+def gold_chain(survey='gama', dryrun=False, checkpoint=False, nooverwrite=False, nproc=12, theta_def='Z_THETA_QCOLOR', aall=False):
+    '''
+    Gold branch in one process:  gold -> kE -> zmax -> ddp limits -> ddp, chained in memory.  The
+    ddp catalogue is always written;  with checkpoint, so is the output of each intermediate stage,
+    as the separate scripts.  Returns the ddp catalogue.
+    '''
+    start  = time.time()
+
+    opath  = findfile(ftype='ddp', dryrun=dryrun, survey=survey)
+
+    # Dryrun gold on disk (e.g. the tracked data/gama_gold_dryrun.fits), as gama_gold:  read, not regenerated.
+    dpath  = findfile(ftype='gold', dryrun=True, survey=survey)
+    dgold  = (survey == 'gama') & dryrun & os.path.isfile(dpath)
+
+    # Input of the chain:  the gama tiling catalogue, see gama_gold_cat, or the gold catalogue.
+    if (survey == 'gama') & (not dgold):
+        ipath  = os.environ.get('TILING_CATDIR', '') + '/TilingCatv46.fits'
+
+    else:
+        ipath  = findfile(ftype='gold', dryrun=dryrun, survey=survey)
+
+    inhash = stage_hash(inputs=[ipath] if os.path.isfile(ipath) else [], params={'theta_def': theta_def, 'aall': aall})
+
+    if nooverwrite:
+        overwrite_check(opath, inhash=inhash)
+
+    def checkpoint_stage(name, ftype, dat):
+        print('\n\n>>>>>  Solved {} in {:.2f} mins.  <<<<<\n\n'.format(name, (time.time() - start) / 60.))
+
+        if checkpoint:
+            cpath = findfile(ftype=ftype, dryrun=dryrun, survey=survey)
+
+            print(f'Writing {cpath}.')
+
+            write_desitable(cpath, dat)
+
+    with stage('gold_chain', opath=opath):
+        if dgold:
+            print(f'Reading {dpath}.')
+
+            with stage('gold'):
+                dat = read_desitable(dpath)
+
+            # E.g. the tracked dryrun gold predates the RLIM & RMAX header of gama_gold_cat. 
+            for key, value in gold_meta.items():
+                dat.meta.setdefault(key, value)
+
+        elif survey == 'gama':
+            with stage('gold'):
+                dat = gama_gold_cat()
+
+                if dryrun:
+                    if checkpoint:
+                        # Full & dryrun gold, as gen_gold.
+                        write_desitable(findfile(ftype='gold', dryrun=False, survey=survey), dat)
+
+                    dat = gama_gold_dryrun(dat)
+
+                checkpoint_stage('gold', 'gold', dat)
+
+        else:
+            # See gen_gold.py:  the desi gold catalogue is assumed present, bar at nersc.
+            fpath = findfile(ftype='gold', dryrun=dryrun, survey=survey)
+
+            print(f'Reading {fpath}.')
+
+            dat   = read_desitable(fpath)
+
+        with stage('kE'):
+            dat   = kE_cat(dat, nproc=nproc)
+
+            checkpoint_stage('kE', 'kE', dat)
+
+        with stage('zmax'):
+            dat   = zmax_cat(dat, dat.meta['RLIM'], dat.meta['RMAX'], theta_def=theta_def, aall=aall, nproc=nproc)
+
+            checkpoint_stage('zmax', 'zmax', dat)
+
+        with stage('ddp_limits'):
+            ddp_limit_curves(survey=survey, rlims=[dat.meta['RMAX'], dat.meta['RLIM']], nooverwrite=nooverwrite)
+
+        with stage('ddp'):
+            dat   = ddp_cat(dat, survey=survey)
+
+            print(f'Writing {opath}.')
+
+            write_desitable(opath, dat, inhash=inhash)
+
+    print('\n\nDone in {:.2f} mins.\n\n'.format((time.time() - start) / 60.))
+
+    return  dat
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Gold branch, gold to ddp, in one process.')
+    parser.add_argument('--log',          help='Create a log file of stdout.', action='store_true')
+    parser.add_argument('-d', '--dryrun', help='Dryrun.', action='store_true')
+    parser.add_argument('-s', '--survey', help='Select survey', default='gama')
+    parser.add_argument('--config',       help='Path to configuration file', type=str, default=findfile('config'))
+    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
+    parser.add_argument('--checkpoint',   help='Write the output of each intermediate stage.', action='store_true')
+    parser.add_argument('--nproc',        help='Number of processors', type=int, default=12)
+    parser.add_argument('--theta_def',    help='Specifier for definition of theta', default='Z_THETA_QCOLOR')
+
+    args    = parser.parse_args()
+    survey  = args.survey.lower()
+
+    config  = Configuration(args.config)
+    config.update_attributes('gold_chain', args)
+    config.write()
+
+    if args.log:
+        logfile = findfile(ftype='ddp', dryrun=False, survey=survey, log=True)
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    call_signature(args.dryrun, sys.argv)
+
+    gold_chain(survey=survey, dryrun=args.dryrun, checkpoint=args.checkpoint, nooverwrite=args.nooverwrite, nproc=args.nproc, theta_def=args.theta_def)
+
+    if args.log:
+        sys.stdout.close()
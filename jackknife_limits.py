@@ -1,3 +1,4 @@
+import re
 import numpy             as np
 import matplotlib.pyplot as plt
 import astropy.io.fits   as fits
@@ -90,16 +91,20 @@ def solve_jackknife(rand, ndiv=2):
 
     return  njack, jk_volfrac, limits, jks
 
-def jackknife_mean(fpath):
+def jackknife_mean(fpath, ext='LUMFN'):
     print('Appending JK mean and error to lumfn. extension.')
 
+    # Per region LUMFN_JK{n} (or LUMFN_JK{n}_{MCOL} for ext=LUMFN_{MCOL}) extensions.
+    suffix = ext[len('LUMFN'):]
+    jkext  = re.compile(r'^LUMFN_JK\d+{}$'.format(suffix))
+
     with fits.open(fpath, mode='update') as hdulist:
         nphi =  0
         phis = []
 
         for i, hdu in enumerate(hdulist):
             # skip primary.                                                                                                                                                                                 
-            if i > 0:
+            if (i > 0) and jkext.match(hdu.name):
                 phis.append(hdu.data['PHI_IVMAX'])
 
                 nphi += 1
@@ -110,9 +115,9 @@ def jackknife_mean(fpath):
 
         err   =  np.std(phis, axis=0)
 
-        hdr   = hdulist['LUMFN'].header
+        hdr   = hdulist[ext].header
 
-        lumfn = hdulist['LUMFN'].data
+        lumfn = hdulist[ext].data
         lumfn = Table(lumfn, names=lumfn.names)
 
         lumfn['PHI_IVMAX_JK']       = mean
@@ -120,9 +125,9 @@ def jackknife_mean(fpath):
 
         lumfn.pprint()
 
-        lumfn = fits.BinTableHDU(lumfn, name='LUMFN', header=hdr)
+        lumfn = fits.BinTableHDU(lumfn, name=ext, header=hdr)
 
-        hdulist[1] = lumfn
+        hdulist[ext] = lumfn
 
         hdulist.flush()
         hdulist.close()
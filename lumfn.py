@@ -1,18 +1,19 @@
 import fitsio
-import subprocess
 import astropy.io.fits as      fits
 import numpy           as      np
 
 from   astropy.table   import  Table
 from   cosmo           import  volcom
 from   schechter       import  named_schechter
+from   findfile        import  set_permissions
 
 
 def multifield_lumfn(lumfn_list, ext=None, weight=None, sub_cols=None):
+    # Either paths or in-memory tables. 
     if ext is None:
-        tables = [Table.read(x) for x in lumfn_list]
+        tables = [x if isinstance(x, Table) else Table.read(x) for x in lumfn_list]
     else:
-        tables = [Table.read(x, ext) for x in lumfn_list]
+        tables = [x if isinstance(x, Table) else Table.read(x, ext) for x in lumfn_list]
 
     if weight is not None:
         weights = np.array([tab.meta[weight] for tab in tables]).astype(float)
@@ -49,15 +50,16 @@ def multifield_lumfn(lumfn_list, ext=None, weight=None, sub_cols=None):
     
     result = Table()
 
-    if ext in [None, 'LUMFN']:
-        sum_cols   = ['N']
-        mean_cols  = ['MEDIAN_M', 'MEAN_M', 'MID_M', 'IVMAXMEAN_M', 'PHI_N', 'PHI_IVMAX', 'V_ON_VMAX', 'REF_SCHECHTER', 'REF_RATIO', 'PHI_STEPWISE']
-        qsum_cols  = ['PHI_N_ERROR', 'PHI_IVMAX_ERROR']
-
-    elif ext == 'LUMFN_STEP':
+    # Note: LUMFN_{MCOL} & LUMFN_STEP_{MCOL} for multiple abs. mag. definitions;  LUMFN_CMINUS as LUMFN_STEP.
+    if (ext is not None) and (ext.startswith('LUMFN_STEP') or ext.startswith('LUMFN_CMINUS')):
         sum_cols   = ['N']
         mean_cols  = ['MID_M', 'PHI_STEPWISE', 'REF_RATIO']
         qsum_cols  = []
+
+    elif (ext is None) or ext.startswith('LUMFN'):
+        sum_cols   = ['N']
+        mean_cols  = ['MEDIAN_M', 'MEAN_M', 'MID_M', 'IVMAXMEAN_M', 'PHI_N', 'PHI_IVMAX', 'V_ON_VMAX', 'REF_SCHECHTER', 'REF_RATIO', 'PHI_STEPWISE']
+        qsum_cols  = ['PHI_N_ERROR', 'PHI_IVMAX_ERROR']
         
     elif ext == 'REFERENCE':
         sum_cols   = []
@@ -86,10 +88,20 @@ def multifield_lumfn(lumfn_list, ext=None, weight=None, sub_cols=None):
     
     return  result
 
-def lumfn(dat, Ms=None, Mcol='MCOLOR_0P0', jackknife=None, opath=None, d8=None):
+def lumfn(dat, Ms=None, Mcol='MCOLOR_0P0', jackknife=None, opath=None, d8=None, suffix=''):
+    if isinstance(Mcol, list):
+        # One LUMFN_{MCOL} extension per abs. mag. definition, sharing the vmax catalog;  LUMFN_JK{n}_{MCOL} for jack knives.
+        results = [lumfn(dat, Ms=Ms, Mcol=xx, jackknife=jackknife, opath=opath, d8=d8, suffix=f'_{xx}') for xx in Mcol]
+
+        if jackknife is None:
+            for xx, result in zip(Mcol, results):
+                result.meta['EXTNAME'] = 'LUMFN_{}'.format(xx)
+
+        return  results
+
     if type(jackknife) == np.ndarray:
         for jk in jackknife:
-            lumfn(dat, Ms=Ms, Mcol=Mcol, jackknife=int(jk), opath=opath)
+            lumfn(dat, Ms=Ms, Mcol=Mcol, jackknife=int(jk), opath=opath, suffix=suffix)
 
         return 0
     
@@ -204,7 +216,7 @@ def lumfn(dat, Ms=None, Mcol='MCOLOR_0P0', jackknife=None, opath=None, d8=None):
     result.meta['EXTNAME']        = 'LUMFN'
     
     if jackknife is not None:        
-        result.meta['EXTNAME']    = 'LUMFN_JK{}'.format(jackknife)
+        result.meta['EXTNAME']    = 'LUMFN_JK{}{}'.format(jackknife, suffix)
         result.meta['RENORM']     = 'FALSE'
         result.meta['JK_VOLFRAC'] = dat.meta['JK_VOLFRAC']
         result.meta['NJACK']      = dat.meta['NJACK']
@@ -215,14 +227,7 @@ def lumfn(dat, Ms=None, Mcol='MCOLOR_0P0', jackknife=None, opath=None, d8=None):
             hdulist.flush()  
             hdulist.close()
 
-        cmds   = []
-        cmds.append(f'chgrp desi {opath}')
-        cmds.append(f'chmod  700 {opath}')
-
-        for cmd in cmds:
-            output = subprocess.check_output(cmd, shell=True)
-
-            print(cmd, output)
+        set_permissions(opath)
 
         return  0
 
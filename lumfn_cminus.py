@@ -0,0 +1,92 @@
+import numpy           as     np
+
+from   astropy.table   import Table
+from   schechter       import named_schechter
+from   lumfn_stepwise  import stepwise_Mcol
+
+
+def cminus_counts(Ms, faints):
+    '''
+    Lynden-Bell C- of each galaxy:  the number of galaxies brighter than M_i at whose redshift M_i
+    would be visible, i.e. M_j < M_i < M_faint,j.  As M_j < M_faint,j, this is the number brighter
+    less the number with M_faint,j <= M_i;  two sorted searches, O(N log N).  The bright limits
+    do not enter, as M_bright,j < M_j < M_i.
+    '''
+    sortedM     = np.sort(Ms)
+    sortedfaint = np.sort(faints)
+
+    return  np.searchsorted(sortedM, Ms, side='left') - np.searchsorted(sortedfaint, Ms, side='right')
+
+def lumfn_cminus(vmax, Mcol='MCOLOR_0P0', d8=None, normalise=True):
+    '''
+    Density independent, non-parametric (cumulative) luminosity function by the C- method of
+    Lynden-Bell (1971), with the per-galaxy STEPWISE_FAINTLIM_0P0 limits.  The product limit
+    estimator is accumulated in log space and differenced in the lumfn_stepwise bins, with the
+    same normalisation.  Returns a LUMFN_STEP-like table (PHI_STEPWISE) as LUMFN_CMINUS.
+    '''
+    if Mcol != stepwise_Mcol:
+        raise  ValueError(f'Stepwise limits are for {stepwise_Mcol}, not {Mcol}.')
+
+    # Note: match lumfn_stepwise binning.
+    nbins      = 36
+
+    phi_Ms     = np.linspace(-23.,  -16.,  nbins)
+    dM         = np.abs(np.diff(phi_Ms)[0])
+
+    faints     = vmax['STEPWISE_FAINTLIM_0P0'].data
+    Ms         = vmax[Mcol].data
+
+    # Limits undefined (-99) outwith the DDP redshift range, see gen_ddp_cat.py.
+    isin       = (faints > -99.) & (Ms < faints)
+
+    Ms         = Ms[isin]
+    faints     = faints[isin]
+
+    idx        = np.argsort(Ms, kind='stable')
+
+    Ms         = Ms[idx]
+    faints     = faints[idx]
+
+    Cs         = cminus_counts(Ms, faints)
+
+    # Psi(M_k) propto prod_{i <= k} (1 + 1 / C_i);  the brightest, C_i = 0, define the zero point.
+    lnpsi      = np.cumsum(np.where(Cs > 0, np.log1p(1. / np.maximum(Cs, 1)), 0.))
+
+    # Cumulative at the bin edges, from the last galaxy brighter than the edge.
+    edges      = np.append(phi_Ms, phi_Ms[-1] + dM)
+    last       = np.searchsorted(Ms, edges, side='right') - 1
+
+    psi        = np.where(last >= 0, np.exp(lnpsi[np.clip(last, 0, None)] - lnpsi[-1]), 0.)
+
+    phis       = np.diff(psi)
+    nMs        = np.diff(np.searchsorted(Ms, edges, side='left'))
+
+    phi_Ms    += dM/2.
+
+    if normalise:
+        # As lumfn_stepwise.
+        valid  = (nMs >= 5) & (phis > 0.)
+        norm   = dM * np.sum(named_schechter(phi_Ms[valid], named_type='TMR'))
+
+        if d8 != None:
+            norm  *= (1. + d8) / (1. + 0.007)
+
+        phis  *= (norm / np.sum(phis[valid]))
+
+    phis       = phis / dM
+
+    result                       = Table(np.c_[phi_Ms, phis, nMs], names=['MID_M', 'PHI_STEPWISE', 'N'])
+    result['VALID']              = result['N'] >= 5
+    result['REF_SCHECHTER']      = named_schechter(result['MID_M'], named_type='TMR')
+
+    if d8 != None:
+        # TODO HARDCODE 0.007
+        result['REF_SCHECHTER'] *= (1. + d8) / (1. + 0.007)
+
+    result['REF_RATIO']          = result['PHI_STEPWISE'] / result['REF_SCHECHTER']
+
+    result.meta['DDP1_D8']       = d8
+    result.meta['ABSMAG_DEF']    = Mcol
+    result.meta['EXTNAME']       = 'LUMFN_CMINUS'
+
+    return  result
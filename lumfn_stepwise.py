@@ -19,6 +19,10 @@ from    params          import fillfactor_threshold
 from    schechter       import named_schechter
 
 
+# Abs. mag. definition of the STEPWISE_BRIGHTLIM_0P0 & STEPWISE_FAINTLIM_0P0 limits (the M0P0_QCOLOR
+# limiting curves), see gen_ddp_cat.py;  the stepwise, C- and STY estimators are valid for it only.
+stepwise_Mcol = 'MCOLOR_0P0'
+
 def lum_binner(x, dM):
     '''
     Eqn. 2.10a, W(x), of Efstathiou, Ellis & Peterson.
@@ -131,15 +135,21 @@ def lumfn_stepwise_eval(vmax, dM, phi_M, phi, phi_Ms, phis, Mcol='MCOLOR_0P0', s
     
     results = []
 
-    with multiprocessing.get_context('spawn').Pool(nproc) as pool:
-        # For this phi_M, per rest frame color list of the stepwise (1/<n>) weight for all galaxies in the vol. limited sample.
-        for result in pool.imap(partial(process_one, Mmins=Mmins, Mmaxs=Mmaxs, dM=dM, phi_Ms=phi_Ms, phis=phis), iterable=splits):
-            results.append(np.array(result))
+    if nproc == 1:
+        # Serial, e.g. within a pool worker. 
+        for split in splits:
+            results.append(np.array(process_one(split, Mmins=Mmins, Mmaxs=Mmaxs, dM=dM, phi_Ms=phi_Ms, phis=phis)))
+
+    else:
+        with multiprocessing.get_context('spawn').Pool(nproc) as pool:
+            # For this phi_M, per rest frame color list of the stepwise (1/<n>) weight for all galaxies in the vol. limited sample.
+            for result in pool.imap(partial(process_one, Mmins=Mmins, Mmaxs=Mmaxs, dM=dM, phi_Ms=phi_Ms, phis=phis), iterable=splits):
+                results.append(np.array(result))
     
-        pool.close()
+            pool.close()
 
-        # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join                                                                                                       
-        pool.join()
+            # https://stackoverflow.com/questions/38271547/when-should-we-call-multiprocessing-pool-join                                                                                                       
+            pool.join()
 
     '''
     for split, result in zip(splits, results):
@@ -166,7 +176,24 @@ def lumfn_stepwise_eval(vmax, dM, phi_M, phi, phi_Ms, phis, Mcol='MCOLOR_0P0', s
 
     return  phi_hat, np.sum(nums)
 
-def lumfn_stepwise(vmax, Mcol='MCOLOR_0P0', tolerance=1.e-3, d8=None, normalise=True):
+def lumfn_stepwise(vmax, Mcol='MCOLOR_0P0', tolerance=1.e-3, d8=None, normalise=True, nproc=12):
+    if isinstance(Mcol, list):
+        for xx in Mcol:
+            if xx != stepwise_Mcol:
+                print(f'WARNING:  no stepwise limits for {xx}, skipping its stepwise LF.')
+
+        # One LUMFN_STEP_{MCOL} extension per abs. mag. definition, sharing the vmax catalog.
+        Mcol    = [xx for xx in Mcol if xx == stepwise_Mcol]
+        results = [lumfn_stepwise(vmax, Mcol=xx, tolerance=tolerance, d8=d8, normalise=normalise, nproc=nproc) for xx in Mcol]
+
+        for xx, result in zip(Mcol, results):
+            result.meta['EXTNAME'] = 'LUMFN_STEP_{}'.format(xx)
+
+        return  results
+
+    if Mcol != stepwise_Mcol:
+        raise  ValueError(f'Stepwise limits are for {stepwise_Mcol}, not {Mcol}.')
+
     # Note: match lumfn binning.
     nbins      = 36
 
@@ -196,7 +223,7 @@ def lumfn_stepwise(vmax, Mcol='MCOLOR_0P0', tolerance=1.e-3, d8=None, normalise=
         new_phis = []
     
         for i, (phi_M, phi) in enumerate(zip(phi_Ms, phis)):
-            phi_hat, nM = lumfn_stepwise_eval(vmax, dM, phi_M, phi, phi_Ms, phis, Mcol=Mcol)
+            phi_hat, nM = lumfn_stepwise_eval(vmax, dM, phi_M, phi, phi_Ms, phis, Mcol=Mcol, nproc=nproc)
             
             nMs.append(nM)
             new_phis.append(phi_hat)
@@ -248,6 +275,7 @@ def lumfn_stepwise(vmax, Mcol='MCOLOR_0P0', tolerance=1.e-3, d8=None, normalise=
     result_stepwise['REF_RATIO']          = result_stepwise['PHI_STEPWISE'] / result_stepwise['REF_SCHECHTER']
 
     result_stepwise.meta['DDP1_D8']       = d8
+    result_stepwise.meta['ABSMAG_DEF']    = Mcol
     result_stepwise.meta['EXTNAME']       = 'LUMFN_STEP'
     
     return  result_stepwise
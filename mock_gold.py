@@ -0,0 +1,361 @@
+import os
+import sys
+import argparse
+import runtime
+import numpy           as np
+
+from   astropy.table   import Table, vstack
+from   findfile        import findfile, fetch_fields, overwrite_check, write_desitable
+from   config          import Configuration
+from   cosmo           import distmod, distcom, volcom
+from   cartesian       import rotate
+from   schechter       import named_schechter
+from   smith_kcorr     import GAMA_KCorrection
+from   tmr_ecorr       import tmr_ecorr
+from   gama_limits     import gama_limits
+from   ros_tools       import roscen, calc_rosr, ros_limits
+from   ddp_zlimits     import ddp_zlimits
+from   data.schechters import schechters
+from   runtime         import stage
+
+'''
+Mock gold catalogues, for scale testing the pipeline offline:  galaxies sampled from a named Schechter
+LF, uniform in comoving volume within the GAMA fields or DESI rosettes, thinned by a lognormal density
+field for clustering, with Smith k-corrections & TMR e-corrections inverted for DETMAG and GMR.
+
+    python3 mock_gold.py --survey gama --ngal 1000000
+'''
+
+# Survey limits, as for gama_gold & desi_gold.
+mock_limits = {'gama': {'RLIM': 19.8, 'RMAX': 12.0, 'MAX_SEP': 70.0},\
+               'desi': {'RLIM': 19.5, 'RMAX': 12.0, 'MAX_SEP': 10.0}}
+
+def mock_area(survey, field, dryrun=False):
+    if survey == 'gama':
+        if dryrun:
+            # Dryrun:  1x1 sq. patch of sky, see gama_gold_dryrun.
+            return  1.
+
+        lims   = gama_limits[field]
+
+        return  (lims['ra_max'] - lims['ra_min']) * np.degrees(np.sin(np.radians(lims['dec_max'])) - np.sin(np.radians(lims['dec_min'])))
+
+    elif survey == 'desi':
+        limits = ros_limits(dryrun)
+
+        return  np.pi * (limits[1]**2. - limits[0]**2.)
+
+    else:
+        raise  NotImplementedError(f'No implementation for survey: {survey}')
+
+def mock_footprint(survey, field, nrand, dryrun=False):
+    '''
+    ras & decs uniform on the sphere within a GAMA field, or a DESI rosette annulus.
+    '''
+    if survey == 'gama':
+        lims       = dict(gama_limits[field])
+
+        if dryrun:
+            ra_cen = {'G9': 135., 'G12': 180., 'G15': 217.}[field]
+            lims   = {'ra_min': ra_cen - 0.5, 'ra_max': ra_cen + 0.5, 'dec_min': -0.5, 'dec_max': 0.5}
+
+        ras        = np.random.uniform(lims['ra_min'], lims['ra_max'], nrand)
+        decs       = np.degrees(np.arcsin(np.random.uniform(np.sin(np.radians(lims['dec_min'])), np.sin(np.radians(lims['dec_max'])), nrand)))
+
+    elif survey == 'desi':
+        ra_cen, dec_cen = np.radians(roscen[int(field[1:])])
+
+        limits     = np.radians(ros_limits(dryrun))
+
+        # Separation from, & position angle about, the rosette center.
+        sep        = np.arccos(np.random.uniform(np.cos(limits[1]), np.cos(limits[0]), nrand))
+        pa         = np.random.uniform(0., 2. * np.pi, nrand)
+
+        decs       = np.arcsin(np.sin(dec_cen) * np.cos(sep) + np.cos(dec_cen) * np.sin(sep) * np.cos(pa))
+        ras        = ra_cen + np.arctan2(np.sin(pa) * np.sin(sep) * np.cos(dec_cen), np.cos(sep) - np.sin(dec_cen) * np.sin(decs))
+
+        ras        = np.degrees(ras) % 360.
+        decs       = np.degrees(decs)
+
+    else:
+        raise  NotImplementedError(f'No implementation for survey: {survey}')
+
+    return  ras, decs
+
+def mock_colors(Ms):
+    '''
+    Rest-frame ^0.1(g-r):  red & blue sequences, with a red fraction increasing with luminosity.
+    '''
+    red_frac = 1. / (1. + np.exp((Ms + 20.5) / 0.75))
+    is_red   = np.random.uniform(0., 1., len(Ms)) < red_frac
+
+    return  np.where(is_red, np.random.normal(0.93 - 0.02 * (Ms + 20.5), 0.05), np.random.normal(0.65 - 0.03 * (Ms + 20.5), 0.12))
+
+def lognormal_field(shape, cell, sigma=1.0, kpeak=0.02):
+    '''
+    1 + delta of a lognormal field on a grid of the given shape & cell size [Mpc/h];  the
+    Gaussian field has P(k) ~ k / (1 + (k / kpeak)^2.5) and variance sigma^2 on the grid.
+    '''
+    kx, ky = [2. * np.pi * np.fft.fftfreq(nn, d=cell) for nn in shape[:2]]
+    kz     = 2. * np.pi * np.fft.rfftfreq(shape[2], d=cell)
+
+    ks     = np.sqrt(kx[:,None,None]**2. + ky[None,:,None]**2. + kz[None,None,:]**2.)
+    ks[0,0,0] = 1.
+
+    pk     = ks / (1. + (ks / kpeak)**2.5)
+    pk[0,0,0] = 0.
+
+    gauss  = np.fft.irfftn(np.fft.rfftn(np.random.normal(size=shape)) * np.sqrt(pk), s=shape)
+    gauss *= sigma / np.std(gauss)
+
+    return  np.exp(gauss - sigma**2. / 2.)
+
+def mock_zm(rlim, named_type='TMR', zmin=ddp_zlimits['DDP1'][0], zmax=ddp_zlimits['DDP1'][1], Mbright=-24., Mfaint=-14.5, margin=0.5, dz=1.e-4, dM=1.e-3):
+    '''
+    Grids for sampling (z, M):  z from dV/dz times the fraction of the LF brighter than the (median
+    colour, plus margin) faint limit at z;  M from the LF truncated at that limit.  The expected number
+    per unit area (no margin) normalises the mock.
+    '''
+    kcorr_r   = GAMA_KCorrection(band='R')
+
+    zs        = np.arange(zmin, zmax + dz, dz)
+    Ms        = np.arange(Mbright, Mfaint + dM, dM)
+
+    cdf       = np.concatenate([[0.], np.cumsum(named_schechter(Ms[1:], named_type=named_type)) * dM])
+
+    # Faint limit at the median rest-frame colour.
+    median    = 0.603 * np.ones_like(zs)
+    Mlims     = rlim - distmod(zs) - kcorr_r.k_nonnative_zref(0.0, zs, median) - tmr_ecorr(zs, median, aall=True)
+
+    Mcuts     = np.minimum(Mfaint, Mlims + margin)
+    Ccuts     = np.interp(Mcuts, Ms, cdf)
+
+    dVs       = np.diff(volcom(zs, 1.))
+    pzs       = np.concatenate([[0.], np.cumsum(dVs * Ccuts[1:])])
+
+    expected  = np.sum(dVs * np.interp(np.minimum(Mfaint, Mlims[1:]), Ms, cdf))
+
+    return  {'ZS': zs, 'MS': Ms, 'CDF': cdf, 'MCUTS': Mcuts, 'CCUTS': Ccuts, 'PZS': pzs / pzs[-1], 'NGAL_PER_DEG2': expected}
+
+def mock_field(survey, field, ngal, grids, rlim, rmax, sigma=1.0, cell=4., dryrun=False, nbatch=4_000_000):
+    '''
+    ngal galaxies of the gold sample in a field.
+    '''
+    kcorr_r   = GAMA_KCorrection(band='R')
+    kcorr_g   = GAMA_KCorrection(band='G')
+
+    zs        = grids['ZS']
+    chis      = distcom(zs)
+    mus       = distmod(zs)
+
+    # Bounding box of the field volume, for the density field.
+    ras, decs = mock_footprint(survey, field, 10_000, dryrun=dryrun)
+    corners   = chis[-1] * np.c_[np.cos(np.radians(decs)) * np.cos(np.radians(ras)), np.cos(np.radians(decs)) * np.sin(np.radians(ras)), np.sin(np.radians(decs))]
+    corners   = np.vstack([corners, np.zeros(3)])
+
+    lo        = corners.min(axis=0) - cell
+    shape     = tuple(int(xx) for xx in np.ceil((corners.max(axis=0) + cell - lo) / cell))
+
+    onepd     = lognormal_field(shape, cell, sigma=sigma)
+
+    # Rare peaks are clipped, for the acceptance rate.
+    wmax      = np.percentile(onepd, 99.9)
+    accept    = np.mean(np.minimum(onepd, wmax)) / wmax
+
+    print('Solving for {} galaxies in {} with a {} lognormal grid of {:.1f} Mpc/h (acceptance {:.3f}).'.format(ngal, field, shape, cell, accept))
+
+    result    = []
+    nresult   = 0
+    ndrawn    = 0
+
+    while nresult < ngal:
+        ndraw     = int(np.clip(1.2 * (ngal - nresult) / accept, 1_000, nbatch))
+
+        ras, decs = mock_footprint(survey, field, ndraw, dryrun=dryrun)
+
+        zz        = np.interp(np.random.uniform(0., 1., ndraw), grids['PZS'], zs)
+        chi       = np.interp(zz, zs, chis)
+
+        xyz       = chi[:,None] * np.c_[np.cos(np.radians(decs)) * np.cos(np.radians(ras)), np.cos(np.radians(decs)) * np.sin(np.radians(ras)), np.sin(np.radians(decs))]
+        idx       = np.floor((xyz - lo) / cell).astype(int)
+
+        isin      = np.random.uniform(0., 1., ndraw) < np.minimum(onepd[idx[:,0], idx[:,1], idx[:,2]], wmax) / wmax
+
+        ras, decs, zz, xyz = ras[isin], decs[isin], zz[isin], xyz[isin]
+
+        # Abs. mag. from the LF, truncated at the faint limit.
+        Ccut      = np.interp(zz, zs, grids['CCUTS'])
+        Ms        = np.interp(np.random.uniform(0., 1., len(zz)) * Ccut, grids['CDF'], grids['MS'])
+
+        rest_0p1  = mock_colors(Ms)
+
+        gmr       = rest_0p1 + kcorr_g.k(zz, rest_0p1) - kcorr_r.k(zz, rest_0p1)
+
+        kcorr_r0p0 = kcorr_r.k_nonnative_zref(0.0, zz, rest_0p1)
+        kcorr_g0p0 = kcorr_g.k_nonnative_zref(0.0, zz, rest_0p1)
+
+        rest_0p0  = gmr - (kcorr_g0p0 - kcorr_r0p0)
+
+        mu        = np.interp(zz, zs, mus)
+        detmag    = Ms + mu + kcorr_r0p0 + tmr_ecorr(zz, rest_0p0, aall=False)
+
+        isin      = (detmag > rmax) & (detmag < rlim)
+
+        batch     = Table(np.c_[ras[isin], decs[isin], zz[isin], detmag[isin], gmr[isin], Ms[isin], rest_0p1[isin], mu[isin]],\
+                          names=['RA', 'DEC', 'ZSURV', 'DETMAG', 'GMR', 'MOCK_MCOLOR_0P0', 'MOCK_REST_GMR_0P1', 'DISTMOD'])
+
+        for ii, col in enumerate(['CARTESIAN_X', 'CARTESIAN_Y', 'CARTESIAN_Z']):
+            batch[col] = xyz[isin,ii]
+
+        result.append(batch)
+
+        nresult  += len(batch)
+        ndrawn   += ndraw
+
+        accept    = max(nresult / ndrawn, 1.e-3)
+
+        print('Solved {} of {} for {}.'.format(min(nresult, ngal), ngal, field))
+
+    result           = vstack(result)[:ngal]
+    result['FIELD']  = field
+
+    return  result
+
+def mock_gold_cat(survey='gama', ngal=None, named_type='TMR', sigma=1.0, cell=4., seed=314, dryrun=False):
+    '''
+    Mock gold catalogue, in memory, of ngal galaxies;  defaults to the number expected for the
+    named LF in the footprint.
+    '''
+    np.random.seed(seed)
+
+    fields   = fetch_fields(survey)
+    limits   = mock_limits[survey]
+
+    grids    = mock_zm(limits['RLIM'], named_type=named_type)
+
+    areas    = np.array([mock_area(survey, ff, dryrun=dryrun) for ff in fields])
+    area     = np.sum(areas)
+
+    expected = int(np.round(grids['NGAL_PER_DEG2'] * area))
+
+    if ngal is None:
+        ngal = expected
+
+    print('Expected {} galaxies for the {} LF in {:.2f} sq. deg.;  mocking {}.'.format(expected, named_type, area, ngal))
+
+    # Split by area.
+    ngals    = np.diff(np.round(np.concatenate([[0.], np.cumsum(areas)]) * ngal / area).astype(int))
+
+    dat      = vstack([mock_field(survey, ff, nn, grids, limits['RLIM'], limits['RMAX'], sigma=sigma, cell=cell, dryrun=dryrun) for ff, nn in zip(fields, ngals)])
+
+    dat['LUMDIST'] = (1. + dat['ZSURV'].data) * distcom(dat['ZSURV'].data)
+
+    xyz      = rotate(dat['RA'], dat['DEC'], np.c_[dat['CARTESIAN_X'].data, dat['CARTESIAN_Y'].data, dat['CARTESIAN_Z'].data])
+
+    dat['ROTCARTESIAN_X'] = xyz[:,0]
+    dat['ROTCARTESIAN_Y'] = xyz[:,1]
+    dat['ROTCARTESIAN_Z'] = xyz[:,2]
+
+    dat['IN_D8LUMFN']     = np.zeros(len(dat), dtype=int)
+    dat['CONSERVATIVE']   = np.zeros(len(dat), dtype=int)
+
+    if survey == 'gama':
+        dat['CATAID']         = np.arange(len(dat))
+        dat['ZGAMA']          = dat['ZSURV']
+        dat['R_PETRO']        = dat['DETMAG']
+        dat['RMAG_DRED_SDSS'] = dat['DETMAG']
+        dat['GMAG_DRED_SDSS'] = dat['DETMAG'] + dat['GMR']
+        dat['NQ']             = 4 * np.ones(len(dat), dtype=int)
+        dat['SURVEY_CLASS']   = 6 * np.ones(len(dat), dtype=int)
+
+    else:
+        dat['TARGETID']       = np.arange(len(dat))
+        dat['ZDESI']          = dat['ZSURV']
+        dat['RMAG_DRED']      = dat['DETMAG']
+        dat['GMAG_DRED']      = dat['DETMAG'] + dat['GMR']
+        dat['ROS']            = np.array([int(xx[1:]) for xx in dat['FIELD']])
+        dat['ROS_DIST']       = np.zeros(len(dat))
+
+        for rosn in np.unique(dat['ROS'].data):
+            isin = dat['ROS'].data == rosn
+            dat['ROS_DIST'][isin] = calc_rosr(rosn, dat['RA'].data[isin], dat['DEC'].data[isin])
+
+    # Randomise rows.
+    dat      = dat[np.random.permutation(len(dat))]
+
+    dat.meta = {'AREA': area,\
+                'GOLD_NGAL': len(dat),\
+                'IMMUTABLE': 'FALSE',\
+                'RLIM': limits['RLIM'],\
+                'RMAX': limits['RMAX'],\
+                'MAX_SEP': limits['MAX_SEP'],\
+                'MOCK': 'TRUE',\
+                'MOCK_LF': named_type,\
+                'MOCK_SEED': seed,\
+                'MOCK_SIGMA': sigma,\
+                'MOCK_CELL': cell,\
+                'MOCK_NBAR': ngal / max(expected, 1)}
+
+    return  dat
+
+def mock_gold(args):
+    survey = args.survey.lower()
+
+    if args.log:
+        logfile = findfile(ftype='gold', dryrun=False, survey=survey, log=True).replace('gold', 'mock_gold')
+
+        print(f'Logging to {logfile}')
+
+        sys.stdout = open(logfile, 'w')
+
+    opath  = args.opath
+
+    if opath is None:
+        if (survey == 'gama') & args.dryrun:
+            raise  ValueError('The GAMA dryrun gold catalogue is shipped in data/;  provide --opath for a dryrun mock.')
+
+        opath = findfile(ftype='gold', dryrun=args.dryrun, survey=survey)
+
+    if args.nooverwrite:
+        overwrite_check(opath)
+
+    with stage('mock_gold', opath=opath, survey=survey, ngal=args.ngal):
+        dat = mock_gold_cat(survey=survey, ngal=args.ngal, named_type=args.lf, sigma=args.sigma, cell=args.cell, seed=args.seed, dryrun=args.dryrun)
+        dat.pprint()
+
+        if not os.path.isdir(os.path.dirname(opath)):
+            os.makedirs(os.path.dirname(opath))
+
+        print('Writing {}.'.format(opath))
+
+        write_desitable(opath, dat)
+
+    if args.log:
+        sys.stdout.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gen mock gold cat.')
+    parser.add_argument('--log',          help='Create a log file of stdout.', action='store_true')
+    parser.add_argument('--config',       help='Path to configuration file', type=str, default=findfile('config'))
+    parser.add_argument('-s', '--survey', help='Select survey', default='gama', choices=['gama', 'desi'])
+    parser.add_argument('-d', '--dryrun', help='Dryrun footprint', action='store_true')
+    parser.add_argument('--nooverwrite',  help='Do not overwrite outputs if on disk', action='store_true')
+    parser.add_argument('--ngal',         help='Number of galaxies, e.g. 12000000;  defaults to that expected for the LF.', type=int, default=None)
+    parser.add_argument('--lf',           help='Named Schechter LF', default='TMR', choices=list(schechters.keys()))
+    parser.add_argument('--sigma',        help='Std. of the Gaussian field of the lognormal', type=float, default=1.0)
+    parser.add_argument('--cell',         help='Cell size of the lognormal field [Mpc/h]', type=float, default=4.)
+    parser.add_argument('--seed',         help='Random seed', type=int, default=314)
+    parser.add_argument('--opath',        help='Output path;  defaults to the gold catalogue.', type=str, default=None)
+
+    args   = parser.parse_args()
+
+    config = Configuration(args.config)
+    config.update_attributes('mock', args)
+    config.write()
+
+    mock_gold(args)
+
+    print('\n\nDone.\n\n')
@@ -0,0 +1,163 @@
+import os
+import json
+import sqlite3
+import contextlib
+import argparse
+import datetime
+import numpy    as np
+
+'''
+History of the stage run reports (see runtime.stage), across pipeline runs, in a local SQLite store;
+each new run is compared to a rolling baseline of the previous runs of each stage (per field and
+realisation, as named by the product).
+
+    python3 perf_history.py --window 5 --threshold 1.2
+    python3 perf_history.py --stage randoms_G9
+'''
+
+metrics = ['WALL_S', 'CPU_S', 'PEAK_RSS_MB', 'READ_MB', 'WRITE_MB', 'NOPENED']
+
+def history_path(root=None):
+    if root is None:
+        root = os.environ['GOLD_DIR']
+
+    return  root + '/logs/perf_history.sqlite'
+
+def connect(hpath=None):
+    if hpath is None:
+        hpath = history_path()
+
+    os.makedirs(os.path.dirname(hpath), exist_ok=True)
+
+    conn = sqlite3.connect(hpath)
+
+    # A stage report is recorded once, however often it is collected.
+    conn.execute('CREATE TABLE IF NOT EXISTS stages (RUN TEXT, STAGE TEXT, NAME TEXT, START TEXT, HOST TEXT, SUCCESS INTEGER, '\
+                 + ', '.join(f'{xx} REAL' for xx in metrics) + ', UNIQUE(STAGE, START))')
+
+    return  conn
+
+def stage_key(record):
+    # e.g. gama_gold_kE, or randoms_G9_0_bd for field & realisation.
+    return  os.path.basename(record['REPORT']).replace('.report.json', '')
+
+def record_run(rpath=None, hpath=None, run=None):
+    '''
+    Record the stage reports of a pipeline run report (see runtime.aggregate_reports);  returns the
+    number of new stage runs.
+    '''
+    if rpath is None:
+        rpath = os.environ['GOLD_DIR'] + '/logs/run_report.json'
+
+    if run is None:
+        run   = datetime.datetime.now().isoformat()
+
+    with open(rpath, 'r') as ff:
+        records = json.load(ff)['STAGES']
+
+    rows = []
+
+    for record in records:
+        # Including terminated pool workers.
+        record['CPU_S'] = record.get('CPU_S', 0.) + record.get('CHILD_CPU_S', 0.)
+
+        rows.append((run, stage_key(record), record['NAME'], record['START'], record.get('HOST', ''), int(record.get('SUCCESS', True))) + tuple(float(record.get(xx, 0.)) for xx in metrics))
+
+    with contextlib.closing(connect(hpath)) as conn, conn:
+        before = conn.total_changes
+
+        conn.executemany('INSERT OR IGNORE INTO stages VALUES ({})'.format(', '.join(['?'] * (6 + len(metrics)))), rows)
+
+        nnew   = conn.total_changes - before
+
+    print(f'Recorded {nnew} new stage runs of {len(rows)} to the performance history.')
+
+    return  nnew
+
+def fetch_history(stage, hpath=None):
+    with contextlib.closing(connect(hpath)) as conn:
+        rows = conn.execute('SELECT START, HOST, SUCCESS, ' + ', '.join(metrics) + ' FROM stages WHERE STAGE = ? ORDER BY START', (stage,)).fetchall()
+
+    return  [dict(zip(['START', 'HOST', 'SUCCESS'] + metrics, row)) for row in rows]
+
+def compare_history(hpath=None, window=5, threshold=1.2, minruns=1, metrics_to_flag=['WALL_S', 'PEAK_RSS_MB']):
+    '''
+    Latest successful run of each stage vs. the median of its previous (up to) window successful
+    runs;  a ratio beyond threshold, for any of metrics_to_flag, is flagged.
+    '''
+    with contextlib.closing(connect(hpath)) as conn:
+        stages = [xx[0] for xx in conn.execute('SELECT DISTINCT STAGE FROM stages ORDER BY STAGE').fetchall()]
+
+    result = []
+
+    for stage in stages:
+        history = [xx for xx in fetch_history(stage, hpath=hpath) if xx['SUCCESS']]
+
+        if len(history) < minruns + 1:
+            continue
+
+        latest   = history[-1]
+        baseline = history[-window-1:-1]
+
+        row      = {'STAGE': stage, 'START': latest['START'], 'NBASELINE': len(baseline), 'FLAGGED': []}
+
+        for key in metrics_to_flag:
+            base         = np.median([xx[key] for xx in baseline])
+
+            row[key]     = latest[key]
+            row[f'{key}_RATIO'] = latest[key] / base if base > 0. else np.nan
+
+            if row[f'{key}_RATIO'] > threshold:
+                row['FLAGGED'].append(key)
+
+        result.append(row)
+
+    return  result
+
+def history_summary(hpath=None, window=5, threshold=1.2):
+    result  = compare_history(hpath=hpath, window=window, threshold=threshold)
+
+    print('\n\n{}\t{}\t{}\t{}'.format('STAGE'.ljust(40), 'WALL [MINS]', 'WALL RATIO', 'RSS RATIO'))
+
+    for row in sorted(result, key=lambda xx: -np.nan_to_num(xx['WALL_S_RATIO'])):
+        print('{}\t{:.2f}\t\t{:.3f}\t\t{:.3f}\t{}'.format(row['STAGE'].ljust(40), row['WALL_S'] / 60., row['WALL_S_RATIO'], row['PEAK_RSS_MB_RATIO'], ' '.join('SLOWER' if xx == 'WALL_S' else 'MORE MEMORY' for xx in row['FLAGGED'])))
+
+    flagged = [row['STAGE'] for row in result if row['FLAGGED']]
+
+    if flagged:
+        print('\n\nWARNING:  {} stages regressed beyond {:.2f}x their rolling baseline of {} runs:  {}'.format(len(flagged), threshold, window, ', '.join(flagged)))
+
+    return  result
+
+def track_run(rpath=None, hpath=None, window=5, threshold=1.2):
+    record_run(rpath=rpath, hpath=hpath)
+
+    return  history_summary(hpath=hpath, window=window, threshold=threshold)
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Performance history of pipeline runs.')
+    parser.add_argument('--window',    help='Number of previous runs of the rolling baseline.', type=int, default=5)
+    parser.add_argument('--threshold', help='Ratio to the baseline flagged as a regression.', type=float, default=1.2)
+    parser.add_argument('--record',    help='Record the latest run report first.', action='store_true')
+    parser.add_argument('--stage',     help='Print the history of stages matching this, e.g. randoms_G9', default=None)
+
+    args    = parser.parse_args()
+
+    if args.record:
+        record_run()
+
+    if args.stage is not None:
+        with contextlib.closing(connect()) as conn:
+            stages = [xx[0] for xx in conn.execute('SELECT DISTINCT STAGE FROM stages WHERE STAGE LIKE ? ORDER BY STAGE', (f'%{args.stage}%',)).fetchall()]
+
+        for stage in stages:
+            print(f'\n\n{stage}')
+
+            for row in fetch_history(stage):
+                print('{}\t{}\t{}\t{:.2f} mins\t{:.2f}MB'.format(row['START'], row['HOST'], 'OK' if row['SUCCESS'] else 'FAILED', row['WALL_S'] / 60., row['PEAK_RSS_MB']))
+
+    else:
+        history_summary(window=args.window, threshold=args.threshold)
+
+    print('\n\nDone.\n\n')
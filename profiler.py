@@ -0,0 +1,172 @@
+import os
+import sys
+import glob
+import argparse
+import time
+import atexit
+import pstats
+import cProfile
+
+from   multiprocessing.util import Finalize
+
+
+# Profiler of this process, see start_profile.
+_profile = {}
+
+def profile_dir():
+    root = os.environ.get('GOLD_DIR', os.environ['HOME'] + '/data/GAMA4/')
+
+    return  root + '/logs/profiles/'
+
+def profile_requested():
+    '''
+    Profiling is opt-in:  GOLD_PROFILE=1 in the environment, or --profile on the command line of any
+    entry point (removed from sys.argv before argparse).
+    '''
+    if '--profile' in sys.argv:
+        sys.argv.remove('--profile')
+
+        os.environ['GOLD_PROFILE'] = '1'
+
+    return  os.environ.get('GOLD_PROFILE', '0') not in ['0', '', 'False', 'false']
+
+def start_profile(name=None):
+    '''
+    cProfile this process until exit.  Spawned pool workers inherit the environment, so profile
+    themselves, and are merged by the parent at exit:  pstats and collapsed stacks (for flamegraph.pl
+    or speedscope) in $GOLD_DIR/logs/profiles/.
+    '''
+    if 'PROFILE' in _profile:
+        return
+
+    # Spawned pool workers, at import, before multiprocessing restores sys.argv & the parent process.
+    worker = '--multiprocessing-fork' in getattr(sys, 'orig_argv', [])
+
+    if not worker:
+        if name is None:
+            name = os.path.basename(sys.argv[0]).replace('.py', '') or 'python'
+
+        # Shared by the workers of this run.
+        os.environ['GOLD_PROFILE_RUN'] = '{}_{}_{}'.format(name, time.strftime('%Y%m%d_%H%M%S'), os.getpid())
+
+    _profile['RUN']     = os.environ.get('GOLD_PROFILE_RUN', f'python_{os.getpid()}')
+    _profile['WORKER']  = worker
+    _profile['PROFILE'] = cProfile.Profile()
+    _profile['PROFILE'].enable()
+
+    if worker:
+        # Pool workers exit via os._exit, after multiprocessing finalizers but not atexit.
+        Finalize(None, stop_profile, exitpriority=100)
+
+    else:
+        atexit.register(stop_profile)
+
+def stop_profile():
+    if 'PROFILE' not in _profile:
+        return
+
+    profile = _profile.pop('PROFILE')
+    profile.disable()
+
+    root    = profile_dir()
+    run     = _profile['RUN']
+
+    os.makedirs(root, exist_ok=True)
+
+    if _profile['WORKER']:
+        profile.dump_stats(root + f'{run}.worker{os.getpid()}.prof')
+
+        return
+
+    profile.dump_stats(root + f'{run}.prof')
+
+    if sys.stdout.closed:
+        # --log closes the redirected stdout before exit.
+        sys.stdout = sys.__stdout__
+
+    merge_profiles(run)
+
+def merge_profiles(run, remove=True):
+    '''
+    Merge the profile of a run with those of its pool workers;  write pstats & collapsed stacks.
+    '''
+    root     = profile_dir()
+    wpaths   = sorted(glob.glob(root + f'{run}.worker*.prof'))
+
+    stats    = pstats.Stats(root + f'{run}.prof')
+
+    for wpath in wpaths:
+        stats.add(wpath)
+
+    opath    = root + f'{run}.pstats'
+
+    stats.dump_stats(opath)
+
+    cpath    = root + f'{run}.collapsed'
+
+    with open(cpath, 'w') as ff:
+        for line in collapsed_stacks(stats):
+            ff.write(line + '\n')
+
+    if remove:
+        for wpath in wpaths:
+            os.remove(wpath)
+
+    print(f'\n\nProfile of {run} ({len(wpaths)} workers) written to {opath} & {cpath}.\n')
+
+    stats.sort_stats('cumulative').print_stats(20)
+
+    return  opath, cpath
+
+def _label(func):
+    fname, line, name = func
+
+    return  '{}:{}:{}'.format(os.path.basename(fname), line, name).replace(';', ',').replace(' ', '_')
+
+def collapsed_stacks(stats, maxdepth=64, mintime=1.e-4):
+    '''
+    Collapsed stack lines, 'root;caller;callee microseconds', of a pstats.Stats.  cProfile records
+    caller -> callee edges only, so the self time of each function is apportioned to its stacks by
+    the cumulative time of each call edge.
+    '''
+    stats     = stats.stats
+    children  = {}
+
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+
+    roots     = [func for func, value in stats.items() if len(value[4]) == 0]
+    totals    = {}
+
+    def walk(func, stack, weight):
+        tt      = stats[func][2]
+        stack   = stack + [func]
+
+        if tt * weight > mintime:
+            key         = ';'.join(_label(xx) for xx in stack)
+            totals[key] = totals.get(key, 0.) + tt * weight
+
+        if len(stack) >= maxdepth:
+            return
+
+        for child, edge_ct in children.get(func, []):
+            # Recursion, or negligible.
+            if (child in stack) or (weight * edge_ct <= mintime):
+                continue
+
+            walk(child, stack, min(weight * edge_ct / stats[child][3], 1.))
+
+    for root in roots:
+        walk(root, [], 1.)
+
+    return  ['{} {:d}'.format(key, int(round(1.e6 * value))) for key, value in totals.items() if value > 0.]
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Merge the (pool worker) profiles of a run.')
+    parser.add_argument('run', help='Run name, e.g. gen_zmax_cat_20230101_120000_1234')
+
+    args    = parser.parse_args()
+
+    merge_profiles(args.run)
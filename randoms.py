@@ -8,15 +8,26 @@ from   cosmo             import cosmo, volcom
 from   scipy.interpolate import interp1d
 from   astropy.table     import Table
 from   cartesian         import cartesian, rotate
-from   runtime           import calc_runtime
+from   runtime           import calc_runtime, stage
 from   desi_randoms      import desi_randoms
-from   findfile          import fetch_fields, findfile, overwrite_check, call_signature
+from   findfile          import fetch_fields, findfile, overwrite_check, call_signature, stage_hash
 from   gama_limits       import gama_limits, gama_field
 from   ddp_zlimits       import ddp_zlimits
 from   config            import Configuration
 from   params            import oversample_nrealisations
 
 
+def sampling_seed(seed, realz, oversample, oversampled=False):
+    '''
+    Seed of the body, or oversampled, randoms of realization realz;  as accumulated by the former
+    body then oversampled passes of a single call, whether or not generated together.
+    '''
+    if oversample > 1:
+        # only generate independent realizations for oversample.
+        seed += (1 + int(oversampled)) * (realz + 50 * oversample)
+
+    return  seed
+
 def randoms(field='G9', survey='gama', density=1., zmin=ddp_zlimits['DDP1'][0], zmax=ddp_zlimits['DDP1'][1], dryrun=False, prefix='', seed=None, oversample=2, realz=0):
     start   = time.time()
 
@@ -26,190 +37,194 @@ def randoms(field='G9', survey='gama', density=1., zmin=ddp_zlimits['DDP1'][0],
 
     opath   = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=prefix, realz=realz, oversample=oversample)
 
+    inhash  = stage_hash()
+
     if args.nooverwrite:
-        overwrite_check(opath)
+        overwrite_check(opath, inhash=inhash)
 
-    if seed == None:
-        seed = seed + realz + 50 * oversample
+    if seed is None:
+        seed = sampling_seed(0, realz, oversample, oversampled=oversample > 1)
 
-    np.random.seed(seed)
+    with stage('randoms', opath=opath):
+        np.random.seed(seed)
 
-    call_signature(dryrun, sys.argv)
+        call_signature(dryrun, sys.argv)
 
-    print('Solving for redshift limits: {} < z < {}.'.format(zmin, zmax))
+        print('Solving for redshift limits: {} < z < {}.'.format(zmin, zmax))
 
-    ##  ras and decs.                                                                                                                                                              
-    if survey == 'gama':    
-        Area       = 60.
+        ##  ras and decs.                                                                                                                                                              
+        if survey == 'gama':    
+            Area       = 60.
 
-        ra_min     = gama_limits[field]['ra_min']
-        ra_max     = gama_limits[field]['ra_max']
+            ra_min     = gama_limits[field]['ra_min']
+            ra_max     = gama_limits[field]['ra_max']
 
-        dec_min    = gama_limits[field]['dec_min']
-        dec_max    = gama_limits[field]['dec_max']
+            dec_min    = gama_limits[field]['dec_min']
+            dec_max    = gama_limits[field]['dec_max']
 
-        ctheta_min = np.cos(np.pi/2. - np.radians(dec_min))
-        ctheta_max = np.cos(np.pi/2  - np.radians(dec_max))
+            ctheta_min = np.cos(np.pi/2. - np.radians(dec_min))
+            ctheta_max = np.cos(np.pi/2  - np.radians(dec_max))
 
-        vol        = volcom(zmax, Area) - volcom(zmin, Area)
+            vol        = volcom(zmax, Area) - volcom(zmin, Area)
 
-        nrand      = int(np.ceil(vol * density * oversample))
+            nrand      = int(np.ceil(vol * density * oversample))
         
-        cos_theta  = np.random.uniform(ctheta_min, ctheta_max, nrand)
-        theta      = np.arccos(cos_theta)
-        decs       = np.pi/2. - theta
-        decs       = np.degrees(decs)
+            cos_theta  = np.random.uniform(ctheta_min, ctheta_max, nrand)
+            theta      = np.arccos(cos_theta)
+            decs       = np.pi/2. - theta
+            decs       = np.degrees(decs)
 
-        ras        = np.random.uniform(ra_min, ra_max, nrand)
+            ras        = np.random.uniform(ra_min, ra_max, nrand)
 
-        randoms    = Table(np.c_[ras, decs], names=['RANDOM_RA', 'RANDOM_DEC'])
-        nrand      = len(randoms)
+            randoms    = Table(np.c_[ras, decs], names=['RANDOM_RA', 'RANDOM_DEC'])
+            nrand      = len(randoms)
         
-        if dryrun:
-            # Dryrun:  2x2 sq. patch of sky.  
-            # G12
-            delta_deg = 0.5
+            if dryrun:
+                # Dryrun:  2x2 sq. patch of sky.  
+                # G12
+                delta_deg = 0.5
  
-            isin    = (randoms['RANDOM_RA'] > 180. - delta_deg) & (randoms['RANDOM_RA'] < 180. + delta_deg)
-            isin   &= (randoms['RANDOM_DEC'] > 0. - delta_deg) & (randoms['RANDOM_DEC'] < 0. + delta_deg)
+                isin    = (randoms['RANDOM_RA'] > 180. - delta_deg) & (randoms['RANDOM_RA'] < 180. + delta_deg)
+                isin   &= (randoms['RANDOM_DEC'] > 0. - delta_deg) & (randoms['RANDOM_DEC'] < 0. + delta_deg)
 
-            allin  = isin
+                allin  = isin
 
-            # G9                                                                                                                                                                                       
-            isin   = (randoms['RANDOM_RA']  > 135. - delta_deg) & (randoms['RANDOM_RA']  < 135. + delta_deg)
-            isin  &= (randoms['RANDOM_DEC'] > 0. - delta_deg) & (randoms['RANDOM_DEC'] < 0. + delta_deg)
+                # G9                                                                                                                                                                                       
+                isin   = (randoms['RANDOM_RA']  > 135. - delta_deg) & (randoms['RANDOM_RA']  < 135. + delta_deg)
+                isin  &= (randoms['RANDOM_DEC'] > 0. - delta_deg) & (randoms['RANDOM_DEC'] < 0. + delta_deg)
 
-            allin |= isin
+                allin |= isin
 
-            # G15                                                                                                                                                                                         
-            isin   = (randoms['RANDOM_RA']  > 217. - delta_deg) & (randoms['RANDOM_RA']  < 217. + delta_deg)
-            isin  &= (randoms['RANDOM_DEC'] > 0.0 - delta_deg) & (randoms['RANDOM_DEC'] < 0.0 + delta_deg)
+                # G15                                                                                                                                                                                         
+                isin   = (randoms['RANDOM_RA']  > 217. - delta_deg) & (randoms['RANDOM_RA']  < 217. + delta_deg)
+                isin  &= (randoms['RANDOM_DEC'] > 0.0 - delta_deg) & (randoms['RANDOM_DEC'] < 0.0 + delta_deg)
             
-            allin |= isin
+                allin |= isin
 
-            randoms = randoms[allin]
-            nrand   = len(randoms)
+                randoms = randoms[allin]
+                nrand   = len(randoms)
             
-    elif survey == 'desi':
-        if 'NERSC_HOST' in os.environ.keys():
-            # Support to run on nersc only.
-            randoms = desi_randoms(int(field[1:]), oversample=oversample, dryrun=dryrun)
+        elif survey == 'desi':
+            if 'NERSC_HOST' in os.environ.keys():
+                # Support to run on nersc only.
+                randoms = desi_randoms(int(field[1:]), oversample=oversample, dryrun=dryrun)
 
-            nrand   = randoms.meta['NRAND']
-            Area    = randoms.meta['AREA']
+                nrand   = randoms.meta['NRAND']
+                Area    = randoms.meta['AREA']
             
-        elif 'ddp1' in prefix:
-            rpath   = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=None, realz=realz, oversample=oversample)
-            randoms = Table.read(rpath)
+            elif 'ddp1' in prefix:
+                rpath   = findfile(ftype='randoms', dryrun=dryrun, field=field, survey=survey, prefix=None, realz=realz, oversample=oversample)
+                randoms = Table.read(rpath)
 
-            nrand   = randoms.meta['NRAND']
-            Area    = randoms.meta['AREA']
+                nrand   = randoms.meta['NRAND']
+                Area    = randoms.meta['AREA']
             
-        else:
-            print(f'As you are not running on nersc, the output of this script is assumed to be present at {opath} for dryrun: {dryrun}.')
-            return 0
+            else:
+                print(f'As you are not running on nersc, the output of this script is assumed to be present at {opath} for dryrun: {dryrun}.')
+                return 0
 
-    else:
-        raise  NotImplementedError(f'No implementation for survey: {survey}')
+        else:
+            raise  NotImplementedError(f'No implementation for survey: {survey}')
     
-    ##  Vs and zs.
-    dz       = 1.e-4
+        ##  Vs and zs.
+        dz       = 1.e-4
 
-    Vmin     = volcom(zmin, Area)
-    Vmax     = volcom(zmax, Area)
+        Vmin     = volcom(zmin, Area)
+        Vmax     = volcom(zmax, Area)
 
-    vol      = Vmax - Vmin
+        vol      = Vmax - Vmin
 
-    density  = nrand / vol
+        density  = nrand / vol
 
-    rand_dir = os.path.dirname(opath)
+        rand_dir = os.path.dirname(opath)
         
-    if not os.path.isdir(rand_dir):
-        print('Creating {}'.format(rand_dir))
+        if not os.path.isdir(rand_dir):
+            print('Creating {}'.format(rand_dir))
 
-        os.makedirs(rand_dir)
+            os.makedirs(rand_dir)
 
-    print('Volume [1e6]: {:.2f}; oversample: {:.2f};  density: {:.2e}; nrand [1e6]: {:.2f}'.format(vol/1.e6, oversample, density, nrand / 1.e6))
+        print('Volume [1e6]: {:.2f}; oversample: {:.2f};  density: {:.2e}; nrand [1e6]: {:.2f}'.format(vol/1.e6, oversample, density, nrand / 1.e6))
 
-    zs       = np.arange(0.0, zmax+dz, dz)
-    Vs       = volcom(zs, Area) 
+        zs       = np.arange(0.0, zmax+dz, dz)
+        Vs       = volcom(zs, Area) 
 
-    # https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.interp1d.html
-    Vz       = interp1d(Vs, zs, kind='linear', copy=True, bounds_error=True, fill_value=np.NaN, assume_sorted=False)
+        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.interp1d.html
+        Vz       = interp1d(Vs, zs, kind='linear', copy=True, bounds_error=True, fill_value=np.NaN, assume_sorted=False)
 
-    Vdraws   = np.random.uniform(0., 1., nrand)
-    Vdraws   = Vmin + Vdraws * (Vmax - Vmin)
+        Vdraws   = np.random.uniform(0., 1., nrand)
+        Vdraws   = Vmin + Vdraws * (Vmax - Vmin)
 
-    zs       = Vz(Vdraws)
+        zs       = Vz(Vdraws)
 
-    print('Solved {:d} for field {}'.format(nrand, field))
+        print('Solved {:d} for field {}'.format(nrand, field))
 
-    ras               = randoms['RANDOM_RA']
-    decs              = randoms['RANDOM_DEC']
+        ras               = randoms['RANDOM_RA']
+        decs              = randoms['RANDOM_DEC']
 
-    randoms['Z']      = zs
-    randoms['V']      = Vdraws
-    randoms['RANDID'] = np.arange(len(randoms))
+        randoms['Z']      = zs
+        randoms['V']      = Vdraws
+        randoms['RANDID'] = np.arange(len(randoms))
 
-    randoms['FIELD']      = field
+        randoms['FIELD']      = field
 
-    # TODO/HACK/RESTORE
-    randoms['GAMA_FIELD'] = gama_field(ras, decs)
+        # TODO/HACK/RESTORE
+        randoms['GAMA_FIELD'] = gama_field(ras, decs)
 
-    print('Applying rotation.')
+        print('Applying rotation.')
 
-    xyz      = cartesian(ras, decs, zs)
+        xyz      = cartesian(ras, decs, zs)
 
-    randoms['CARTESIAN_X'] = xyz[:,0]
-    randoms['CARTESIAN_Y'] = xyz[:,1]
-    randoms['CARTESIAN_Z'] = xyz[:,2]
+        randoms['CARTESIAN_X'] = xyz[:,0]
+        randoms['CARTESIAN_Y'] = xyz[:,1]
+        randoms['CARTESIAN_Z'] = xyz[:,2]
 
-    xyz      = rotate(randoms['RANDOM_RA'], randoms['RANDOM_DEC'], xyz)
+        xyz      = rotate(randoms['RANDOM_RA'], randoms['RANDOM_DEC'], xyz)
 
-    randoms['ROTCARTESIAN_X'] = xyz[:,0]
-    randoms['ROTCARTESIAN_Y'] = xyz[:,1]
-    randoms['ROTCARTESIAN_Z'] = xyz[:,2]
+        randoms['ROTCARTESIAN_X'] = xyz[:,0]
+        randoms['ROTCARTESIAN_Y'] = xyz[:,1]
+        randoms['ROTCARTESIAN_Z'] = xyz[:,2]
 
-    '''
-    elif survey == 'desi':    
-        randoms['IS_BOUNDARY'][randoms['ROS_DIST']   > np.percentile(randoms['ROS_DIST'],   100. - boundary_percent)] = 1
-        randoms['IS_BOUNDARY'][randoms['ROS_DIST']   < np.percentile(randoms['ROS_DIST'],   boundary_percent)]        = 1
-    '''
+        '''
+        elif survey == 'desi':    
+            randoms['IS_BOUNDARY'][randoms['ROS_DIST']   > np.percentile(randoms['ROS_DIST'],   100. - boundary_percent)] = 1
+            randoms['IS_BOUNDARY'][randoms['ROS_DIST']   < np.percentile(randoms['ROS_DIST'],   boundary_percent)]        = 1
+        '''
 
-    randoms['ZSURV']          = randoms['Z']
-    randoms['CONSERVATIVE']   = np.zeros_like(randoms['FIELD'], dtype=int)
+        randoms['ZSURV']          = randoms['Z']
+        randoms['CONSERVATIVE']   = np.zeros_like(randoms['FIELD'], dtype=int)
 
-    if 'IN_D8LUMFN' not in randoms.dtype.names:
-        randoms['IN_D8LUMFN'] = np.zeros_like(randoms['FIELD'], dtype=int)
+        if 'IN_D8LUMFN' not in randoms.dtype.names:
+            randoms['IN_D8LUMFN'] = np.zeros_like(randoms['FIELD'], dtype=int)
 
-    updates      = {'ZMIN':   zmin,\
-                    'ZMAX':   zmax,\
-                    'DZ':       dz,\
-                    'NRAND': nrand,\
-                    'FIELD': field,\
-                    'AREA':   Area,\
-                    'VOL':     vol,\
-                    'RAND_DENS': density,\
-                    'VOL8': (4./3.)*np.pi*(8.**3.),\
-                    'OVERSAMPLE': oversample,\
-                    'SEED': seed,\
-                    'PREFIX': prefix,\
-                    'REALZ': realz,\
-                    'FPATH': opath}
+        updates      = {'ZMIN':   zmin,\
+                        'ZMAX':   zmax,\
+                        'DZ':       dz,\
+                        'NRAND': nrand,\
+                        'FIELD': field,\
+                        'AREA':   Area,\
+                        'VOL':     vol,\
+                        'RAND_DENS': density,\
+                        'VOL8': (4./3.)*np.pi*(8.**3.),\
+                        'OVERSAMPLE': oversample,\
+                        'SEED': seed,\
+                        'PREFIX': prefix,\
+                        'REALZ': realz,\
+                        'FPATH': opath}
 
-    randoms.meta.update(updates)
+        randoms.meta.update(updates)
 
-    randoms.meta['NRAND8']      = randoms.meta['VOL8'] * randoms.meta['RAND_DENS']
-    randoms.meta['NRAND8_PERR'] = np.sqrt(randoms.meta['NRAND8'])
+        randoms.meta['NRAND8']      = randoms.meta['VOL8'] * randoms.meta['RAND_DENS']
+        randoms.meta['NRAND8_PERR'] = np.sqrt(randoms.meta['NRAND8'])
+        randoms.meta['INHASH']      = inhash
 
-    for key in randoms.meta.keys():
-        print(key, randoms.meta[key])
+        for key in randoms.meta.keys():
+            print(key, randoms.meta[key])
 
-    runtime = calc_runtime(start, 'Writing {}'.format(opath), xx=randoms)
+        runtime = calc_runtime(start, 'Writing {}'.format(opath), xx=randoms)
 
-    randoms.write(opath, format='fits', overwrite=True)
+        randoms.write(opath, format='fits', overwrite=True)
 
-    runtime = calc_runtime(start, 'Finished'.format(opath))
+        runtime = calc_runtime(start, 'Finished'.format(opath))
 
     return 0
 
@@ -227,6 +242,8 @@ if __name__ == '__main__':
     parser.add_argument('--density',      help='Random density per (Mpc/h)^3', default=1., type=float)
     parser.add_argument('--oversample',   help='Oversampling factor for fillfactor counting.', default=2, type=int)
     parser.add_argument('--seed',         help='Random seed.', default=0, type=int)
+    parser.add_argument('--body',         help='Only the body (not oversampled, realz=0) randoms, once per field;  see bin/rand_field_pipeline.', action='store_true')
+    parser.add_argument('--oversampled',  help='Only the oversampled randoms of this realization, given the body randoms.', action='store_true')
     
     # Defaults to GAMA Gold limits. 
     parser.add_argument('--zmin', type=float, help='Minimum redshift limit', default=ddp_zlimits['DDP1'][0])
@@ -248,9 +265,21 @@ if __name__ == '__main__':
 
     assert oversample < 9, f'Oversample of {oversample} is not supported.'
     assert realz < oversample_nrealisations, f'Provided realization number is inconsistent with that expected in params; consult there and bin/rand_pipeline scripts.'
+    assert not (args.body & args.oversampled), 'Body and oversampled randoms are generated by separate calls, or together by default.'
+
+    if args.body:
+        # Read as realz=0 by fillfactor & boundary, for all realizations.
+        realz      = 0
+        samplings  = [1]
+
+    elif args.oversampled:
+        samplings  = [oversample]
+
+    else:
+        samplings  = [1, oversample]
 
     if log:
-        logfile    = findfile(ftype='randoms', dryrun=False, field=field, survey=survey, prefix=prefix, realz=realz, log=True)
+        logfile    = findfile(ftype='randoms', dryrun=False, field=field, survey=survey, prefix=prefix, realz=realz, oversample=oversample if args.oversampled else 1, log=True)
 
         print(f'Logging to {logfile}')
 
@@ -260,15 +289,10 @@ if __name__ == '__main__':
     config.update_attributes('randoms', args)
     config.write()
     '''
-    for xx in [1, oversample]:        
-        seed      = seed
-
-        # only generate independent realizations for oversample.
-        if oversample > 1:
-            seed += realz
-            seed += 50 * oversample
+    for xx in samplings:
+        xseed     = sampling_seed(seed, realz, oversample, oversampled=xx > 1)
 
-        randoms(field=field, survey=survey, density=density, zmin=zmin, zmax=zmax, dryrun=dryrun, prefix=prefix, seed=seed, oversample=xx, realz=realz)
+        randoms(field=field, survey=survey, density=density, zmin=zmin, zmax=zmax, dryrun=dryrun, prefix=prefix, seed=xseed, oversample=xx, realz=realz)
 
     if log:
         sys.stdout.close()
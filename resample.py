@@ -0,0 +1,264 @@
+import numpy             as np
+
+from   collections       import OrderedDict
+from   astropy.table     import Table
+from   scipy.spatial     import KDTree
+
+
+def percentile_regions(ras, decs, ndiv=2):
+    '''
+    (ndiv x ndiv) regions on the sky:  RA percentile strips, each split by its DEC percentiles,
+    as solve_jackknife.
+    '''
+    percentiles = np.linspace(0., 100., ndiv + 1)
+
+    ra_edges    = np.percentile(ras, percentiles)
+    ra_idx      = np.clip(np.searchsorted(ra_edges, ras, side='right') - 1, 0, ndiv - 1)
+
+    dec_edges   = np.array([np.percentile(decs[ra_idx == ii], percentiles) for ii in range(ndiv)])
+
+    return  {'TYPE': 'PERCENTILE', 'NREGION': ndiv * ndiv, 'NDIV': ndiv, 'RA_EDGES': ra_edges, 'DEC_EDGES': dec_edges}
+
+def kmeans_regions(ras, decs, nregion=9, niter=20, seed=314):
+    '''
+    nregion regions on the sky by k-means (Lloyd) of the unit vectors of (a subset of) points.
+    '''
+    rng         = np.random.default_rng(seed)
+
+    points      = radec2xyz(ras, decs)
+
+    if len(points) > 100000:
+        points  = points[rng.choice(len(points), 100000, replace=False)]
+
+    centers     = points[rng.choice(len(points), nregion, replace=False)]
+
+    for ii in range(niter):
+        _, ids  = KDTree(centers).query(points, k=1)
+
+        counts  = np.bincount(ids, minlength=nregion)
+
+        for jj in range(3):
+            centers[:,jj] = np.where(counts > 0, np.bincount(ids, weights=points[:,jj], minlength=nregion) / np.maximum(counts, 1), centers[:,jj])
+
+        centers /= np.linalg.norm(centers, axis=1)[:,None]
+
+    return  {'TYPE': 'KMEANS', 'NREGION': nregion, 'CENTERS': centers}
+
+def solve_regions(ras, decs, kind='percentile', ndiv=2, nregion=None):
+    '''
+    Percentile (ndiv x ndiv) or k-means (nregion, default ndiv x ndiv) regions on the sky.
+    '''
+    if kind == 'percentile':
+        return  percentile_regions(ras, decs, ndiv=ndiv)
+
+    elif kind == 'kmeans':
+        return  kmeans_regions(ras, decs, nregion=ndiv * ndiv if nregion is None else nregion)
+
+    else:
+        raise  NotImplementedError(f'No implementation for regions of kind: {kind}')
+
+def radec2xyz(ras, decs):
+    ras         = np.radians(ras)
+    decs        = np.radians(decs)
+
+    return  np.c_[np.cos(decs) * np.cos(ras), np.cos(decs) * np.sin(ras), np.sin(decs)]
+
+def assign_regions(ras, decs, regions):
+    '''
+    Integer region ID of each point, -1 outwith any (percentile) region.
+    '''
+    ras         = np.asarray(ras)
+    decs        = np.asarray(decs)
+
+    if regions['TYPE'] == 'KMEANS':
+        _, ids  = KDTree(regions['CENTERS']).query(radec2xyz(ras, decs), k=1)
+
+        return  ids
+
+    ndiv        = regions['NDIV']
+    ra_edges    = regions['RA_EDGES']
+    dec_edges   = regions['DEC_EDGES']
+
+    ids         = -np.ones(len(ras), dtype=int)
+
+    ra_idx      = np.searchsorted(ra_edges, ras, side='right') - 1
+
+    # Inclusive upper edge, as set_jackknife.
+    ra_idx[ras == ra_edges[-1]] = ndiv - 1
+
+    for ii in range(ndiv):
+        isin    = (ra_idx == ii)
+
+        dec_idx = np.searchsorted(dec_edges[ii], decs[isin], side='right') - 1
+        dec_idx[decs[isin] == dec_edges[ii][-1]] = ndiv - 1
+
+        valid   = (dec_idx >= 0) & (dec_idx < ndiv)
+
+        ids[np.where(isin)[0][valid]] = ii * ndiv + dec_idx[valid]
+
+    return  ids
+
+def region_limits(regions):
+    '''
+    Percentile regions as jackknife limits, see jackknife_limits.jk_limits;  k-means regions as
+    the (ra, dec) of their centers.
+    '''
+    limits      = OrderedDict()
+
+    if regions['TYPE'] == 'KMEANS':
+        centers = regions['CENTERS']
+
+        for ii, center in enumerate(centers):
+            limits[f'JK{ii}'] = {'ra':  float(np.degrees(np.arctan2(center[1], center[0])) % 360.),\
+                                 'dec': float(np.degrees(np.arcsin(np.clip(center[2], -1., 1.))))}
+
+        return  limits
+
+    ndiv        = regions['NDIV']
+
+    for ii in range(ndiv):
+        for jj in range(ndiv):
+            limits[f'JK{ii * ndiv + jj}'] = {'ra_min':  float(regions['RA_EDGES'][ii]),     'ra_max':  float(regions['RA_EDGES'][ii + 1]),\
+                                             'dec_min': float(regions['DEC_EDGES'][ii][jj]), 'dec_max': float(regions['DEC_EDGES'][ii][jj + 1])}
+
+    return  limits
+
+def region_labels(ids):
+    '''
+    String labels ('JK0', ...) of region IDs, as set_jackknife.
+    '''
+    result      = np.array(['JK{}'.format(x) for x in range(np.max(ids) + 1)] + ['None'])
+
+    return  result[np.where(ids >= 0, ids, -1)]
+
+def region_sums(ids, nregion, bins=None, nbin=1, weights=None):
+    '''
+    Per region partial sums [nregion, nbin] of weights (or counts), in integer bins;  computed
+    once and shared by all resamplings.
+    '''
+    if bins is None:
+        bins    = np.zeros(len(ids), dtype=int)
+
+    isin        = (ids >= 0) & (bins >= 0) & (bins < nbin)
+
+    if weights is not None:
+        weights = weights[isin]
+
+    result      = np.bincount(ids[isin] * nbin + bins[isin], weights=weights, minlength=nregion * nbin)
+
+    return  result.reshape(nregion, nbin)
+
+def jackknife_weights(nregion):
+    '''
+    Region weights of each jackknife realisation:  all but one region.
+    '''
+    return  1. - np.eye(nregion)
+
+def bootstrap_weights(nregion, nboot=100, seed=314):
+    '''
+    Region weights of each bootstrap realisation:  nregion regions drawn with replacement.
+    '''
+    rng         = np.random.default_rng(seed)
+
+    return  rng.multinomial(nregion, np.ones(nregion) / nregion, size=nboot).astype(float)
+
+def resample(sums, weights):
+    '''
+    Realisations [nrealz, nbin] of region partial sums [nregion, nbin].
+    '''
+    return  weights @ sums
+
+def resample_error(realz):
+    '''
+    Mean and error of realisations;  for jackknife, the standard deviation as jackknife_mean.
+    '''
+    return  np.mean(realz, axis=0), np.std(realz, axis=0)
+
+def resample_lumfn(vmax, ids, nregion, weights, rand_ids=None, Ms=None, Mcol='MCOLOR_0P0', kind='JK'):
+    '''
+    1/VMAX luminosity function of each realisation (jackknife or bootstrap region weights),
+    binned as lumfn.  The volume of each realisation is the randoms weighted fraction, if
+    region IDs of randoms are provided, or proportional to the number of regions otherwise.
+    '''
+    if Ms is None:
+        Ms      = np.linspace(-23.,  -16.,  36)
+
+    dM          = np.round(np.diff(Ms)[0], decimals=4)
+    nbin        = len(Ms)
+
+    bins        = np.digitize(vmax[Mcol].data, bins=Ms)
+    bins[(vmax[Mcol].data < Ms.min()) | (vmax[Mcol].data > Ms.max())] = -1
+
+    ns          = region_sums(ids, nregion, bins=bins, nbin=nbin)
+    ivmax       = region_sums(ids, nregion, bins=bins, nbin=nbin, weights=1. / vmax['VMAX'].data)
+    ivmax2      = region_sums(ids, nregion, bins=bins, nbin=nbin, weights=1. / vmax['VMAX'].data**2.)
+
+    if rand_ids is None:
+        fracs   = np.ones(nregion) / nregion
+
+    else:
+        fracs   = region_sums(rand_ids, nregion)[:,0]
+        fracs   = fracs / np.sum(fracs)
+
+    volfracs    = resample(fracs[:,None], weights)
+
+    phis        = resample(ivmax, weights) / volfracs / dM
+
+    mean, err   = resample_error(phis)
+
+    result      = Table()
+    result['MID_M']                        = Ms + dM/2.
+    result['N']                            = np.sum(ns, axis=0)
+    result[f'PHI_IVMAX_{kind}']            = mean
+    result[f'PHI_IVMAX_ERROR_{kind}']      = err
+    result[f'PHI_IVMAX_{kind}_REALZ']      = phis.T
+    result[f'PHI_IVMAX_ERROR_{kind}_REALZ'] = (np.sqrt(resample(ivmax2, weights / volfracs**2.)) / dM).T
+    result[f'N_{kind}_REALZ']              = resample(ns, weights).T
+
+    result.meta['NREALZ']                  = len(weights)
+    result.meta['NREGION']                 = nregion
+    result.meta['EXTNAME']                 = f'LUMFN_{kind}'
+
+    return  result, volfracs[:,0]
+
+def realisation_lumfns(result, volfracs, kind='JK', suffix=''):
+    '''
+    Per realisation LFs of resample_lumfn, as the LUMFN_JK{n} extensions of lumfn with a jack knife
+    array, e.g. for jackknife_limits.jackknife_mean.
+    '''
+    realz       = []
+
+    for ii, volfrac in enumerate(volfracs):
+        lf                     = Table()
+        lf['MID_M']            = result['MID_M']
+        lf['PHI_IVMAX']        = result[f'PHI_IVMAX_{kind}_REALZ'][:,ii]
+        lf['PHI_IVMAX_ERROR']  = result[f'PHI_IVMAX_ERROR_{kind}_REALZ'][:,ii]
+        lf['N']                = result[f'N_{kind}_REALZ'][:,ii]
+        lf['VALID']            = lf['N'] >= 5
+
+        lf.meta['EXTNAME']     = f'LUMFN_{kind}{ii}{suffix}'
+        lf.meta['RENORM']      = 'FALSE'
+        lf.meta[f'{kind}_VOLFRAC'] = volfrac
+        lf.meta['NREALZ']      = len(volfracs)
+
+        realz.append(lf)
+
+    return  realz
+
+def resample_tier_volfracs(rand_ids, tiers, nregion, ntier, weights):
+    '''
+    Density tier volume fractions of each realisation, from randoms tiers and region IDs.
+    '''
+    counts      = region_sums(rand_ids, nregion, bins=tiers, nbin=ntier)
+    total       = region_sums(rand_ids, nregion)
+
+    return  resample(counts, weights) / resample(total, weights)
+
+def resample_mean(ids, values, nregion, weights, bins=None, nbin=1):
+    '''
+    Mean of values (e.g. delta8, in tiers) for each realisation.
+    '''
+    sums        = region_sums(ids, nregion, bins=bins, nbin=nbin, weights=values)
+    counts      = region_sums(ids, nregion, bins=bins, nbin=nbin)
+
+    return  resample(sums, weights) / resample(counts, weights)
@@ -1,17 +1,53 @@
 import os
 import sys
+import glob
+import json
 import time
+import socket
+import resource
+import datetime
 import warnings
+import contextlib
+import numpy                  as     np
 
+from   functools              import partial
+from   astropy.table          import Table
 from   astropy.io.fits.verify import VerifyWarning
 from   astropy.utils.metadata import MergeConflictWarning
+from   profiler               import profile_requested, start_profile
 
 # Suppress verify warnings, e.g. HIERARCH card length. 
 warnings.simplefilter('ignore', category=VerifyWarning)
 warnings.simplefilter('ignore', category=MergeConflictWarning)
 
+# Opt-in profiling of any entry point importing runtime, see profiler.py.
+if profile_requested():
+    start_profile()
+
+# Stack of open stage records, see stage.
+_stages = []
+
+# Files opened (python level) by this process, see _audit.
+_opened = {'COUNT': 0, 'HOOKED': False}
+
+def nbytes(xx):
+    if isinstance(xx, Table):
+        return  np.sum([xx[col].data.nbytes for col in xx.colnames], dtype=int)
+
+    if isinstance(xx, np.ndarray):
+        return  xx.nbytes
+
+    if isinstance(xx, (list, tuple)):
+        return  np.sum([nbytes(x) for x in xx], dtype=int)
+
+    if isinstance(xx, dict):
+        return  np.sum([nbytes(x) for x in xx.values()], dtype=int)
+
+    return  sys.getsizeof(xx)
+
 def sizeofMB(xx):
-    return  sys.getsizeof(xx) / 1.e6
+    # sys.getsizeof excludes numpy buffers, e.g. of Table columns.
+    return  nbytes(xx) / 1.e6
 
 def calc_runtime(start, log=None, memuse=False, xx=None):
     runtime  = time.time() - start
@@ -33,13 +69,210 @@ def calc_runtime(start, log=None, memuse=False, xx=None):
         msg = '{} after {:.4f} mins{}.'.format(log, runtime, memuse)
         
         if xx is not None:
-            msg = msg.replace('Writing', 'Writing ({}MB)'.format(sizeofMB(xx)))
-            msg = msg.replace('Reading', 'Reading ({}MB)'.format(sizeofMB(xx)))
+            msg = msg.replace('Writing', 'Writing ({:.2f}MB)'.format(sizeofMB(xx)))
+            msg = msg.replace('Reading', 'Reading ({:.2f}MB)'.format(sizeofMB(xx)))
 
         print(msg)
         
     return  runtime
 
+def _audit(event, args):
+    if (event == 'open') and isinstance(args[0], str) and not args[0].startswith('/proc/'):
+        _opened['COUNT'] += 1
+
+def _peak_rss_mb():
+    # ru_maxrss is inherited across fork & exec, e.g. by spawned pool workers;  VmHWM is not.
+    try:
+        with open('/proc/self/status') as ff:
+            for line in ff:
+                if line.startswith('VmHWM:'):
+                    return  int(line.split()[1]) / 1.e3
+
+    except OSError:
+        pass
+
+    return  resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1.e3
+
+def _usage():
+    usage  = resource.getrusage(resource.RUSAGE_SELF)
+    child  = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    result = {'WALL_S':            time.time(),\
+              'CPU_S':             usage.ru_utime + usage.ru_stime,\
+              'CHILD_CPU_S':       child.ru_utime + child.ru_stime,\
+              # Peak to date.
+              'PEAK_RSS_MB':       _peak_rss_mb(),\
+              'CHILD_PEAK_RSS_MB': child.ru_maxrss / 1.e3,\
+              'READ_MB':           0.,\
+              'WRITE_MB':          0.,\
+              'NOPENED':           _opened['COUNT']}
+
+    try:
+        # Includes cached & C level, e.g. cfitsio, I/O.
+        with open('/proc/self/io') as ff:
+            io = dict(line.split(':') for line in ff.read().splitlines())
+
+        result['READ_MB']  = int(io['rchar']) / 1.e6
+        result['WRITE_MB'] = int(io['wchar']) / 1.e6
+
+    except (OSError, KeyError):
+        pass
+
+    return  result
+
+def report_path(opath):
+    return  os.path.splitext(opath)[0] + '.report.json'
+
+def write_report(record, opath):
+    rpath = report_path(opath)
+
+    with open(rpath, 'w') as ff:
+        json.dump(record, ff, indent=2, default=str)
+
+    print(f'Writing run report {rpath}.')
+
+    return  rpath
+
+@contextlib.contextmanager
+def stage(name, opath=None, **meta):
+    '''
+    Instrument a named stage, or a sub-step if nested:  wall & cpu time (of self and of terminated
+    pool workers), peak rss to date, MB read & written, files opened (python level) and per-worker
+    stats, see pool_map.  With opath, the record is written as json next to the product.
+    '''
+    if not _opened['HOOKED']:
+        sys.addaudithook(_audit)
+
+        _opened['HOOKED'] = True
+
+    record = {'NAME': name, 'START': datetime.datetime.now().isoformat(), 'HOST': socket.gethostname(), 'PID': os.getpid(), 'ARGV': ' '.join(sys.argv), 'SUCCESS': True}
+    record.update(meta)
+
+    if _stages:
+        _stages[-1]['STEPS'].append(record)
+
+    record['STEPS']   = []
+    record['WORKERS'] = {}
+
+    start  = _usage()
+
+    _stages.append(record)
+
+    try:
+        yield  record
+
+    except BaseException:
+        record['SUCCESS'] = False
+
+        raise
+
+    finally:
+        end = _usage()
+
+        for key in ['WALL_S', 'CPU_S', 'CHILD_CPU_S', 'READ_MB', 'WRITE_MB', 'NOPENED']:
+            record[key] = end[key] - start[key]
+
+        for key in ['PEAK_RSS_MB', 'CHILD_PEAK_RSS_MB']:
+            record[key] = end[key]
+
+        _stages.pop()
+
+        print('{} in {:.4f} mins (cpu {:.2f}s, peak rss {:.2f}MB, read {:.2f}MB, written {:.2f}MB).'.format(name, record['WALL_S'] / 60., record['CPU_S'] + record['CHILD_CPU_S'], record['PEAK_RSS_MB'], record['READ_MB'], record['WRITE_MB']))
+
+        if opath is not None:
+            write_report(record, opath)
+
+def _instrumented(func, args, star=False):
+    start  = time.time()
+    cpu    = time.process_time()
+
+    result = func(*args) if star else func(args)
+
+    stats  = {'PID':         os.getpid(),\
+              'WALL_S':      time.time() - start,\
+              'CPU_S':       time.process_time() - cpu,\
+              'PEAK_RSS_MB': _peak_rss_mb()}
+
+    return  result, stats
+
+def _record_workers(stats):
+    if _stages:
+        workers = _stages[-1]['WORKERS']
+        pid     = str(stats['PID'])
+
+        if pid not in workers:
+            workers[pid] = {'NCALLS': 0, 'WALL_S': 0., 'CPU_S': 0., 'PEAK_RSS_MB': 0.}
+
+        workers[pid]['NCALLS']     += 1
+        workers[pid]['WALL_S']     += stats['WALL_S']
+        workers[pid]['CPU_S']      += stats['CPU_S']
+        workers[pid]['PEAK_RSS_MB'] = max(workers[pid]['PEAK_RSS_MB'], stats['PEAK_RSS_MB'])
+
+def pool_map(pool, func, iterable, star=False):
+    '''
+    pool.map (or starmap) of func, recording the calls, wall & cpu time and peak rss of each worker
+    to the open stage.
+    '''
+    result = pool.map(partial(_instrumented, func, star=star), iterable)
+
+    for _, stats in result:
+        _record_workers(stats)
+
+    return  [xx[0] for xx in result]
+
+def pool_imap(pool, func, iterable, chunksize=1):
+    '''
+    As pool_map, for pool.imap:  yields the results in order, e.g. to a progress bar.
+    '''
+    for result, stats in pool.imap(partial(_instrumented, func), iterable, chunksize=chunksize):
+        _record_workers(stats)
+
+        yield  result
+
+def aggregate_reports(root=None, opath=None):
+    '''
+    Gather the stage reports under root (default $GOLD_DIR) into a single pipeline level report.
+    '''
+    if root is None:
+        root  = os.environ['GOLD_DIR']
+
+    if opath is None:
+        opath = root + '/logs/run_report.json'
+
+    rpaths  = sorted(glob.glob(root + '/**/*.report.json', recursive=True))
+    records = []
+
+    for rpath in rpaths:
+        with open(rpath, 'r') as ff:
+            record = json.load(ff)
+
+        record['REPORT'] = rpath
+
+        records.append(record)
+
+    totals  = {}
+
+    for key in ['WALL_S', 'CPU_S', 'CHILD_CPU_S', 'READ_MB', 'WRITE_MB', 'NOPENED']:
+        totals[key] = np.sum([record.get(key, 0) for record in records]).tolist()
+
+    for key in ['PEAK_RSS_MB', 'CHILD_PEAK_RSS_MB']:
+        totals[key] = np.max([record.get(key, 0) for record in records] + [0]).tolist()
+
+    totals['NSTAGES'] = len(records)
+    totals['FAILED']  = [record['NAME'] for record in records if not record.get('SUCCESS', True)]
+
+    print('\n\n{}\t{}\t{}\t{}\t{}'.format('STAGE'.ljust(40), 'WALL [MINS]', 'CPU [MINS]', 'PEAK RSS [MB]', 'WRITTEN [MB]'))
+
+    for record in sorted(records, key=lambda xx: -xx.get('WALL_S', 0)):
+        print('{}\t{:.2f}\t\t{:.2f}\t\t{:.2f}\t\t{:.2f}'.format(os.path.basename(record['REPORT']).replace('.report.json', '').ljust(40), record['WALL_S'] / 60., (record['CPU_S'] + record['CHILD_CPU_S']) / 60., record['PEAK_RSS_MB'], record['WRITE_MB']))
+
+    with open(opath, 'w') as ff:
+        json.dump({'TOTALS': totals, 'STAGES': records}, ff, indent=2, default=str)
+
+    print(f'\n\nWriting pipeline run report {opath}.')
+
+    return  opath
+
 
 if __name__ == '__main__':
     start = time.time()
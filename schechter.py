@@ -10,14 +10,19 @@ def schechter(M, phistar, Mstar, alpha):
 
     return  np.log(10.) * phistar * expa * expb / 2.5
 
-def schechter_d8(M, d8, params=False, fit=True, ratio=False):
+# TMR d8 scaling, see schechter_d8.
+tmr_d8_coeffs = {'log10phistar0': -2.030, 'dlog10phistar': 1.01, 'Mstar0': -20.70, 'dMstar': -0.67, 'alpha': -1.25}
+
+def schechter_d8(M, d8, params=False, fit=True, ratio=False, coeffs=None):
     '''
-    TMR d8 Schechter.
+    d8 Schechter, TMR unless coeffs (see tmr_d8_coeffs) are given, e.g. from schechter_fit.fit_lumfn_d8.
     '''
+    if coeffs is None:
+        coeffs    = tmr_d8_coeffs
 
-    alpha         = -1.25
-    Mstar         = -20.70 - 0.67 * np.log10(1. + d8) 
-    log10phistar  = -2.030 + 1.01 * np.log10(1. + d8)
+    alpha         = coeffs['alpha']
+    Mstar         = coeffs['Mstar0'] + coeffs['dMstar'] * np.log10(1. + d8) 
+    log10phistar  = coeffs['log10phistar0'] + coeffs['dlog10phistar'] * np.log10(1. + d8)
 
     if not fit:
         # Middle panel TMR Fig. 7 shows least dense bin is above fit
@@ -0,0 +1,406 @@
+import os
+import re
+import sys
+import argparse
+import numpy           as     np
+import astropy.io.fits as     fits
+
+from   scipy.optimize  import minimize
+from   scipy.linalg    import block_diag
+from   astropy.table   import Table
+from   schechter       import schechter, tmr_d8_coeffs
+from   delta8_limits   import d8_limits
+from   findfile        import findfile
+from   data.schechters import schechters
+
+
+# Gaussian priors (loc, scale), as fit_schechter.py;  parameter order of all batches.
+pnames  = ['log10phistar', 'Mstar', 'alpha']
+priors  = np.array([[ -2.00, 0.25],\
+                    [-20.89, 0.15],\
+                    [ -1.25, 0.05]])
+
+# d8 scaling parameters of schechter_d8, with broad Gaussian priors about TMR.
+d8_pnames  = ['log10phistar0', 'dlog10phistar', 'Mstar0', 'dMstar', 'alpha']
+d8_priors  = np.array([[tmr_d8_coeffs[x], scale] for x, scale in zip(d8_pnames, [0.5, 0.5, 0.5, 0.5, 0.2])])
+
+def schechter_batch(M, params):
+    '''
+    Schechter for a batch of parameter vectors [nbatch, 3] of (log10phistar, Mstar, alpha),
+    evaluated at each M [nM];  returns [nbatch, nM].
+    '''
+    params  = np.atleast_2d(params)
+
+    return  schechter(M[None,:], 10.**params[:,0,None], params[:,1,None], params[:,2,None])
+
+def jackknife_cov(realz):
+    '''
+    Covariance of realisations [nbin, nrealz], normalised as resample_error.  With no more
+    realisations than (non-empty) bins, the sample covariance is singular and only its diagonal
+    is retained.
+    '''
+    cov     = np.cov(realz, bias=True)
+
+    nbin    = np.count_nonzero(np.diag(cov) > 0.)
+    nrealz  = realz.shape[1]
+
+    if nrealz <= nbin:
+        print('WARNING:  {} realisations for {} bins;  diagonal jack knife covariance only.'.format(nrealz, nbin))
+
+        cov = np.diag(np.diag(cov))
+
+    return  cov
+
+def jackknife_realz(fpath, ext='LUMFN'):
+    '''
+    Jack knife realisations [nbin, nrealz] of the ext (LUMFN or LUMFN_{MCOL}) LF of a lumfn file:  from
+    its LUMFN_JK (or LUMFN_JK_{MCOL}) extension, see resample.resample_lumfn, or else the per region 
+    LUMFN_JK{n} (or LUMFN_JK{n}_{MCOL}) extensions of lumfn.
+    '''
+    assert  ext.startswith('LUMFN') and not ext.startswith('LUMFN_STEP'), f'No jack knife realisations for {ext}.'
+
+    jkext   = ext.replace('LUMFN', 'LUMFN_JK', 1)
+    suffix  = ext[len('LUMFN'):]
+
+    with fits.open(fpath) as hdulist:
+        extnames = [hdu.name for hdu in hdulist]
+
+    if jkext in extnames:
+        return  Table.read(fpath, jkext)['PHI_IVMAX_JK_REALZ'].data
+
+    realz   = [Table.read(fpath, xx)['PHI_IVMAX'].data for xx in extnames if re.match(r'^LUMFN_JK\d+' + re.escape(suffix) + '$', xx)]
+
+    if len(realz) == 0:
+        raise  KeyError(f'No {jkext} or per region LUMFN_JK{{n}}{suffix} extensions in {fpath};  run gen_gold_lf.py with --jackknife.')
+
+    return  np.array(realz).T
+
+def lumfn_data(lumfn, phi_col='PHI_IVMAX', err_col='PHI_IVMAX_ERROR', Mcol='MEDIAN_M', cov=None, nmin=5):
+    '''
+    Arrays of a binned LF (lumfn, lumfn_stepwise or jack knife) for batched fitting:  valid bins with
+    phi > 0 and N >= nmin, and the inverse covariance, either diagonal from err_col (or Poisson, if
+    absent) or the given (e.g. jack knife) covariance.
+    '''
+    phi     = np.array(lumfn[phi_col].data, dtype=float)
+
+    isin    = np.isfinite(phi) & (phi > 0.) & (lumfn['N'].data >= nmin)
+
+    if cov is None:
+        if err_col in lumfn.colnames:
+            err = np.array(lumfn[err_col].data, dtype=float)
+
+        else:
+            # E.g. stepwise;  Poisson.
+            err = phi / np.sqrt(np.clip(lumfn['N'].data, 1, None))
+
+        isin   &= (err > 0.)
+
+        icov    = np.diag(1. / err[isin]**2.)
+
+    else:
+        # No variance, e.g. empty in all realisations.
+        isin   &= (np.diag(cov) > 0.)
+
+        icov    = np.linalg.pinv(cov[isin][:,isin])
+
+    return  {'M': np.array(lumfn[Mcol].data[isin], dtype=float), 'PHI': phi[isin], 'ICOV': icov}
+
+def lnlike_batch(params, data):
+    '''
+    Gaussian log likelihood of the LF data for a batch of parameter vectors [nbatch, 3].
+    '''
+    res     = data['PHI'][None,:] - schechter_batch(data['M'], params)
+
+    return  -0.5 * np.einsum('bi,ij,bj->b', res, data['ICOV'], res)
+
+def lnprior_batch(params, priors=priors):
+    params  = np.atleast_2d(params)
+
+    return  -0.5 * np.sum(((params - priors[None,:,0]) / priors[None,:,1])**2., axis=1)
+
+def lnpost_batch(params, data, lnlike=lnlike_batch, priors=priors):
+    return  lnlike(params, data) + lnprior_batch(params, priors=priors)
+
+def ml_fit(data, lnlike=lnlike_batch, priors=priors, start=None):
+    '''
+    Maximum posterior parameters and (approx.) covariance, seeds for the chains.
+    '''
+    if start is None:
+        start = priors[:,0]
+
+    def nlnpost(x):
+        return  -lnpost_batch(x[None,:], data, lnlike=lnlike, priors=priors)[0]
+
+    result  = minimize(nlnpost, start, method='BFGS')
+    best    = result.x
+
+    # Finite difference Hessian, with all stencil points in one batch;  BFGS estimate as fallback.
+    npar    = len(best)
+    hs      = 1.e-3 * priors[:,1]
+
+    steps   = np.array([[si, sj] for si in [1., -1.] for sj in [1., -1.]])
+    points  = np.array([best + si * hs[ii] * np.eye(npar)[ii] + sj * hs[jj] * np.eye(npar)[jj] for ii in range(npar) for jj in range(npar) for si, sj in steps])
+
+    lps     = -lnpost_batch(points, data, lnlike=lnlike, priors=priors).reshape(npar, npar, 4)
+
+    hess    = (lps[:,:,0] - lps[:,:,1] - lps[:,:,2] + lps[:,:,3]) / (4. * hs[:,None] * hs[None,:])
+    hess    = 0.5 * (hess + hess.T)
+
+    try:
+        pcov = np.linalg.inv(hess)
+        
+        np.linalg.cholesky(pcov)
+
+    except np.linalg.LinAlgError:
+        pcov = np.atleast_2d(result.hess_inv)
+
+    return  best, pcov
+
+def run_chains(data, nchains=8, nsteps=5000, nburn=1000, lnlike=lnlike_batch, priors=priors, seed=314, start=None, pcov=None):
+    '''
+    Metropolis chains run in parallel, i.e. all chains are advanced together with one batched
+    posterior evaluation per step.  Seeded about the maximum posterior, with a proposal of its
+    covariance.  Returns samples [nchains, nsteps - nburn, npar], acceptance and the Gelman-Rubin R-1.
+    '''
+    assert  nsteps > nburn, f'{nsteps} steps leave no samples after a burn-in of {nburn}.'
+
+    rng     = np.random.default_rng(seed)
+
+    if start is None:
+        start, pcov = ml_fit(data, lnlike=lnlike, priors=priors)
+
+    npar    = len(start)
+
+    # Optimal scaling for a Gaussian target.
+    chol    = np.linalg.cholesky((2.38**2. / npar) * pcov + 1.e-12 * np.eye(npar))
+
+    xs      = start[None,:] + 0.1 * rng.normal(size=(nchains, npar)) @ chol.T
+    lps     = lnpost_batch(xs, data, lnlike=lnlike, priors=priors)
+
+    samples = np.zeros((nchains, nsteps, npar))
+    naccept = 0
+
+    for ii in range(nsteps):
+        props   = xs + rng.normal(size=(nchains, npar)) @ chol.T
+        lprops  = lnpost_batch(props, data, lnlike=lnlike, priors=priors)
+
+        accept  = np.log(rng.uniform(size=nchains)) < (lprops - lps)
+
+        xs[accept]  = props[accept]
+        lps[accept] = lprops[accept]
+
+        naccept    += np.count_nonzero(accept)
+
+        samples[:,ii,:] = xs
+
+    samples = samples[:,nburn:,:]
+
+    return  samples, naccept / nchains / nsteps, gelman_rubin(samples)
+
+def gelman_rubin(samples):
+    '''
+    Gelman-Rubin R-1 of each parameter for chains [nchains, nsamples, npar].
+    '''
+    nn      = samples.shape[1]
+
+    within  = np.mean(np.var(samples, axis=1, ddof=1), axis=0)
+    between = nn * np.var(np.mean(samples, axis=1), axis=0, ddof=1)
+
+    var     = (nn - 1.) / nn * within + between / nn
+
+    return  np.sqrt(var / within) - 1.
+
+def tier_data(lumfns, d8s, covs=None, **kwargs):
+    '''
+    Concatenated arrays of the LFs of all density tiers, with the tier log10(1 + d8) of each 
+    bin and a block diagonal inverse covariance, for a joint fit.  kwargs as lumfn_data.
+    '''
+    if covs is None:
+        covs  = [None] * len(lumfns)
+
+    datas     = [lumfn_data(lumfn, cov=cov, **kwargs) for lumfn, cov in zip(lumfns, covs)]
+
+    result    = {'M':    np.concatenate([data['M'] for data in datas]),\
+                 'PHI':  np.concatenate([data['PHI'] for data in datas]),\
+                 'LD8':  np.concatenate([np.log10(1. + d8) * np.ones(len(data['M'])) for d8, data in zip(d8s, datas)]),\
+                 'ICOV': block_diag(*[data['ICOV'] for data in datas])}
+
+    return  result
+
+def lnlike_d8_batch(params, data):
+    '''
+    Joint Gaussian log likelihood of all tier LFs for a batch of d8 scaling parameters 
+    [nbatch, 5], see d8_pnames and schechter.schechter_d8.
+    '''
+    params        = np.atleast_2d(params)
+
+    log10phistar  = params[:,0,None] + params[:,1,None] * data['LD8'][None,:]
+    Mstar         = params[:,2,None] + params[:,3,None] * data['LD8'][None,:]
+    alpha         = params[:,4,None]
+
+    res           = data['PHI'][None,:] - schechter(data['M'][None,:], 10.**log10phistar, Mstar, alpha)
+
+    return  -0.5 * np.einsum('bi,ij,bj->b', res, data['ICOV'], res)
+
+def fit_lumfn_d8(fpaths, ext='LUMFN', phi_col='PHI_IVMAX', err_col='PHI_IVMAX_ERROR', Mcol='MEDIAN_M', jackknife=False, nchains=8, nsteps=5000, nburn=1000):
+    '''
+    Joint fit of the d8 scaling of the Schechter parameters to the LFs of all density tiers, 
+    e.g. the multi-field ddp_n8_d0_lumfn files.  The tier d8 is that of the DDP1_D8 header. 
+    '''
+    lumfns    = [Table.read(fpath, ext) for fpath in fpaths]
+    d8s       = [float(lumfn.meta['DDP1_D8']) for lumfn in lumfns]
+
+    covs      = None
+
+    if jackknife:
+        covs  = [jackknife_cov(jackknife_realz(fpath, ext=ext)) for fpath in fpaths]
+
+    data      = tier_data(lumfns, d8s, covs=covs, phi_col=phi_col, err_col=err_col, Mcol=Mcol)
+
+    print('Jointly fitting {} bins of {} tiers with d8 of {}.'.format(len(data['M']), len(lumfns), d8s))
+
+    best, pcov               = ml_fit(data, lnlike=lnlike_d8_batch, priors=d8_priors)
+    samples, accept, rminus1 = run_chains(data, nchains=nchains, nsteps=nsteps, nburn=nburn, lnlike=lnlike_d8_batch, priors=d8_priors, start=best, pcov=pcov)
+
+    flat      = samples.reshape(-1, samples.shape[-1])
+
+    result    = Table()
+    result['PARAM']   = d8_pnames
+    result['ML']      = best
+    result['MEAN']    = np.mean(flat, axis=0)
+    result['STD']     = np.std(flat, axis=0)
+    result['RMINUS1'] = rminus1
+    result['TMR']     = [tmr_d8_coeffs[x] for x in d8_pnames]
+
+    result.meta['EXT']      = ext
+    result.meta['PHI_COL']  = phi_col
+    result.meta['JK_COV']   = jackknife
+    result.meta['NTIER']    = len(lumfns)
+    result.meta['CHI2']     = -2. * lnlike_d8_batch(best, data)[0]
+    result.meta['NBIN']     = len(data['M'])
+    result.meta['ACCEPT']   = accept
+    result.meta['NBURN']    = nburn
+    result.meta['EXTNAME']  = 'SCHECHTER_D8_FIT'
+
+    return  result, samples
+
+def fit_lumfn(fpath, ext='LUMFN', phi_col='PHI_IVMAX', err_col='PHI_IVMAX_ERROR', Mcol='MEDIAN_M', jackknife=False, nchains=8, nsteps=5000, nburn=1000):
+    '''
+    Schechter fit of a lumfn file extension, e.g. LUMFN (1/VMAX), LUMFN_STEP (stepwise, with
+    phi_col=PHI_STEPWISE and Mcol=MID_M) or with the jack knife covariance, see jackknife_realz.
+    '''
+    lumfn   = Table.read(fpath, ext)
+    cov     = None
+
+    if jackknife:
+        cov   = jackknife_cov(jackknife_realz(fpath, ext=ext))
+
+    data    = lumfn_data(lumfn, phi_col=phi_col, err_col=err_col, Mcol=Mcol, cov=cov)
+
+    print('Fitting {} bins of {} of {}.'.format(len(data['M']), ext, fpath))
+
+    best, pcov               = ml_fit(data)
+    samples, accept, rminus1 = run_chains(data, nchains=nchains, nsteps=nsteps, nburn=nburn, start=best, pcov=pcov)
+
+    flat    = samples.reshape(-1, samples.shape[-1])
+
+    result  = Table()
+    result['PARAM']  = pnames
+    result['ML']     = best
+    result['MEAN']   = np.mean(flat, axis=0)
+    result['STD']    = np.std(flat, axis=0)
+    result['RMINUS1']= rminus1
+
+    result.meta['EXT']      = ext
+    result.meta['PHI_COL']  = phi_col
+    result.meta['JK_COV']   = jackknife
+    result.meta['CHI2']     = -2. * lnlike_batch(best, data)[0]
+    result.meta['NBIN']     = len(data['M'])
+    result.meta['ACCEPT']   = accept
+    result.meta['NBURN']    = nburn
+    result.meta['EXTNAME']  = 'SCHECHTER_FIT'
+
+    return  result, samples
+
+
+if __name__ == '__main__':
+    parser  = argparse.ArgumentParser(description='Batched Schechter fit of measured luminosity functions.')
+    parser.add_argument('--fpath',     help='lumfn file; defaults to that of the survey, e.g. $GOLD_DIR/gama_gold_lumfn.fits', default=None)
+    parser.add_argument('--ext',       help='Extension, e.g. LUMFN, LUMFN_STEP', default='LUMFN')
+    parser.add_argument('--jackknife', help='Use the jack knife covariance.', action='store_true')
+    parser.add_argument('--nchains',   help='Number of chains.', default=8, type=int)
+    parser.add_argument('--nsteps',    help='Steps per chain.', default=5000, type=int)
+    parser.add_argument('--nburn',     help='Burn-in steps per chain, discarded.', default=1000, type=int)
+    parser.add_argument('--known',     action='store_true', help='Run for toy luminosity function.')
+    parser.add_argument('--d8',        action='store_true', help='Joint d8 fit to the multi-field LFs of all density tiers.')
+    parser.add_argument('--survey',    help='Select survey', default='gama')
+    parser.add_argument('--dryrun',    help='Fit the dryrun LFs.', action='store_true')
+
+    args    = parser.parse_args()
+
+    fpath   = args.fpath
+
+    if fpath is None:
+        fpath = findfile(ftype='lumfn', dryrun=args.dryrun, survey=args.survey)
+
+    ext     = args.ext
+
+    if ext.startswith('LUMFN_STEP'):
+        phi_col, err_col, Mcol = 'PHI_STEPWISE', None, 'MID_M'
+
+    else:
+        phi_col, err_col, Mcol = 'PHI_IVMAX', 'PHI_IVMAX_ERROR', 'MEDIAN_M'
+
+    if args.known:
+        tmr     = schechters['TMR']
+
+        Ms      = np.linspace(-23., -16., 36)
+        lumfn   = Table()
+        lumfn['MEDIAN_M']        = Ms
+        lumfn['PHI_IVMAX']       = schechter(Ms, 10.**tmr['log10phistar'], tmr['Mstar'], tmr['alpha'])
+        lumfn['PHI_IVMAX_ERROR'] = 1.e-2 * lumfn['PHI_IVMAX']
+        lumfn['N']               = 100
+
+        data    = lumfn_data(lumfn)
+
+        best, pcov               = ml_fit(data)
+        samples, accept, rminus1 = run_chains(data, nchains=args.nchains, nsteps=args.nsteps, nburn=args.nburn, start=best, pcov=pcov)
+
+        print('ML:  {}'.format(best))
+        print('Mean:  {}'.format(np.mean(samples.reshape(-1, 3), axis=0)))
+        print('Acceptance:  {:.3f};  R-1:  {}'.format(accept, rminus1))
+
+        sys.exit(0)
+
+    if args.d8:
+        fpaths          = [findfile(ftype='ddp_n8_d0_lumfn', dryrun=args.dryrun, field='GALL', survey=args.survey, utier=idx) for idx in range(len(d8_limits))]
+        fpaths          = [x for x in fpaths if os.path.isfile(x)]
+
+        if len(fpaths) == 0:
+            raise  FileNotFoundError('No multi-field density tier LFs, e.g. {}, to fit;  see gen_gold_lf.py --density_split --batch.'.format(findfile(ftype='ddp_n8_d0_lumfn', dryrun=args.dryrun, field='GALL', survey=args.survey, utier=0)))
+
+        result, samples = fit_lumfn_d8(fpaths, ext=ext, phi_col=phi_col, err_col=err_col, Mcol=Mcol, jackknife=args.jackknife, nchains=args.nchains, nsteps=args.nsteps, nburn=args.nburn)
+
+        result.pprint()
+
+        opath           = findfile(ftype='ddp_n8_d0_lumfn', dryrun=args.dryrun, field='GALL', survey=args.survey, utier='all').replace('.fits', '_{}_schechter.fits'.format(ext.lower()))
+
+        print(f'Writing {opath}')
+
+        result.write(opath, format='fits', overwrite=True)
+
+        np.save(opath.replace('.fits', '_chains.npy'), samples)
+
+        sys.exit(0)
+
+    result, samples = fit_lumfn(fpath, ext=ext, phi_col=phi_col, err_col=err_col, Mcol=Mcol, jackknife=args.jackknife, nchains=args.nchains, nsteps=args.nsteps, nburn=args.nburn)
+
+    result.pprint()
+
+    opath   = fpath.replace('.fits', '_{}_schechter.fits'.format(ext.lower()))
+
+    print(f'Writing {opath}')
+
+    result.write(opath, format='fits', overwrite=True)
+
+    np.save(opath.replace('.fits', '_chains.npy'), samples)
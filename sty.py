@@ -0,0 +1,244 @@
+import numpy           as     np
+
+from   scipy.optimize  import minimize
+from   astropy.table   import Table
+from   lumfn_stepwise  import stepwise_Mcol
+
+
+ln10    = np.log(10.)
+
+# Tabulated grid of x = M - Mstar and alpha, see sty_tables.
+_sty_tables = {}
+
+def sty_shape(x, alpha):
+    '''
+    Schechter shape, phi / phistar, in x = M - Mstar.
+    '''
+    return  0.4 * ln10 * 10. ** (-0.4 * x * (1. + alpha)) * np.exp(-10. ** (-0.4 * x))
+
+def sty_tables(xmin=-6., xmax=9., dx=2.e-3, amin=-2., amax=0., da=1.e-2):
+    '''
+    Cumulative Schechter shape, C(x, alpha) = int_xmin^x phi / phistar dx', i.e. an incomplete gamma
+    function, and its alpha derivative, D(x, alpha), tabulated once per process on an (x, alpha) grid.
+    '''
+    key     = (xmin, xmax, dx, amin, amax, da)
+
+    if key not in _sty_tables:
+        xs      = np.arange(xmin, xmax + dx / 2., dx)
+        alphas  = np.arange(amin, amax + da / 2., da)
+
+        shape   = sty_shape(xs[None,:], alphas[:,None])
+        dshape  = -0.4 * ln10 * xs[None,:] * shape
+
+        # Cumulative trapezoid along x.
+        cum     = np.zeros_like(shape)
+        dcum    = np.zeros_like(shape)
+
+        cum[:,1:]  = np.cumsum(0.5 * dx * (shape[:,1:]  + shape[:,:-1]),  axis=1)
+        dcum[:,1:] = np.cumsum(0.5 * dx * (dshape[:,1:] + dshape[:,:-1]), axis=1)
+
+        _sty_tables[key] = {'XS': xs, 'ALPHAS': alphas, 'DX': dx, 'DA': da, 'C': cum, 'D': dcum}
+
+    return  _sty_tables[key]
+
+def _interp2(tables, x, alpha, grad=False):
+    '''
+    Interpolation of the tabulated C, vectorised over x (alpha a scalar):  cubic Hermite in alpha, 
+    given C & its alpha derivative D at the nodes, and linear in x.  The interpolant is continuous 
+    in its alpha derivative;  with grad, also the x and alpha derivatives of the interpolant itself,
+    such that the gradient is exact for the interpolated likelihood.
+    '''
+    xs      = tables['XS']
+    alphas  = tables['ALPHAS']
+    da      = tables['DA']
+
+    fx      = np.clip((x - xs[0]) / tables['DX'], 0., len(xs) - 1.000001)
+    fa      = np.clip((alpha - alphas[0]) / da, 0., len(alphas) - 1.000001)
+
+    ix      = fx.astype(int)
+    ia      = int(fa)
+
+    wx      = fx - ix
+    tt      = fa - ia
+
+    # Hermite basis, and its derivative in tt.
+    hs      = np.array([2. * tt**3. - 3. * tt**2. + 1., tt**3. - 2. * tt**2. + tt, -2. * tt**3. + 3. * tt**2., tt**3. - tt**2.])
+    dhs     = np.array([6. * tt**2. - 6. * tt, 3. * tt**2. - 4. * tt + 1., -6. * tt**2. + 6. * tt, 3. * tt**2. - 2. * tt])
+
+    def hermite(ii, basis):
+        return  basis[0] * tables['C'][ia, ii] + basis[1] * da * tables['D'][ia, ii] + basis[2] * tables['C'][ia + 1, ii] + basis[3] * da * tables['D'][ia + 1, ii]
+
+    lo      = hermite(ix,     hs)
+    hi      = hermite(ix + 1, hs)
+
+    result  = (1. - wx) * lo + wx * hi
+
+    if not grad:
+        return  result
+
+    dx      = (hi - lo) / tables['DX']
+    dalpha  = ((1. - wx) * hermite(ix, dhs) + wx * hermite(ix + 1, dhs)) / da
+
+    return  result, dx, dalpha
+
+def sty_lnlike(params, Ms, brights, faints, weights=None, tables=None):
+    '''
+    STY log likelihood of (Mstar, alpha) given absolute magnitudes visible in (bright, faint),
+    and its analytic gradient.
+    '''
+    Mstar, alpha = params
+
+    if tables is None:
+        tables = sty_tables()
+
+    if weights is None:
+        weights = np.ones(len(Ms))
+
+    x       = Ms - Mstar
+    xb      = brights - Mstar
+    xf      = faints  - Mstar
+
+    lnshape = np.log(0.4 * ln10) - 0.4 * ln10 * x * (1. + alpha) - 10. ** (-0.4 * x)
+
+    cf, dcf_dx, dcf_dalpha = _interp2(tables, xf, alpha, grad=True)
+    cb, dcb_dx, dcb_dalpha = _interp2(tables, xb, alpha, grad=True)
+
+    norms   = np.clip(cf - cb, 1.e-300, None)
+
+    lnlike  = np.sum(weights * (lnshape - np.log(norms)))
+
+    # d/dMstar:  dx/dMstar = -1;  normalisation derivatives are those of the interpolant.
+    dshape_dMstar = 0.4 * ln10 * (1. + alpha) - 0.4 * ln10 * 10. ** (-0.4 * x)
+    dshape_dalpha = -0.4 * ln10 * x
+
+    dnorm_dMstar  = (dcb_dx - dcf_dx) / norms
+    dnorm_dalpha  = (dcf_dalpha - dcb_dalpha) / norms
+
+    grad    = np.array([np.sum(weights * (dshape_dMstar - dnorm_dMstar)),\
+                        np.sum(weights * (dshape_dalpha - dnorm_dalpha))])
+
+    return  lnlike, grad
+
+def sty_sample(vmax, Mcol='MCOLOR_0P0', Mlims=[-23., -16.]):
+    '''
+    Magnitudes and visibility limits, clipped to Mlims, of galaxies with stepwise limits.
+    '''
+    if Mcol != stepwise_Mcol:
+        raise  ValueError(f'Stepwise limits are for {stepwise_Mcol}, not {Mcol}.')
+
+    Ms      = vmax[Mcol].data
+    brights = np.clip(vmax['STEPWISE_BRIGHTLIM_0P0'].data, Mlims[0], None)
+    faints  = np.clip(vmax['STEPWISE_FAINTLIM_0P0'].data,  None, Mlims[1])
+
+    # Limits undefined (-99) outwith the DDP redshift range, see gen_ddp_cat.py.
+    isin    = (vmax['STEPWISE_FAINTLIM_0P0'].data > -99.) & (Ms > brights) & (Ms < faints)
+
+    return  isin, Ms[isin], brights[isin], faints[isin]
+
+def sty_fit(vmax, Mcol='MCOLOR_0P0', Mlims=[-23., -16.], start=[-20.89, -1.25], isin=None):
+    '''
+    Unbinned STY maximum likelihood (Mstar, alpha) with analytic gradients (L-BFGS-B), and
+    phistar from the 1/VMAX density within Mlims.  isin optionally restricts the sample,
+    e.g. a jack knife region.
+    '''
+    tables  = sty_tables()
+
+    valid, Ms, brights, faints = sty_sample(vmax, Mcol=Mcol, Mlims=Mlims)
+
+    if isin is not None:
+        sub                    = isin[valid]
+        Ms, brights, faints    = Ms[sub], brights[sub], faints[sub]
+        valid                  = valid & isin
+
+    def nlnlike(params):
+        lnlike, grad = sty_lnlike(params, Ms, brights, faints, tables=tables)
+
+        return  -lnlike, -grad
+
+    bounds  = [(-23., -18.), (tables['ALPHAS'][0], tables['ALPHAS'][-1])]
+    result  = minimize(nlnlike, start, jac=True, method='L-BFGS-B', bounds=bounds)
+
+    Mstar, alpha = result.x
+
+    # Hessian by finite differences of the analytic gradient.
+    hs      = np.array([1.e-4, 1.e-4])
+    hess    = np.array([(nlnlike(result.x + hh * np.eye(2)[ii])[1] - nlnlike(result.x - hh * np.eye(2)[ii])[1]) / (2. * hh) for ii, hh in enumerate(hs)])
+    hess    = 0.5 * (hess + hess.T)
+
+    try:
+        errs = np.sqrt(np.diag(np.linalg.inv(hess)))
+
+    except np.linalg.LinAlgError:
+        errs = np.array([np.nan, np.nan])
+
+    # phistar:  number density in Mlims over the shape integral.
+    inwindow = (vmax[Mcol].data >= Mlims[0]) & (vmax[Mcol].data <= Mlims[1])
+
+    if isin is not None:
+        inwindow &= isin
+
+    density  = np.sum(1. / vmax['VMAX'].data[inwindow])
+    shape    = _interp2(tables, np.array([Mlims[1] - Mstar]), alpha)[0] - _interp2(tables, np.array([Mlims[0] - Mstar]), alpha)[0]
+
+    return  {'MSTAR': Mstar, 'MSTAR_ERR': errs[0], 'ALPHA': alpha, 'ALPHA_ERR': errs[1], 'LOG10PHISTAR': np.log10(density / shape),\
+             'NGAL': len(Ms), 'LNLIKE': -result.fun, 'SUCCESS': bool(result.success)}
+
+def sty_jackknife(vmax, ids, nregion, Mcol='MCOLOR_0P0', Mlims=[-23., -16.]):
+    '''
+    STY fit of each jack knife realisation, i.e. all but one region of resample.assign_regions.
+    '''
+    rows    = []
+
+    for ii in range(nregion):
+        fit = sty_fit(vmax, Mcol=Mcol, Mlims=Mlims, isin=(ids != ii))
+
+        rows.append([ii, fit['MSTAR'], fit['ALPHA'], fit['LOG10PHISTAR'], fit['NGAL']])
+
+    result  = Table(np.array(rows), names=['JK', 'MSTAR', 'ALPHA', 'LOG10PHISTAR', 'NGAL'])
+    result.meta['EXTNAME'] = 'STY_JK'
+
+    return  result
+
+def sty_meta(lumfn, fit, prefix='STY'):
+    '''
+    Record an STY fit in the header of a LF table.
+    '''
+    for key in ['MSTAR', 'MSTAR_ERR', 'ALPHA', 'ALPHA_ERR', 'LOG10PHISTAR', 'NGAL']:
+        lumfn.meta[f'{prefix}_{key}'] = fit[key]
+
+    return  lumfn
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from   findfile      import findfile, fetch_fields
+    from   delta8_limits import d8_limits
+    from   resample      import percentile_regions, assign_regions
+
+    parser  = argparse.ArgumentParser(description='Unbinned STY Schechter fit of each density tier vmax catalogue.')
+    parser.add_argument('--survey',    help='Select survey', default='gama')
+    parser.add_argument('--dryrun',    action='store_true', help='dryrun.')
+    parser.add_argument('--Mcol',      help='Abs. mag. definition.', default='MCOLOR_0P0')
+    parser.add_argument('--jackknife', help='Fit each jack knife realisation.', action='store_true')
+    parser.add_argument('--ndiv',      help='Jack knife regions per side, per field.', default=2, type=int)
+
+    args    = parser.parse_args()
+
+    for field in fetch_fields(args.survey):
+        for tier in range(len(d8_limits)):
+            fpath = findfile('ddp_n8_d0_vmax', dryrun=args.dryrun, field=field, utier=tier, survey=args.survey)
+            vmax  = Table.read(fpath)
+
+            fit   = sty_fit(vmax, Mcol=args.Mcol)
+
+            print('{} d{}:  Mstar={:.3f} +- {:.3f}, alpha={:.3f} +- {:.3f}, log10phistar={:.3f} ({:d} galaxies)'.format(field, tier, fit['MSTAR'], fit['MSTAR_ERR'], fit['ALPHA'], fit['ALPHA_ERR'], fit['LOG10PHISTAR'], fit['NGAL']))
+
+            if args.jackknife:
+                regions = percentile_regions(vmax['RA'].data, vmax['DEC'].data, ndiv=args.ndiv)
+                ids     = assign_regions(vmax['RA'].data, vmax['DEC'].data, regions)
+
+                result  = sty_jackknife(vmax, ids, regions['NREGION'], Mcol=args.Mcol)
+                result.pprint()
+
+                print('Jack knife error:  Mstar {:.3f}, alpha {:.3f}'.format(np.sqrt(len(result) - 1.) * np.std(result['MSTAR']), np.sqrt(len(result) - 1.) * np.std(result['ALPHA'])))
@@ -16,10 +16,13 @@ def customise_script(args, debug=False):
 
     supported  = ['gold_pipeline',\
                   'gold_d8_pipeline',\
+                  'rand_field_pipeline',\
                   'rand_pipeline',\
+                  'rand_ddp1_field_pipeline',\
                   'rand_d8_pipeline',\
                   'rand_ddp1_d8_pipeline',\
-                  'rand_ddp1_pipeline']
+                  'rand_ddp1_pipeline',\
+                  'packed_pipeline']
 
     if script == None:
         for script in supported:
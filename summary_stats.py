@@ -8,7 +8,7 @@ from   astropy.io    import ascii
 from   astropy.table import Table
 from   ddp           import tmr_DDP1, tmr_DDP2, tmr_DDP3
 from   delta8_limits import delta8_tier, d8_limits
-from   findfile      import findfile, fetch_header
+from   findfile      import findfile, fetch_header, fetch_partition
 
 
 parser = argparse.ArgumentParser(description='Generate Summary Stats')
@@ -87,8 +87,7 @@ for idx in np.arange(9):
     
     for field in ['G9', 'G12', 'G15']:        
         # Number of galaxies in each density tier (across fields). 
-        fpath = findfile(ftype='ddp_n8_d0', survey=survey, field=field, utier=idx)
-        dat   = Table.read(fpath)
+        dat   = fetch_partition('ddp_n8_d0', field, idx, survey=survey, columns=['ZSURV'])
                 
         nd8  += len(dat) / 1.e3
 
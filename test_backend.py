@@ -0,0 +1,180 @@
+import os
+import pytest
+import numpy         as np
+
+from   astropy.table import Table
+from   findfile      import findfile, write_desitable, read_desitable, fetch_meta, convert_desitable, backends, flush_writes, write_partitioned, read_partition, stage_hash, repo_modules
+
+
+def _dependency(backend):
+    if backend == 'parquet':
+        # astropy parquet reads require pandas.
+        pytest.importorskip('pyarrow')
+        pytest.importorskip('pandas')
+
+    elif backend == 'hdf5':
+        pytest.importorskip('h5py')
+
+def _table():
+    table                 = Table()
+    table['ZSURV']        = np.linspace(0.01, 0.5, 10)
+    table['FIELD']        = ['G9', 'G12'] * 5
+    table['DDP']          = np.arange(30, dtype=np.int32).reshape(10, 3)
+    table['IN_D8LUMFN']   = np.zeros(10, dtype=np.int32)
+    table.meta['AREA']    = 180.
+    table.meta['SURVEY']  = 'GAMA'
+
+    return  table
+
+@pytest.mark.parametrize('backend', list(backends.keys()))
+def test_roundtrip(backend, tmp_path):
+    _dependency(backend)
+
+    table = _table()
+    opath = str(tmp_path / ('gama_gold_ddp' + backends[backend]))
+
+    write_desitable(opath, table, inhash='0123456789abcdef')
+
+    result = read_desitable(opath)
+
+    assert result.colnames == table.colnames
+
+    for col in table.colnames:
+        assert np.all(result[col] == table[col])
+
+    assert result.meta['AREA']   == table.meta['AREA']
+    assert result.meta['SURVEY'] == 'GAMA'
+    assert result.meta['INHASH'] == '0123456789abcdef'
+
+    assert fetch_meta(opath)['INHASH'] == '0123456789abcdef'
+    assert fetch_meta(opath)['AREA']   == table.meta['AREA']
+
+@pytest.mark.parametrize('backend', list(backends.keys()))
+def test_projection(backend, tmp_path):
+    _dependency(backend)
+
+    opath  = str(tmp_path / ('gama_gold_ddp' + backends[backend]))
+
+    write_desitable(opath, _table())
+
+    result = read_desitable(opath, columns=['ZSURV', 'DDP'])
+
+    assert result.colnames == ['ZSURV', 'DDP']
+    assert result['DDP'].shape == (10, 3)
+    assert result.meta['AREA'] == 180.
+
+@pytest.mark.parametrize('backend', ['parquet', 'hdf5'])
+def test_convert(backend, tmp_path):
+    _dependency(backend)
+
+    table  = _table()
+    fpath  = str(tmp_path / 'gama_gold_ddp.fits')
+
+    write_desitable(fpath, table)
+
+    opath  = convert_desitable(fpath, backend, remove=True)
+
+    assert opath.endswith(backends[backend])
+    assert not os.path.isfile(fpath)
+
+    result = read_desitable(convert_desitable(opath, 'fits'))
+
+    for col in table.colnames:
+        assert np.all(result[col] == table[col])
+
+def test_findfile(monkeypatch):
+    monkeypatch.setenv('GOLD_BACKEND', 'parquet')
+
+    assert findfile(ftype='ddp', survey='gama').endswith('.parquet')
+    assert findfile(ftype='ddp', survey='gama', backend='fits').endswith('.fits')
+    assert findfile(ftype='ddp', survey='gama', log=True).endswith('.log')
+
+    # Final deliverables remain FITS.
+    assert findfile(ftype='ddp_n8_d0_lumfn', survey='gama', field='G9', utier=0).endswith('.fits')
+
+def test_stage_hash(tmp_path):
+    # Imported repo modules, e.g. findfile, enter the code hash.
+    assert any(x.endswith('/findfile.py') for x in repo_modules())
+
+    fpath  = str(tmp_path / 'gama_gold_ddp.fits')
+
+    write_desitable(fpath, _table())
+
+    argv   = ['gen_ddp_n8.py', '--dryrun']
+    inhash = stage_hash(inputs=[fpath], argv=argv)
+
+    assert inhash == stage_hash(inputs=[fpath], argv=argv + ['--nooverwrite'])
+    assert inhash != stage_hash(inputs=[fpath], argv=argv, params={'fillfactor_threshold': 0.9})
+
+def test_stage_hash_config(tmp_path):
+    # fillfactor (& randoms) import params, for sphere_radius (oversample_nrealisations);  not fillfactor_threshold.
+    import fillfactor
+    import randoms
+
+    from   params import sphere_radius
+
+    assert not any(x.endswith('/params.py') for x in repo_modules())
+
+    fpath  = str(tmp_path / 'randoms_G9_x2_1.fits')
+
+    write_desitable(fpath, _table())
+
+    argv   = ['fillfactor.py', '--field', 'G9', '--realz', '1']
+    ppath  = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'params.py')
+
+    with open(ppath, 'r') as ff:
+        source = ff.read()
+
+    inhash = stage_hash(inputs=[fpath], argv=argv, params={'sphere_radius': sphere_radius})
+
+    try:
+        with open(ppath, 'w') as ff:
+            ff.write(source.replace('fillfactor_threshold     = 0.90', 'fillfactor_threshold     = 0.80'))
+
+        assert inhash == stage_hash(inputs=[fpath], argv=argv, params={'sphere_radius': sphere_radius})
+
+    finally:
+        with open(ppath, 'w') as ff:
+            ff.write(source)
+
+    assert inhash != stage_hash(inputs=[fpath], argv=argv, params={'sphere_radius': 2. * sphere_radius})
+
+def test_background(tmp_path):
+    opaths = [str(tmp_path / f'gama_gold_ddp_n8_d0_{ii}.fits') for ii in range(4)]
+
+    for opath in opaths:
+        write_desitable(opath, _table(), inhash='0123456789abcdef', background=True)
+
+    flush_writes()
+
+    for opath in opaths:
+        assert read_desitable(opath).meta['INHASH'] == '0123456789abcdef'
+        assert (os.stat(opath).st_mode & 0o777) == 0o700
+
+    with pytest.raises(Exception):
+        write_desitable(str(tmp_path / 'missing' / 'gama_gold_ddp.fits'), _table(), background=True)
+
+        flush_writes()
+
+def test_partition(tmp_path):
+    table                     = _table()
+    table['DDP1_DELTA8_TIER'] = np.arange(10) % 3
+
+    opath  = str(tmp_path / 'gama_gold_ddp_n8_d0_parts.fits')
+
+    write_partitioned(opath, table, keys=['DDP1_DELTA8_TIER', 'FIELD'], part_cols={(1, 'G9'): {'AREA': 60.}})
+
+    part   = read_partition(opath, DDP1_DELTA8_TIER=1, FIELD='G9')
+
+    assert np.all(part['DDP1_DELTA8_TIER'] == 1) & np.all(part['FIELD'] == 'G9')
+    assert len(part) == np.count_nonzero((table['DDP1_DELTA8_TIER'] == 1) & (table['FIELD'] == 'G9'))
+    assert part.meta['AREA'] == 60.
+
+    # Missing partition, and an empty DATA extension.
+    assert read_partition(opath, columns=['ZSURV'], DDP1_DELTA8_TIER=8, FIELD='G9').colnames == ['ZSURV']
+
+    write_partitioned(opath, table[:0], keys=['DDP1_DELTA8_TIER', 'FIELD'])
+
+    empty  = read_partition(opath, DDP1_DELTA8_TIER=1, FIELD='G9')
+
+    assert (len(empty) == 0) & ('ZSURV' in empty.colnames)
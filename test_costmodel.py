@@ -0,0 +1,178 @@
+import os
+import json
+import stat
+import numpy     as np
+
+from   dag       import pipeline_jobs, run_local, run_packed, submit_jobs
+from   costmodel import write_job_report, load_reports, calibrate, predict, sbatch_resources, pack_jobs, parse_sacct
+
+
+def _reports(jobs, scale=1.e-4):
+    # wall time linear in rows, inverse in nproc.
+    for job, nrows, nproc in zip(jobs, [1.e5, 1.e6, 1.e7], [4, 16, 8]):
+        write_job_report(job, scale * nrows / nproc, 1.e-3 * nrows, features={'NROWS': nrows, 'NPROC': nproc})
+
+def _stub_sbatch(tmp_path):
+    bindir = tmp_path / 'stub'
+    bindir.mkdir()
+
+    sbatch = bindir / 'sbatch'
+    sbatch.write_text('#!/bin/bash\necho "$@" >> {}/sbatch.log\necho $(( $(wc -l < {}/sbatch.log) + 100 ))\n'.format(tmp_path, tmp_path))
+    sbatch.chmod(sbatch.stat().st_mode | stat.S_IEXEC)
+
+    return  str(bindir)
+
+def _fake_scripts(tmp_path, scripts):
+    bindir = tmp_path / 'fake'
+    bindir.mkdir()
+
+    for name, body in scripts.items():
+        script = bindir / name
+        script.write_text('#!/bin/bash\n' + body + '\n')
+        script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+    return  str(bindir)
+
+def test_calibrate(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+
+    jobs  = [job for job in pipeline_jobs(['G9'], nrealisations=3) if job['script'] == 'rand_pipeline']
+
+    _reports(jobs)
+
+    assert len(load_reports('rand_pipeline')) == 3
+
+    fit   = calibrate(['rand_pipeline'])['rand_pipeline']
+
+    assert np.allclose(fit['WALL_S']['COEFFS'], [np.log(1.e-4), 1., -1.])
+    assert np.allclose(fit['PEAK_RSS_MB']['COEFFS'][1:], [1., 0.], atol=1.e-6)
+
+    cost  = predict(jobs[0], features={'NROWS': 2.e6, 'NPROC': 4})
+
+    assert np.isclose(cost['WALL_S'], 1.5 * 1.e-4 * 2.e6 / 4)
+
+    # No past runs:  the #SBATCH defaults.
+    gold  = [job for job in pipeline_jobs(['G9']) if job['script'] == 'gold_d8_pipeline'][0]
+
+    assert sbatch_resources(gold)['mem'] == '50G'
+
+def test_pack(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+
+    jobs   = pipeline_jobs(['G9', 'G12'], dryrun='--dryrun', nrealisations=4, stages=['rand', 'rand_d8'])
+
+    _reports([job for job in jobs if job['script'] == 'rand_pipeline'], scale=1.e-6)
+
+    packed = pack_jobs(jobs)
+    names  = [job['name'] for job in packed]
+
+    # Realisations depend on the (unpacked, by default long) job of their field.
+    assert names == ['rand_field_pipeline_G9', 'rand_pipeline_packed0', 'rand_field_pipeline_G12', 'rand_pipeline_packed1', 'rand_d8_pipeline_G9', 'rand_d8_pipeline_G12']
+    assert len(packed[1]['members']) == 4
+
+    assert packed[1]['deps'] == ['rand_field_pipeline_G9']
+    assert packed[4]['deps'] == ['rand_pipeline_packed0']
+    assert os.path.isfile(packed[1]['env']['PACKED'])
+
+def test_submit(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+    monkeypatch.setenv('PATH', _stub_sbatch(tmp_path) + ':' + os.environ['CODE_ROOT'] + '/bin/:' + os.environ['PATH'])
+
+    jobs   = pipeline_jobs(['G9', 'G12', 'G15'], dryrun='--dryrun', nrealisations=4)
+
+    _reports([job for job in jobs if job['script'] == 'rand_pipeline'], scale=1.e-6)
+
+    jobids = submit_jobs(jobs, use_sbatch=1)
+    calls  = (tmp_path / 'sbatch.log').read_text().strip().split('\n')
+
+    assert len(calls) == len(jobids) < len(jobs)
+    assert all(('--mem=' in call) & ('--time=' in call) for call in calls)
+
+    # Packed randoms are short, the (default) d8 stages are not.
+    assert '--time=00:10:00' in [call for call in calls if 'rand_pipeline_packed0' in call][0]
+    assert '--mem=120G' in [call for call in calls if 'rand_d8_pipeline_G9' in call][0]
+
+    assert '--dependency=afterok:{},{} '.format(jobids['gold_pipeline'], jobids['rand_pipeline_packed0']) in [call for call in calls if 'rand_d8_pipeline_G9' in call][0]
+
+    with open(tmp_path / 'logs' / 'jobs' / 'submitted.json', 'r') as ff:
+        assert len(json.load(ff)) == len(jobids)
+
+def test_array(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+    monkeypatch.setenv('SBATCH_SHIM_RUN', '1')
+
+    ran    = tmp_path / 'ran.txt'
+    fake   = _fake_scripts(tmp_path, {'rand_field_pipeline': f'echo $FIELD body >> {ran}', 'rand_pipeline': f'echo $FIELD $SLURM_ARRAY_TASK_ID >> {ran}', 'rand_d8_pipeline': f'echo $FIELD d8 >> {ran}'})
+
+    monkeypatch.setenv('PATH', os.environ['CODE_ROOT'] + '/bin/shim/:' + fake + ':' + os.environ['CODE_ROOT'] + '/bin/:' + os.environ['PATH'])
+
+    jobs   = pipeline_jobs(['G9', 'G12'], dryrun='--dryrun', nrealisations=3, stages=['rand', 'rand_d8'])
+    jobids = submit_jobs(jobs, use_sbatch=1, array=True)
+    calls  = (tmp_path / 'logs' / 'shim' / 'sbatch.log').read_text().strip().split('\n')
+
+    assert list(jobids) == ['rand_field_pipeline_G9', 'rand_pipeline_G9', 'rand_field_pipeline_G12', 'rand_pipeline_G12', 'rand_d8_pipeline_G9', 'rand_d8_pipeline_G12']
+    assert '--array=0-2 ' in [call for call in calls if 'rand_pipeline_G9' in call][0]
+    assert '--dependency=afterok:{} '.format(jobids['rand_field_pipeline_G9']) in [call for call in calls if 'rand_pipeline_G9' in call][0]
+    assert '--dependency=afterok:{} '.format(jobids['rand_pipeline_G9']) in [call for call in calls if 'rand_d8_pipeline_G9' in call][0]
+
+    # Run by the shim, in order.
+    assert ran.read_text().split('\n')[:-1] == ['G9 body', 'G9 0', 'G9 1', 'G9 2', 'G12 body', 'G12 0', 'G12 1', 'G12 2', 'G9 d8', 'G12 d8']
+
+def test_node(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+    monkeypatch.setenv('PATH', os.environ['CODE_ROOT'] + '/bin/shim/:' + os.environ['CODE_ROOT'] + '/bin/:' + os.environ['PATH'])
+
+    jobs   = pipeline_jobs(['G9'], dryrun='--dryrun', nrealisations=4, stages=['rand', 'rand_d8'])
+    jobids = submit_jobs(jobs, use_sbatch=1, per_node=2)
+    calls  = (tmp_path / 'logs' / 'shim' / 'sbatch.log').read_text().strip().split('\n')
+
+    assert list(jobids) == ['rand_field_pipeline_G9', 'rand_pipeline_G9_node0', 'rand_pipeline_G9_node1', 'rand_d8_pipeline_G9']
+    assert '--cpus-per-task=8 ' in [call for call in calls if 'rand_pipeline_G9_node0' in call][0]
+    assert '--dependency=afterok:{},{} '.format(jobids['rand_pipeline_G9_node0'], jobids['rand_pipeline_G9_node1']) in calls[-1]
+
+    # Members of a node job run concurrently.
+    times  = tmp_path / 'times.txt'
+    fake   = _fake_scripts(tmp_path, {'rand_pipeline': f'echo $REALZ $(date +%s.%N) >> {times}; sleep 1; echo $REALZ $(date +%s.%N) >> {times}'})
+    ppath  = str(tmp_path / 'logs' / 'jobs' / 'packed' / 'rand_pipeline_G9_node0.json')
+
+    with open(ppath, 'r') as ff:
+        members = json.load(ff)
+
+    with open(ppath, 'w') as ff:
+        json.dump([dict(job, script=fake + '/rand_pipeline') for job in members], ff)
+
+    assert run_packed(ppath, ncores=8) == 0
+
+    stamps = np.loadtxt(times)
+
+    assert sorted(stamps[:2,0]) == [0., 1.]
+    assert stamps[:2,1].max() < stamps[2:,1].min()
+
+def test_run_local(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+
+    script = tmp_path / 'rand_pipeline'
+    script.write_text('#!/bin/bash\npython3 -c "import numpy as np; x = np.ones(int(5.e7)); print(x.sum())"\n')
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+    jobs   = [dict(job, script=str(script)) for job in pipeline_jobs(['G9'], nrealisations=1, stages=['rand'])]
+    state  = run_local(jobs, ncores=4, mem=16., poll=0.1)
+
+    assert state == {'rand_field_pipeline_G9': 'DONE', 'rand_pipeline_G9_0': 'DONE'}
+
+    report = load_reports()[0]
+
+    # 400MB array.
+    assert report['PEAK_RSS_MB'] > 400.
+
+def test_run_local_oserror(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+
+    jobs   = [dict(job, script=str(tmp_path / 'missing')) for job in pipeline_jobs(['G9'], nrealisations=1, stages=['rand'])]
+    state  = run_local(jobs, ncores=4, mem=16., poll=0.1)
+
+    assert state == {'rand_field_pipeline_G9': 'FAILED', 'rand_pipeline_G9_0': 'SKIPPED'}
+
+def test_sacct():
+    assert parse_sacct('1-01:00:05', '2G') == (90005., 2.e3)
+    assert parse_sacct('05:30', '1024K') == (330., 1.024)
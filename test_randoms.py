@@ -0,0 +1,17 @@
+from   randoms import sampling_seed
+
+
+def test_sampling_seed():
+    # Body & oversampled seeds of the default, single call:  seed + realz + 50 * oversample, and twice that.
+    for realz in range(4):
+        assert  sampling_seed(0,  realz, 2)                   == realz + 100
+        assert  sampling_seed(0,  realz, 2, oversampled=True) == 2 * realz + 200
+        assert  sampling_seed(10, realz, 4, oversampled=True) == 10 + 2 * realz + 400
+
+    # Body and oversampled randoms are independent, as are realizations.
+    seeds = [sampling_seed(0, realz, 2, oversampled=True) for realz in range(4)] + [sampling_seed(0, 0, 2)]
+
+    assert  len(set(seeds)) == len(seeds)
+
+    # No oversampling, no independent realizations.
+    assert  sampling_seed(7, 3, 1) == sampling_seed(7, 3, 1, oversampled=True) == 7
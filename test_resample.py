@@ -0,0 +1,61 @@
+import numpy         as np
+
+from   astropy.table import Table, vstack
+from   lumfn         import lumfn
+from   resample      import solve_regions, assign_regions, resample_lumfn, jackknife_weights, bootstrap_weights, resample_tier_volfracs, resample_mean
+
+
+def _vmax(ngal=4000, seed=314):
+    rng                    = np.random.default_rng(seed)
+
+    vmax                   = Table()
+    vmax['RA']             = rng.uniform(129., 141., ngal)
+    vmax['DEC']            = rng.uniform(-2., 3., ngal)
+    vmax['MCOLOR_0P0']     = rng.uniform(-23., -16., ngal)
+    vmax['VMAX']           = rng.uniform(1.e5, 1.e6, ngal)
+    vmax.meta['FORCE_VOL'] = 1.e6
+
+    return  vmax
+
+def _brute(vmax, ids, weights):
+    # Each realisation as lumfn of the regions' members, repeated by their weight, with the volume of those regions.
+    nregion = len(weights)
+    sub     = vstack([vmax[ids == ii] for ii in range(nregion) for _ in range(int(weights[ii]))])
+
+    sub['VMAX'] *= np.sum(weights) / nregion
+
+    return  lumfn(sub)['PHI_IVMAX'].data
+
+def test_resample_lumfn():
+    vmax    = _vmax()
+
+    for kind in ['percentile', 'kmeans']:
+        regions = solve_regions(vmax['RA'].data, vmax['DEC'].data, kind=kind, ndiv=2)
+        ids     = assign_regions(vmax['RA'].data, vmax['DEC'].data, regions)
+        nregion = regions['NREGION']
+
+        assert  np.all((ids >= 0) & (ids < nregion))
+
+        for name, weights in zip(['JK', 'BOOT'], [jackknife_weights(nregion), bootstrap_weights(nregion, nboot=5)]):
+            result, volfracs = resample_lumfn(vmax, ids, nregion, weights, kind=name)
+
+            for ii, ws in enumerate(weights):
+                assert  np.allclose(result[f'PHI_IVMAX_{name}_REALZ'][:,ii], _brute(vmax, ids, ws))
+
+def test_resample_tiers():
+    rng     = np.random.default_rng(314)
+
+    ids     = rng.integers(0, 4, 10000)
+    tiers   = rng.integers(0, 3, 10000)
+    d8s     = rng.normal(size=10000)
+
+    weights = jackknife_weights(4)
+
+    volfracs = resample_tier_volfracs(ids, tiers, 4, 3, weights)
+    means    = resample_mean(ids, d8s, 4, weights, bins=tiers, nbin=3)
+
+    for ii in range(4):
+        isin = (ids != ii)
+
+        assert  np.allclose(volfracs[ii], [np.mean(tiers[isin] == tt) for tt in range(3)])
+        assert  np.allclose(means[ii],    [np.mean(d8s[isin & (tiers == tt)]) for tt in range(3)])
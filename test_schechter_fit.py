@@ -0,0 +1,114 @@
+import os
+import sys
+import subprocess
+import numpy           as np
+
+from   astropy.table   import Table
+from   schechter       import schechter, tmr_d8_coeffs, ref_schechter
+from   data.schechters import schechters
+from   findfile        import findfile
+from   lumfn           import lumfn
+from   resample        import solve_regions, assign_regions
+from   gen_gold_lf     import tier_jackknife, write_lumfn
+
+
+def test_fit_lumfn_cli(tmp_path):
+    tmr                      = schechters['TMR']
+
+    Ms                       = np.linspace(-23., -16., 36)
+
+    lumfn                    = Table()
+    lumfn['MEDIAN_M']        = Ms
+    lumfn['PHI_IVMAX']       = schechter(Ms, 10.**tmr['log10phistar'], tmr['Mstar'], tmr['alpha'])
+    lumfn['PHI_IVMAX_ERROR'] = 1.e-2 * lumfn['PHI_IVMAX']
+    lumfn['N']               = 100
+    lumfn.meta['EXTNAME']    = 'LUMFN'
+
+    fpath                    = str(tmp_path / 'gama_gold_lumfn.fits')
+
+    lumfn.write(fpath)
+
+    cmd    = [sys.executable, 'schechter_fit.py', '--fpath', fpath, '--nchains', '4', '--nsteps', '600', '--nburn', '200']
+
+    subprocess.run(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True)
+
+    result = Table.read(fpath.replace('.fits', '_lumfn_schechter.fits'))
+
+    assert list(result['PARAM']) == ['log10phistar', 'Mstar', 'alpha']
+    assert np.allclose(result['ML'], [tmr['log10phistar'], tmr['Mstar'], tmr['alpha']], atol=0.05)
+    assert np.all(np.isfinite(result['MEAN'])) & np.all(np.isfinite(result['STD']))
+    assert result.meta['NBURN'] == 200
+
+    # No samples after burn-in.
+    cmd[-4:] = ['--nsteps', '200', '--nburn', '200']
+
+    assert subprocess.run(cmd, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True).returncode != 0
+
+def _tier_vmax(d8, rng, vol=1.e6, Mcols=['MCOLOR_0P0', 'MALL_0P0']):
+    # Toy (multi-field) vmax catalogue of a density tier, sampled from the TMR d8 Schechter at constant VMAX.
+    ld8          = np.log10(1. + d8)
+    Ms           = np.linspace(-23., -16., 36)
+    dM           = np.diff(Ms)[0]
+
+    phis         = schechter(Ms + dM / 2., 10.**(tmr_d8_coeffs['log10phistar0'] + tmr_d8_coeffs['dlog10phistar'] * ld8), tmr_d8_coeffs['Mstar0'] + tmr_d8_coeffs['dMstar'] * ld8, tmr_d8_coeffs['alpha'])
+    ns           = rng.poisson(phis * vol * dM)
+
+    vmax         = Table()
+    vmax['RA']   = rng.uniform(129., 141., np.sum(ns))
+    vmax['DEC']  = rng.uniform(-2., 3., np.sum(ns))
+
+    for xx in Mcols:
+        vmax[xx] = np.repeat(Ms, ns) + rng.uniform(0., dM, np.sum(ns))
+
+    vmax['VMAX'] = vol
+    vmax.meta['FORCE_VOL'] = vol
+
+    return  vmax
+
+def test_fit_lumfn_d8_jackknife_cli(tmp_path, monkeypatch):
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path))
+
+    rng      = np.random.default_rng(314)
+    Mcols    = ['MCOLOR_0P0', 'MALL_0P0']
+
+    rand     = Table()
+    rand['RANDOM_RA']  = rng.uniform(129., 141., 20000)
+    rand['RANDOM_DEC'] = rng.uniform(-2., 3., 20000)
+
+    regions  = solve_regions(rand['RANDOM_RA'].data, rand['RANDOM_DEC'].data, kind='kmeans', nregion=6)
+    rand_ids = assign_regions(rand['RANDOM_RA'].data, rand['RANDOM_DEC'].data, regions)
+
+    # Tier LFs written as density_split_batch --jackknife.
+    for idx, d8 in zip([2, 5, 8], [-0.5, 0.5, 3.]):
+        vmax  = _tier_vmax(d8, rng, Mcols=Mcols)
+        lf    = lumfn(vmax, Mcol=Mcols, d8=d8)
+
+        lf   += tier_jackknife(lf, vmax, regions, rand_ids, Mcols)
+
+        write_lumfn(findfile(ftype='ddp_n8_d0_lumfn', dryrun=True, field='GALL', survey='gama', utier=idx), lf, [], ref_schechter(d8=d8))
+
+    root   = os.path.dirname(os.path.abspath(__file__))
+    cmd    = [sys.executable, 'schechter_fit.py', '--d8', '--jackknife', '--dryrun', '--ext', 'LUMFN_MALL_0P0', '--nchains', '4', '--nsteps', '600', '--nburn', '200']
+
+    subprocess.run(cmd, cwd=root, check=True, capture_output=True)
+
+    opath  = findfile(ftype='ddp_n8_d0_lumfn', dryrun=True, field='GALL', survey='gama', utier='all').replace('.fits', '_lumfn_mall_0p0_schechter.fits')
+    result = Table.read(opath)
+
+    assert result.meta['JK_COV'] & (result.meta['NTIER'] == 3)
+    assert np.all(np.isfinite(result['MEAN']))
+    assert np.allclose(result['ML'], result['TMR'], atol=0.3)
+
+    # Single tier, with the jack knife covariance of the same abs. mag. definition.
+    fpath  = findfile(ftype='ddp_n8_d0_lumfn', dryrun=True, field='GALL', survey='gama', utier=5)
+
+    subprocess.run([sys.executable, 'schechter_fit.py', '--fpath', fpath, '--jackknife', '--ext', 'LUMFN_MALL_0P0', '--nchains', '4', '--nsteps', '600', '--nburn', '200'], cwd=root, check=True, capture_output=True)
+
+    assert Table.read(fpath.replace('.fits', '_lumfn_mall_0p0_schechter.fits')).meta['JK_COV']
+
+    # No tier LFs.
+    monkeypatch.setenv('GOLD_DIR', str(tmp_path / 'empty'))
+
+    error  = subprocess.run(cmd, cwd=root, capture_output=True, text=True)
+
+    assert (error.returncode != 0) & ('No multi-field density tier LFs' in error.stderr)
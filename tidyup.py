@@ -4,6 +4,8 @@ import yaml
 
 from   findfile import file_check, findfile, fetch_header, supported
 from   config   import smart_open, CustomDumper
+from   runtime  import aggregate_reports
+from   perf_history import track_run
 
 def diagnose():
    result = fetch_header(allsupported=True)
@@ -26,6 +28,11 @@ def summary(fpath=None):
 def tidyup():
     summary()
 
+    rpath = aggregate_reports()
+
+    # Compare to the rolling baseline of previous runs.
+    track_run(rpath)
+
 if __name__ == '__main__':
    tidyup()
 
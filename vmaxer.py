@@ -4,7 +4,7 @@ from   astropy.table   import Table, vstack
 from   cosmo           import volcom
 from   bitmask         import lumfn_mask, consv_mask, update_bit
 from   volfracs        import volfracs
-from   findfile        import findfile, fetch_fields, write_desitable
+from   findfile        import findfile, fetch_fields, write_desitable, read_desitable
 from   params          import fillfactor_threshold
 from   volfracs        import eval_volavg_fillfactor
 
@@ -13,7 +13,7 @@ def vmaxer_rand(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='
     fields = fetch_fields(survey=survey)
 
     rpaths = [findfile(ftype=ftype, dryrun=dryrun, field=ff, survey=survey, prefix=prefix) for ff in fields]
-    rand   = vstack([Table.read(xx) for xx in rpaths])
+    rand   = vstack([read_desitable(xx) for xx in rpaths])
 
     update_bit(rand['IN_D8LUMFN'], lumfn_mask, 'FILLFACTOR', rand['FILLFACTOR'].data < fillfactor_threshold)
     
@@ -38,15 +38,18 @@ def vmaxer_rand(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='
 
     return  rand
 
-def vmaxer(dat, zmin, zmax, extra_cols=[], fillfactor=True, bitmasks=['IN_D8LUMFN'], tier=None):
+def vmaxer(dat, zmin, zmax, extra_cols=[], fillfactor=True, bitmasks=['IN_D8LUMFN'], tier=None, index=None):
     assert  dat['ZSURV'].min() <= zmin
     assert  dat['ZSURV'].max() >= zmax
 
-    # Columns to be propagated
-    extra_cols += ['FIELD', 'MALL_0P0', 'MCOLOR_0P0', 'FIELD', 'IN_D8LUMFN', 'RA', 'DEC', 'DDPMALL_0P0']
+    # Columns to be propagated;  a copy, as the default (or a caller's list) is shared across calls.
+    extra_cols  = list(extra_cols) + ['FIELD', 'MALL_0P0', 'MCOLOR_0P0', 'FIELD', 'IN_D8LUMFN', 'RA', 'DEC', 'DDPMALL_0P0']
     extra_cols += ['FILLFACTOR', 'REST_GMR_0P1_INDEX']
 
 
+    if 'MQZERO_0P0' in dat.dtype.names:
+        extra_cols += ['MQZERO_0P0']
+
     if 'STEPWISE_BRIGHTLIM_0P0' in dat.dtype.names:
         extra_cols += ['STEPWISE_BRIGHTLIM_0P0', 'STEPWISE_FAINTLIM_0P0']
 
@@ -111,7 +114,8 @@ def vmaxer(dat, zmin, zmax, extra_cols=[], fillfactor=True, bitmasks=['IN_D8LUMF
                                                             dryrun=False,\
                                                             prefix='randoms_ddp1',\
                                                             write=False,\
-                                                            tier=tier)
+                                                            tier=tier,\
+                                                            index=index)
 
         result['VZ']   *= result['FILLFACTOR_VMAX']
         result['VMAX'] *= result['FILLFACTOR_VMAX']
@@ -1,74 +1,236 @@
+import os
+import fitsio
 import numpy             as     np
 import runtime
 
-from   delta8_limits     import d8_limits
+from   delta8_limits     import d8_limits, delta8_tier_edges
 from   params            import fillfactor_threshold
 from   scipy.interpolate import interp1d
 from   cosmo             import volcom
 from   ddp_zlimits       import ddp_zlimits
 from   astropy.table     import Table, vstack
-from   findfile          import findfile, fetch_fields, gather_cat
+from   findfile          import findfile, fetch_fields, gather_cat, read_desitable
 from   ddp               import tmr_DDP1
 
 
-def volavg_fillfactor(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1', write=False, tier=None, pprint=False, self_count=False):
-    print(f'\n\nSolving volume average fillfactor with self_count: {self_count}.')
+# Per-process cache of randoms effective-volume indices; see volavg_index.
+_volavg_indices = {}
+
+# Columns of the randoms retained by the volume average fillfactor index.
+_volavg_cols    = ['Z', 'FILLFACTOR', 'DDP1_DELTA8_TIER', 'DDP1_DELTA8_TIER_ZEROPOINT', 'DDP1_DELTA8', 'DDP1_DELTA8_ZEROPOINT']
+
+def volavg_index(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1', rand=None, threshold=fillfactor_threshold, cache=True):
+    '''
+    Index of the (multi-field) randoms sorted by Z.  For a given mask (fillfactor cut, and optionally
+    a density tier), the sorted Z of the passing randoms are extracted once and memoised, such that
+    the cumulative count to any redshift is a searchsorted.  Built once per process and reused by every
+    vmaxer call.
+
+    Unless randoms are provided, the sorted index is also cached on disk (volavg_index) in a single pass 
+    over the randoms, reading only the required columns.  Later tiers and fields, i.e. other processes, 
+    read this cache, which is rebuilt only if any randoms file is newer.  Provided randoms are neither
+    memoised nor cached.
+    '''
+    key = (survey, ftype, dryrun, prefix, threshold)
+
+    if (rand is None) and (key in _volavg_indices):
+        return  _volavg_indices[key]
+
+    if rand is None:
+        fields  = fetch_fields(survey)
+        rpaths  = [findfile(ftype=ftype, dryrun=dryrun, field=ff, survey=survey, prefix=prefix) for ff in fields]
+        ipath   = findfile(ftype='volavg_index', dryrun=dryrun, field='GALL', survey=survey, prefix=prefix)
+
+        stale   = (not cache) or (not os.path.isfile(ipath))
+
+        if not stale:
+            stale = np.any([os.path.getmtime(rpath) > os.path.getmtime(ipath) for rpath in rpaths])
+
+        if not stale:
+            # Cache predating a change to the retained columns.
+            with fitsio.FITS(ipath) as ff:
+                stale = not np.all(np.isin(_volavg_cols, ff[1].get_colnames()))
 
-    fields      = fetch_fields(survey)
+        if not stale:
+            print(f'Reading volume average fillfactor index {ipath}')
 
-    rpaths      = [findfile(ftype=ftype, dryrun=dryrun, field=ff, survey=survey, prefix=prefix) for ff in fields]    
-    rand        = gather_cat(rpaths)
-    nrand       = len(rand)
+            rand  = Table(fitsio.read(ipath, ext=1, columns=_volavg_cols))
 
-    ## 
-    idx         = np.argsort(rand['Z']) 
-    sorted_rand = Table(rand, copy=True)[idx]
+        else:
+            for rpath in rpaths:
+                print(f'\tFetching {rpath}.')
+
+            rand  = vstack([read_desitable(rpath, columns=_volavg_cols) for rpath in rpaths], metadata_conflicts='silent')
+
+    else:
+        ipath   = None
+        stale   = False
+
+    print('\n\nBuilding volume average fillfactor index for {} randoms.'.format(len(rand)))
+
+    idx         = np.argsort(rand['Z'].data, kind='stable')
+
+    index       = {'NRAND': len(rand), 'THRESHOLD': threshold, 'ZS': {}, 'TABLES': {}}
+
+    for col in _volavg_cols:
+        index[col] = rand[col].data[idx]
 
     del rand
 
-    print('\n\nRandoms {:.6f} <= z <= {:.6f}'.format(sorted_rand['Z'].min(), sorted_rand['Z'].max()))
+    print('Randoms {:.6f} <= z <= {:.6f}'.format(index['Z'].min(), index['Z'].max()))
 
-    dbin        = 1.e-3
+    if stale and cache:
+        print(f'Writing volume average fillfactor index {ipath}')
 
-    zlo         = ddp_zlimits['DDP1'][0]
-    zhi         = ddp_zlimits['DDP1'][1]
+        result      = Table([index[col] for col in _volavg_cols], names=_volavg_cols)
+        result.meta = {'EXTNAME': 'VOLAVG_INDEX', 'NRAND': index['NRAND']}
 
-    bins        = np.arange(zlo, zhi + dbin, dbin)
-    idx         = np.digitize(sorted_rand['Z'], bins=bins)
+        # Other processes may read the cache meanwhile:  replace it whole.
+        tpath       = ipath + f'.{os.getpid()}.tmp'
+
+        result.write(tpath, format='fits', overwrite=True)
+
+        os.replace(tpath, ipath)
+
+    if ipath is not None:
+        _volavg_indices[key] = index
+
+    return  index
+
+def volavg_retier(index, edges):
+    '''
+    Copy of a volume average fillfactor index with the (self count) tiers redefined by 
+    delta8 tier edges, see delta8_limits.delta8_tier_edges.  Memoised on edges.
+    '''
+    key         = tuple(np.array(edges, dtype=float).tolist())
+
+    if 'RETIER' not in index:
+        index['RETIER'] = {}
+
+    if key not in index['RETIER']:
+        result  = {xx: index[xx] for xx in index if xx not in ['ZS', 'TABLES', 'RETIER']}
 
-    result      = []
+        result.update({'ZS': {}, 'TABLES': {}, 'EDGES': np.array(key)})
 
+        result['DDP1_DELTA8_TIER']           = delta8_tier_edges(index['DDP1_DELTA8'], edges)
+        result['DDP1_DELTA8_TIER_ZEROPOINT'] = delta8_tier_edges(index['DDP1_DELTA8_ZEROPOINT'], edges)
+
+        index['RETIER'][key] = result
+
+    return  index['RETIER'][key]
+
+def volavg_zs(index, tier=None, self_count=False):
+    '''
+    Sorted Z of the indexed randoms passing the fillfactor cut, and in the given (self count) tier.
+    '''
     if self_count:
-        tcol    = 'DDP1_DELTA8_TIER_ZEROPOINT' 
+        tcol    = 'DDP1_DELTA8_TIER_ZEROPOINT'
 
     else:
         tcol    = 'DDP1_DELTA8_TIER'
 
-    for i, bb in enumerate(bins):
-        sub      = idx <= i
-        vfrac    = 1. * np.count_nonzero(sub) / nrand
+    key         = (tcol, tier)
 
-        sub     &= (sorted_rand['FILLFACTOR'] > fillfactor_threshold)
+    if key not in index['ZS']:
+        sub     = index['FILLFACTOR'] > index['THRESHOLD']
 
         if tier != None:
-            sub &= (sorted_rand[tcol].data == tier)
+            sub &= (index[tcol] == tier)
+
+        # Z already sorted, as is any subset.
+        index['ZS'][key] = index['Z'][sub]
+
+    return  index['ZS'][key]
+
+def volavg_fraction(index, zmin, zmax, tier=None, self_count=False):
+    '''
+    Fraction of randoms with zmin < z < zmax that pass the fillfactor cut (in tier), vectorised 
+    over zmin and zmax.
+    '''
+    zmin        = np.atleast_1d(zmin)
+    zmax        = np.atleast_1d(zmax)
+
+    zs          = index['Z']
+    czs         = volavg_zs(index, tier=tier, self_count=self_count)
+
+    nall        = np.searchsorted(zs,  zmax, side='left') - np.searchsorted(zs,  zmin, side='right')
+    ncut        = np.searchsorted(czs, zmax, side='left') - np.searchsorted(czs, zmin, side='right')
+
+    # No randoms in (zmin, zmax), e.g. zmin == zmax:  no volume to correct. 
+    result      = np.zeros(len(nall), dtype=float)
+    isin        = nall > 0
+
+    result[isin] = ncut[isin] / nall[isin]
+
+    return  result
+
+def volavg_tables(index, dbin=1.e-3):
+    '''
+    Cumulative (in z) fractions of randoms, and of those passing the fillfactor cut, for all density 
+    tiers with and without self count in a single pass over the index.  Memoised on the index.  
+    '''
+    if dbin in index['TABLES']:
+        return  index['TABLES'][dbin]
+
+    nrand       = index['NRAND']
+    ntier       = len(d8_limits)
+
+    zlo         = ddp_zlimits['DDP1'][0]
+    zhi         = ddp_zlimits['DDP1'][1]
+
+    bins        = np.arange(zlo, zhi + dbin, dbin)
+    nbins       = len(bins)
+
+    # Bin i counts randoms with bins[i-1] <= z < bins[i]; cumulative sum is then z < bins[i].
+    zidx        = np.digitize(index['Z'], bins=bins)
+    keep        = zidx < nbins 
+
+    isin        = keep & (index['FILLFACTOR'] > index['THRESHOLD'])
+
+    result      = Table()
+    result['Z'] = bins + dbin/2.
+
+    result['RANDFRAC']            = np.cumsum(np.bincount(zidx[keep], minlength=nbins)) / nrand
+    result['RANDFRAC_FILLFACTOR'] = np.cumsum(np.bincount(zidx[isin], minlength=nbins)) / nrand
+
+    for tcol, name in zip(['DDP1_DELTA8_TIER', 'DDP1_DELTA8_TIER_ZEROPOINT'], ['', '_ZEROPOINT']):
+        tiers   = index[tcol]
+        valid   = isin & (tiers >= 0) & (tiers < ntier)
 
-        cfrac    = 1. * np.count_nonzero(sub) / nrand
+        counts  = np.bincount(tiers[valid] * nbins + zidx[valid], minlength=ntier * nbins).reshape(ntier, nbins)
+        counts  = np.cumsum(counts, axis=1) / nrand
 
-        midb     = bb + dbin/2.
+        for ut in range(ntier):
+            result[f'RANDFRAC_FILLFACTOR{name}_D{ut}'] = counts[ut]
 
-        result.append([midb, vfrac, cfrac])
+    index['TABLES'][dbin] = result
 
-    del sorted_rand
+    return  result
 
-    result      = np.array(result)
-    result      = Table(result, names=['Z', 'RANDFRAC', 'RANDFRAC_FILLFACTOR'])
+def volavg_fillfactor(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1', write=False, tier=None, pprint=False, self_count=False, index=None):
+    print(f'\n\nSolving volume average fillfactor with self_count: {self_count}.')
+
+    if index is None:
+        index   = volavg_index(survey=survey, ftype=ftype, dryrun=dryrun, prefix=prefix)
+
+    tables      = volavg_tables(index)
+
+    if tier == None:
+        ccol    = 'RANDFRAC_FILLFACTOR'
+
+    elif self_count:
+        ccol    = f'RANDFRAC_FILLFACTOR_ZEROPOINT_D{tier}'
+
+    else:
+        ccol    = f'RANDFRAC_FILLFACTOR_D{tier}'
+
+    result      = Table([tables['Z'], tables['RANDFRAC'], tables[ccol]], names=['Z', 'RANDFRAC', 'RANDFRAC_FILLFACTOR'])
     
     if pprint:
         result.pprint()
 
     if write:
-        opath   = findfile(ftype='volavg_fillfactor', dryrun=dryrun, field=field, survey=survey, prefix=prefix, utier=tier)
+        opath   = findfile(ftype='volavg_fillfactor', dryrun=dryrun, field='GALL', survey=survey, prefix=prefix, utier=tier)
         result.write(opath, format='fits', overwrite=True)
 
     vol_splint  = interp1d(result['Z'], result['RANDFRAC'], kind='linear', copy=True, bounds_error=False, fill_value=0.0, assume_sorted=False)
@@ -78,38 +240,23 @@ def volavg_fillfactor(survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, pr
 
     return  vol_splint, cut_splint
 
-def eval_volavg_fillfactor(dat, survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1', write=False, tier=None):
-    vol_splint, cut_splint           = volavg_fillfactor(survey=survey, ftype=ftype, dryrun=dryrun, prefix=prefix, write=write, tier=tier, self_count=False)
+def eval_volavg_fillfactor(dat, survey='gama', ftype='randoms_bd_ddp_n8', dryrun=False, prefix='randoms_ddp1', write=False, tier=None, index=None):
+    if index is None:
+        index    = volavg_index(survey=survey, ftype=ftype, dryrun=dryrun, prefix=prefix)
 
-    def _eval_volavg_fillfactor(zmax, zmin):
-        return (cut_splint(zmax) - cut_splint(zmin)) / (vol_splint(zmax) - vol_splint(zmin))
+    zmins        = np.array(dat['ZMIN'], copy=True)
+    zmaxs        = np.array(dat['ZMAX'], copy=True)
 
-    # Note: must match gen_ddp_cat.py; can distinguish per galaxy in a way renormalise_lf does not.
-    is_ddp1s = (dat['DDPMALL_0P0'] > tmr_DDP1[0]) & (dat['DDPMALL_0P0'] < tmr_DDP1[1])
+    result       = volavg_fraction(index, zmins, zmaxs, tier=tier, self_count=False)
 
-    if tier == None:
-        is_ddp1s = np.zeros(len(dat), dtype=bool)
-
-    else:
-        ddp1_vol_splint, ddp1_cut_splint = volavg_fillfactor(survey=survey, ftype=ftype, dryrun=dryrun, prefix=prefix, write=write, tier=tier, self_count=True)
-
-        def _eval_ddp1_volavg_fillfactor(zmax, zmin):
-            return (ddp1_cut_splint(zmax) - ddp1_cut_splint(zmin)) / (ddp1_vol_splint(zmax) - ddp1_vol_splint(zmin))
+    if tier != None:
+        # Note: must match gen_ddp_cat.py; can distinguish per galaxy in a way renormalise_lf does not.
+        is_ddp1  = (dat['DDPMALL_0P0'] > tmr_DDP1[0]) & (dat['DDPMALL_0P0'] < tmr_DDP1[1])
+        is_ddp1  = np.array(is_ddp1, dtype=bool)
 
+        result[is_ddp1] = volavg_fraction(index, zmins[is_ddp1], zmaxs[is_ddp1], tier=tier, self_count=True)
 
-    result   = []
-
-    for row, is_ddp1 in zip(dat, is_ddp1s):
-        if is_ddp1:
-            func = _eval_ddp1_volavg_fillfactor
-        else:
-            func = _eval_volavg_fillfactor
-
-        result.append(func(row['ZMAX'], row['ZMIN']))
-        
-    result = np.array(result)
-
-    return result
+    return  result
 
 def volfracs(rand, bitmasks=['IN_D8LUMFN']):
     '''
@@ -193,4 +340,6 @@ if __name__ == '__main__':
     rand  = Table.read('/cosma5/data/durham/dc-wils7/GAMA4/randoms/randoms_ddp1_bd_ddp_n8_GALL_0.fits')
     rand.pprint()
 
-    volavg_fillfactor(rand)
+    index = volavg_index(rand=rand)
+
+    volavg_fillfactor(index=index, pprint=True)